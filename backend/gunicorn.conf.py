@@ -0,0 +1,24 @@
+"""Gunicorn com workers uvicorn: um processo (event loop + pool) por worker.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+WEB_CONCURRENCY define o número de workers (padrão: núcleos da máquina) e
+é repassado aos workers, que dividem DB_CONNECTION_BUDGET entre si
+(ver main.py). No SIGTERM cada worker para de aceitar conexões, termina as
+requisições em andamento (até GRACEFUL_TIMEOUT) e roda o shutdown do
+lifespan, que fecha o pool.
+"""
+import multiprocessing
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+# proxies cujo X-Forwarded-For vira o IP do cliente (limite de taxa por IP)
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1,::1")
+accesslog = None
@@ -1,23 +1,188 @@
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, field_validator
 import os
+import asyncio
 import asyncpg
-from typing import Optional
+import base64
+import bisect
+import contextvars
+import csv
+import functools
+import hashlib
+import hmac
+import io
+import json
+import logging
+import math
+import multiprocessing
+import orjson
+import re
+import signal
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
 from passlib.hash import bcrypt_sha256
 from passlib.context import CryptContext
 
+logger = logging.getLogger("finpay")
+
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/finpay")
 pwd_context = CryptContext(schemes=['bcrypt_sha256'], deprecated='auto')
 
+# Pool de conexões
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "0")) or None
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+DB_POOL_CLOSE_TIMEOUT = float(os.getenv("DB_POOL_CLOSE_TIMEOUT", "10"))
+
+# Vários processos (gunicorn.conf.py): com DB_CONNECTION_BUDGET > 0, o teto
+# do pool de cada worker sai do orçamento global de conexões, descontada a
+# conexão de LISTEN que cada worker mantém fora do pool.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+if DB_CONNECTION_BUDGET > 0:
+    DB_POOL_MAX_SIZE = max(2, DB_CONNECTION_BUDGET // WEB_CONCURRENCY - 1)
+DB_POOL_MIN_SIZE = min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+
+# Invalidação de caches entre workers via LISTEN/NOTIFY
+NOTIFY_LISTENER = os.getenv("NOTIFY_LISTENER", "1") == "1"
+
+# Réplica de leitura (opcional): ver db_read()
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+DB_READ_POOL_MAX_SIZE = int(os.getenv("DB_READ_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+READ_YOUR_WRITES_CACHE_SIZE = int(os.getenv("READ_YOUR_WRITES_CACHE_SIZE", "100000"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "2"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "1"))
+
+# Auditoria: 'sync' grava direto em tb_auditoria; 'async' enfileira e o
+# drenador move em lotes (ver sql/11-auditoria-assincrona.sql)
+AUDIT_MODE = os.getenv("AUDIT_MODE", "sync")
+AUDIT_DRAIN_INTERVAL = float(os.getenv("AUDIT_DRAIN_INTERVAL", "1"))
+AUDIT_DRAIN_BATCH = int(os.getenv("AUDIT_DRAIN_BATCH", "5000"))
+
+# Contas quentes: créditos viram pendentes e são consolidados a cada
+# HOT_ACCOUNT_FOLD_INTERVAL segundos (ver sql/13-contas-quentes.sql)
+HOT_ACCOUNT_FOLD_INTERVAL = float(os.getenv("HOT_ACCOUNT_FOLD_INTERVAL", "1"))
+
+# Faturamento mensal: pagamentos entram como pendentes e são consolidados
+# a cada FATURAMENTO_FOLD_INTERVAL segundos (ver sql/19-faturamento-pendente.sql)
+FATURAMENTO_FOLD_INTERVAL = float(os.getenv("FATURAMENTO_FOLD_INTERVAL", "5"))
+
+# GET /me/dashboard: transações recentes e cache de ETag por usuário
+DASHBOARD_RECENT_TX = int(os.getenv("DASHBOARD_RECENT_TX", "10"))
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "100000"))
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "300"))
+
+# GET /accounts/{id}/events (SSE): fila por assinante, batida de vida e
+# folga de relógio na busca de transações novas
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "32"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "20"))
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "20000"))
+SSE_TX_LOOKBACK = float(os.getenv("SSE_TX_LOOKBACK", "10"))
+SSE_TX_MAX = int(os.getenv("SSE_TX_MAX", "20"))
+
+# Limite de taxa por chave (X-User-Id ou IP): regras "MÉTODO /rota=fichas_por_s/rajada",
+# com ":ip" para ignorar o X-User-Id; "*" vale para as demais rotas. Vazio desliga.
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS",
+    "POST /auth/login=2/10:ip,POST /auth/register=0.5/5:ip,POST /transfers=10/20,"
+    "POST /transfers/batch=1/5,POST /payments/batch=1/5,*=50/100",
+)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_EXEMPT = frozenset(
+    os.getenv("RATE_LIMIT_EXEMPT", "/health,/metrics,/stats/pool,/stats/caches").split(",")
+)
+# "postgres": baldes compartilhados entre workers (sql/18-limite-taxa.sql)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_CLEANUP_INTERVAL = float(os.getenv("RATE_LIMIT_CLEANUP_INTERVAL", "600"))
+
+# Importação em lote de usuários (POST /users/import, manage.py importar-usuarios).
+# Sem IMPORT_TOKEN o endpoint fica desligado.
+IMPORT_TOKEN = os.getenv("IMPORT_TOKEN", "")
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "20000"))
+IMPORT_HASH_PROCESSES = int(os.getenv("IMPORT_HASH_PROCESSES", "0")) or os.cpu_count() or 1
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Job de atraso de empréstimos (sql/16-atrasos.sql)
+ARREARS_JOB_INTERVAL = float(os.getenv("ARREARS_JOB_INTERVAL", "3600"))
+OVERDUE_PAGE_MAX = int(os.getenv("OVERDUE_PAGE_MAX", "500"))
+
 # IDs dos Comerciantes
 ALLOWED_UTILITY_MERCHANT_IDS = [11, 12, 13] 
 
+# Hash de senha (bcrypt) fora do event loop
+PWD_HASH_WORKERS = int(os.getenv("PWD_HASH_WORKERS", "4"))
+PWD_HASH_MAX_QUEUE = int(os.getenv("PWD_HASH_MAX_QUEUE", "64"))
+
+# Cache de resolução usuário -> conta
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "50000"))
+ACCOUNT_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "300"))
+
+# Cache de chaves Pix -> (id_conta, nome)
+PIX_CACHE_SIZE = int(os.getenv("PIX_CACHE_SIZE", "100000"))
+PIX_CACHE_TTL = float(os.getenv("PIX_CACHE_TTL", "60"))
+
+# Extrato
+STATEMENT_PAGE_MAX = int(os.getenv("STATEMENT_PAGE_MAX", "200"))
+TRANSACTION_TYPES = (
+    'payment', 'transfer', 'deposit', 'withdrawal',
+    'loan_disbursement', 'loan_repayment', 'fee',
+)
+
+# Lotes de pagamentos/transferências
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+
+# Grade de simulação de empréstimo
+LOAN_PRAZO_MAX = 60
+LOAN_GRID_MAX_PRINCIPAIS = int(os.getenv("LOAN_GRID_MAX_PRINCIPAIS", "24"))
+LOAN_GRID_CACHE_SIZE = int(os.getenv("LOAN_GRID_CACHE_SIZE", "4096"))
+
+# Idempotency-Key em endpoints que movimentam dinheiro
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "20000"))
+IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", "300"))
+IDEMPOTENCY_CLEANUP_BATCH = int(os.getenv("IDEMPOTENCY_CLEANUP_BATCH", "5000"))
+IDEMPOTENCY_KEY_MAX_LEN = 100
+
+# Exportação (CSV/NDJSON): linhas lidas do cursor por vez
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
+
+# Métricas (GET /metrics). METRICS_QUERIES liga o query logger do asyncpg;
+# SLOW_REQUEST_MS > 0 liga o log de requisições lentas com o plano das
+# consultas mais lentas ('plan' = EXPLAIN; 'analyze' = EXPLAIN ANALYZE
+# dentro de transação desfeita, mostra tempo de gatilhos — só em dev)
+METRICS_QUERIES = os.getenv("METRICS_QUERIES", "1") == "1"
+METRICS_MAX_STATEMENTS = int(os.getenv("METRICS_MAX_STATEMENTS", "500"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_EXPLAIN = os.getenv("SLOW_REQUEST_EXPLAIN", "plan")
+SLOW_REQUEST_MAX_PLANS = 3
+
+@asynccontextmanager
+async def lifespan(app):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
 app = FastAPI(
     title="POMENR API",
     version="1.5.0",
     docs_url="/api/docs",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 def _int_or_none(v):
@@ -26,7 +191,1351 @@ def _int_or_none(v):
     except Exception:
         return None
 
-# CORS
+# ---------- POOL ----------
+class Histogram:
+    """Histograma cumulativo de latência (segundos), no formato do Prometheus."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        acumulado = 0
+        buckets = {}
+        for le, n in zip(self.buckets, self.counts):
+            acumulado += n
+            buckets[str(le)] = acumulado
+        buckets["+Inf"] = self.count
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_pool_acquire_hist = Histogram(LATENCY_BUCKETS)
+_pool_waiters = 0
+_pool_acquire_timeouts = 0
+
+async def create_db_pool(dsn: str = DATABASE_URL, max_size: int = DB_POOL_MAX_SIZE):
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=min(DB_POOL_MIN_SIZE, max_size),
+        max_size=max_size,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        server_settings={"finpay.auditoria": AUDIT_MODE},
+        init=_init_connection,
+    )
+
+async def _init_connection(con):
+    if METRICS_QUERIES:
+        con.add_query_logger(_registrar_query)
+
+async def get_pool():
+    # criado uma única vez no lifespan
+    return app.state.pool
+
+@asynccontextmanager
+async def db_acquire(pool=None):
+    """Conexão do pool (padrão: primário) com timeout de acquire e medição da espera."""
+    global _pool_waiters, _pool_acquire_timeouts
+    if pool is None:
+        pool = await get_pool()
+    _pool_waiters += 1
+    t0 = time.perf_counter()
+    try:
+        con = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _pool_acquire_timeouts += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Banco de dados ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"},
+        )
+    finally:
+        _pool_waiters -= 1
+        espera = time.perf_counter() - t0
+        _pool_acquire_hist.observe(espera)
+        req = _req_timing.get()
+        if req is not None:
+            req.pool_wait += espera
+    try:
+        yield con
+    finally:
+        await pool.release(con)
+
+async def _fechar_pool(pool):
+    try:
+        # espera as requisições em andamento devolverem as conexões
+        await asyncio.wait_for(pool.close(), DB_POOL_CLOSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("pool não fechou em %ss; encerrando conexões", DB_POOL_CLOSE_TIMEOUT)
+        pool.terminate()
+
+def pool_stats() -> dict:
+    pool = app.state.pool
+    tamanho = pool.get_size()
+    ociosas = pool.get_idle_size()
+    leitura = None
+    if app.state.read_pool is not None:
+        leitura = {
+            "max_size": app.state.read_pool.get_max_size(),
+            "size": app.state.read_pool.get_size(),
+            "idle": app.state.read_pool.get_idle_size(),
+            "replica_lag_s": _replica_lag,
+            "rotas": {f"{d}:{m}": n for (d, m), n in _leituras.items()},
+        }
+    return {
+        "worker_pid": os.getpid(),
+        "workers": WEB_CONCURRENCY,
+        "connection_budget": DB_CONNECTION_BUDGET or None,
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": tamanho,
+        "idle": ociosas,
+        "in_use": tamanho - ociosas,
+        "waiters": _pool_waiters,
+        "acquire_timeouts": _pool_acquire_timeouts,
+        "acquire_seconds": _pool_acquire_hist.snapshot(),
+        "leitura": leitura,
+    }
+
+# ---------- LIMITE DE TAXA ----------
+# Token bucket por (regra, chave) em memória: O(1) por requisição, LRU
+# limitado a RATE_LIMIT_MAX_KEYS. Um balde parado tempo suficiente para
+# encher de novo é igual a um balde novo, então sai da memória. Com
+# RATE_LIMIT_BACKEND=postgres, quem passa no balde local ainda consulta o
+# balde compartilhado (uma ida ao banco; se o banco falhar, libera).
+class TokenBuckets:
+    """Baldes de fichas por chave; take() devolve 0 ou os segundos até a próxima ficha."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._baldes = OrderedDict()
+
+    def take(self, chave, taxa: float, rajada: float) -> float:
+        agora = time.monotonic()
+        balde = self._baldes.get(chave)
+        if balde is None:
+            balde = self._baldes[chave] = [rajada, agora, rajada / taxa]
+        else:
+            balde[0] = min(rajada, balde[0] + (agora - balde[1]) * taxa)
+            balde[1] = agora
+            self._baldes.move_to_end(chave)
+        espera = 0.0
+        if balde[0] >= 1:
+            balde[0] -= 1
+        else:
+            espera = (1 - balde[0]) / taxa
+        self._expirar(agora)
+        return espera
+
+    def _expirar(self, agora: float):
+        # até duas remoções por chamada: O(1) amortizado e nunca passa de maxsize
+        for _ in range(2):
+            if not self._baldes:
+                return
+            chave, (_, ultimo, cheio_em) = next(iter(self._baldes.items()))
+            if len(self._baldes) <= self.maxsize and agora - ultimo < cheio_em:
+                return
+            del self._baldes[chave]
+
+    def __len__(self):
+        return len(self._baldes)
+
+def _parse_rate_limits(texto: str):
+    """(regras exatas por (método, path), regras com {parâmetro}, regra padrão)."""
+    exatas, padroes, padrao = {}, [], None
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        rota, _, limite = parte.rpartition("=")
+        limite, _, por = limite.partition(":")
+        taxa, _, rajada = limite.partition("/")
+        regra = (rota, float(taxa), float(rajada or taxa), por == "ip")
+        if regra[1] <= 0 or regra[2] < 1:
+            # taxa 0 dividiria por zero no balde; rajada < 1 nunca libera nada
+            raise ValueError(f"RATE_LIMITS: taxa deve ser > 0 e rajada >= 1 em {parte!r}")
+        if rota == "*":
+            padrao = regra
+            continue
+        metodo, _, caminho = rota.partition(" ")
+        if "{" in caminho:
+            padroes.append((metodo, re.compile("^" + re.sub(r"\{[^/]+\}", "[^/]+", caminho) + "$"), regra))
+        else:
+            exatas[(metodo, caminho)] = regra
+    return exatas, padroes, padrao
+
+_limites_exatos, _limites_padroes, _limite_padrao = _parse_rate_limits(RATE_LIMITS)
+_baldes = TokenBuckets(RATE_LIMIT_MAX_KEYS)
+_limitados = {}
+
+def _regra_limite(metodo: str, caminho: str):
+    regra = _limites_exatos.get((metodo, caminho))
+    if regra is not None:
+        return regra
+    for m, padrao, regra in _limites_padroes:
+        if m == metodo and padrao.match(caminho):
+            return regra
+    return _limite_padrao
+
+async def _limite_compartilhado(chave: str, taxa: float, rajada: float) -> float:
+    try:
+        async with db_acquire() as con:
+            return await con.fetchval("SELECT fn_limite_taxa($1, $2, $3)", chave, taxa, rajada)
+    except Exception:
+        logger.exception("limite de taxa no banco falhou; liberando %s", chave)
+        return 0.0
+
+async def cleanup_rate_limits(con) -> int:
+    """Apaga baldes compartilhados parados há mais de uma hora."""
+    status = await con.execute(
+        "DELETE FROM tb_limite_taxa WHERE atualizado_em < now() - interval '1 hour'"
+    )
+    return int(status.split()[-1])
+
+class RateLimitMiddleware:
+    """429 com Retry-After quando o balde da chave (X-User-Id ou IP) esvazia."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in RATE_LIMIT_EXEMPT:
+            return await self.app(scope, receive, send)
+        regra = _regra_limite(scope["method"], scope["path"])
+        if regra is None:
+            return await self.app(scope, receive, send)
+        nome, taxa, rajada, por_ip = regra
+        quem = None
+        if not por_ip:
+            for k, v in scope["headers"]:
+                if k == b"x-user-id":
+                    quem = "u:" + v.decode("latin-1")
+                    break
+        if quem is None:
+            # atrás do nginx o uvicorn já troca o cliente pelo X-Forwarded-For
+            # (FORWARDED_ALLOW_IPS no gunicorn.conf.py)
+            cliente = scope.get("client")
+            quem = "ip:" + (cliente[0] if cliente else "?")
+        espera = _baldes.take((nome, quem), taxa, rajada)
+        if not espera and RATE_LIMIT_BACKEND == "postgres":
+            espera = await _limite_compartilhado(f"{nome}|{quem}", taxa, rajada)
+        if not espera:
+            return await self.app(scope, receive, send)
+
+        _limitados[(nome,)] = _limitados.get((nome,), 0) + 1
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(max(1, math.ceil(espera))).encode()),
+            ],
+        })
+        await send({
+            "type": "http.response.body",
+            "body": orjson.dumps({"detail": "Muitas requisições, tente novamente em instantes"}),
+        })
+
+if _limites_exatos or _limites_padroes or _limite_padrao:
+    # registrado antes do MetricsMiddleware, que fica por fora e conta os 429
+    app.add_middleware(RateLimitMiddleware)
+
+# ---------- MÉTRICAS ----------
+# Tudo em memória do processo, O(1) por requisição/consulta. Rótulos de rota
+# usam o template ("/accounts/{id_conta}"), nunca o path cru.
+_route_hist = {}
+_http_errors = {}
+_stmt_hist = {}
+_STMT_OUTROS = "outros"
+_req_timing = contextvars.ContextVar("finpay_req_timing", default=None)
+_slow_tasks = set()
+
+class _RequestTiming:
+    """Tempo de pool e SQL de uma requisição (só com SLOW_REQUEST_MS > 0)."""
+    __slots__ = ("pool_wait", "sql", "queries")
+
+    def __init__(self):
+        self.pool_wait = 0.0
+        self.sql = 0.0
+        self.queries = []
+
+def _registrar_query(registro):
+    # chamado pelo asyncpg (call_soon) no contexto da requisição
+    query = registro.query
+    hist = _stmt_hist.get(query)
+    if hist is None:
+        if len(_stmt_hist) >= METRICS_MAX_STATEMENTS:
+            query = _STMT_OUTROS
+        hist = _stmt_hist.setdefault(query, Histogram(LATENCY_BUCKETS))
+    hist.observe(registro.elapsed)
+    req = _req_timing.get()
+    if req is not None:
+        req.sql += registro.elapsed
+        req.queries.append((registro.elapsed, registro.query, registro.args))
+
+class MetricsMiddleware:
+    """ASGI puro (sem BaseHTTPMiddleware) para não custar uma task por requisição."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        continua = False
+
+        async def _send(mensagem):
+            nonlocal status, continua
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                continua = any(k == b"content-type" and v.startswith(b"text/event-stream")
+                               for k, v in mensagem.get("headers", ()))
+            await send(mensagem)
+
+        req = _RequestTiming() if SLOW_REQUEST_MS > 0 else None
+        token = _req_timing.set(req)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            duracao = time.perf_counter() - t0
+            _req_timing.reset(token)
+            # stream SSE dura o quanto o cliente ficar conectado: fica de fora
+            # da latência e do log de lentas (ver finpay_sse_*)
+            if not continua:
+                self._observar(scope, status, duracao, req)
+
+    @staticmethod
+    def _observar(scope, status, duracao, req):
+        rota = getattr(scope.get("route"), "path", "nao_mapeada")
+        chave = (scope["method"], rota)
+        hist = _route_hist.get(chave)
+        if hist is None:
+            hist = _route_hist.setdefault(chave, Histogram(LATENCY_BUCKETS))
+        hist.observe(duracao)
+        if status >= 400:
+            chave_erro = chave + (status,)
+            _http_errors[chave_erro] = _http_errors.get(chave_erro, 0) + 1
+        if req is not None and duracao * 1000 >= SLOW_REQUEST_MS:
+            tarefa = asyncio.create_task(_log_slow_request(chave, status, duracao, req))
+            _slow_tasks.add(tarefa)
+            tarefa.add_done_callback(_slow_tasks.discard)
+
+app.add_middleware(MetricsMiddleware)
+
+_EXPLICAVEL = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+
+async def _explain(query, args):
+    async with db_acquire() as con:
+        if SLOW_REQUEST_EXPLAIN == "analyze":
+            tr = con.transaction()
+            await tr.start()
+            try:
+                rows = await con.fetch("EXPLAIN (ANALYZE, BUFFERS) " + query, *args)
+            finally:
+                await tr.rollback()
+        else:
+            rows = await con.fetch("EXPLAIN " + query, *args)
+    return "\n".join(r[0] for r in rows)
+
+async def _log_slow_request(chave, status, duracao, req):
+    lentas = sorted(req.queries, key=lambda q: q[0], reverse=True)[:SLOW_REQUEST_MAX_PLANS]
+    consultas = []
+    for elapsed, query, args in lentas:
+        item = {"ms": round(elapsed * 1000, 2), "sql": " ".join(query.split())}
+        if _EXPLICAVEL.match(query):
+            try:
+                item["plano"] = await _explain(query, args or ())
+            except Exception as e:
+                item["plano_erro"] = str(e)
+        consultas.append(item)
+    logger.warning("requisição lenta %s", json.dumps({
+        "metodo": chave[0],
+        "rota": chave[1],
+        "status": status,
+        "total_ms": round(duracao * 1000, 2),
+        "pool_ms": round(req.pool_wait * 1000, 2),
+        "sql_ms": round(req.sql * 1000, 2),
+        "python_ms": round((duracao - req.pool_wait - req.sql) * 1000, 2),
+        "consultas": consultas,
+    }, ensure_ascii=False, default=str))
+
+def _label(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(nomes, valores) -> str:
+    return ",".join(f'{n}="{_label(v)}"' for n, v in zip(nomes, valores))
+
+def _prom_histogram(linhas, nome, ajuda, series, nomes_labels):
+    linhas.append(f"# HELP {nome} {ajuda}")
+    linhas.append(f"# TYPE {nome} histogram")
+    for valores, hist in list(series.items()):
+        base = _labels(nomes_labels, valores)
+        sep = "," if base else ""
+        sufixo = f"{{{base}}}" if base else ""
+        snap = hist.snapshot()
+        for le, n in snap["buckets"].items():
+            linhas.append(f'{nome}_bucket{{{base}{sep}le="{le}"}} {n}')
+        linhas.append(f"{nome}_sum{sufixo} {snap['sum']}")
+        linhas.append(f"{nome}_count{sufixo} {snap['count']}")
+
+def _prom_simples(linhas, nome, tipo, ajuda, series, nomes_labels=()):
+    linhas.append(f"# HELP {nome} {ajuda}")
+    linhas.append(f"# TYPE {nome} {tipo}")
+    for valores, v in list(series.items()):
+        base = _labels(nomes_labels, valores)
+        linhas.append(f"{nome}{{{base}}} {v}" if base else f"{nome} {v}")
+
+def render_metrics() -> str:
+    linhas = []
+    _prom_histogram(linhas, "finpay_http_request_duration_seconds",
+                    "Latência por rota (template)", _route_hist, ("method", "route"))
+    _prom_simples(linhas, "finpay_http_errors_total", "counter",
+                  "Respostas 4xx/5xx por rota e status", _http_errors, ("method", "route", "status"))
+    _prom_histogram(linhas, "finpay_db_query_duration_seconds",
+                    "Tempo por comando SQL (texto normalizado)",
+                    {(" ".join(q.split()),): h for q, h in _stmt_hist.items()}, ("statement",))
+    _prom_histogram(linhas, "finpay_db_pool_acquire_seconds",
+                    "Espera por conexão do pool", {(): _pool_acquire_hist}, ())
+    pool = getattr(app.state, "pool", None)
+    if pool is not None:
+        tamanho = pool.get_size()
+        _prom_simples(linhas, "finpay_db_pool_connections", "gauge", "Conexões do pool por estado",
+                      {("idle",): pool.get_idle_size(), ("in_use",): tamanho - pool.get_idle_size()},
+                      ("state",))
+    _prom_simples(linhas, "finpay_db_pool_waiters", "gauge", "Requisições esperando conexão",
+                  {(): _pool_waiters})
+    _prom_simples(linhas, "finpay_db_pool_acquire_timeouts_total", "counter",
+                  "Acquires que estouraram DB_ACQUIRE_TIMEOUT", {(): _pool_acquire_timeouts})
+    if DATABASE_READ_URL:
+        _prom_simples(linhas, "finpay_db_read_route_total", "counter",
+                      "Leituras por destino e motivo", _leituras, ("destino", "motivo"))
+        if _replica_lag is not None:
+            _prom_simples(linhas, "finpay_db_replica_lag_seconds", "gauge",
+                          "Atraso de replay da réplica", {(): _replica_lag})
+    _prom_simples(linhas, "finpay_rate_limited_total", "counter", "Respostas 429 por regra",
+                  _limitados, ("rule",))
+    _prom_simples(linhas, "finpay_rate_limit_buckets", "gauge", "Baldes de limite de taxa em memória",
+                  {(): len(_baldes)})
+    _prom_simples(linhas, "finpay_sse_subscribers", "gauge", "Conexões SSE abertas neste worker",
+                  {(): _sse_assinantes})
+    _prom_simples(linhas, "finpay_sse_accounts", "gauge", "Contas com assinantes SSE", {(): len(_canais)})
+    _prom_simples(linhas, "finpay_sse_events_total", "counter", "Quadros SSE enfileirados",
+                  {(): _sse_eventos})
+    _prom_simples(linhas, "finpay_sse_dropped_total", "counter",
+                  "Assinaturas encerradas por fila cheia", {(): _sse_descartados})
+    caches = {"contas": _conta_cache, "pix": _pix_cache, "idempotencia": _idem_cache}
+    _prom_simples(linhas, "finpay_cache_hits_total", "counter", "Acertos de cache",
+                  {(n,): c.hits for n, c in caches.items()}, ("cache",))
+    _prom_simples(linhas, "finpay_cache_misses_total", "counter", "Faltas de cache",
+                  {(n,): c.misses for n, c in caches.items()}, ("cache",))
+    return "\n".join(linhas) + "\n"
+
+# ---------- SENHAS ----------
+# bcrypt leva ~100-300 ms por chamada; rodar isso direto num handler async
+# trava o event loop inteiro. O bcrypt libera o GIL, então um pool de threads
+# limitado basta. Pedidos além de workers + fila são recusados na hora (503)
+# em vez de acumular latência para todo mundo.
+_pwd_executor = ThreadPoolExecutor(max_workers=PWD_HASH_WORKERS, thread_name_prefix="pwd")
+_pwd_inflight = 0
+
+async def _run_pwd(fn, *args):
+    global _pwd_inflight
+    if _pwd_inflight >= PWD_HASH_WORKERS + PWD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"},
+        )
+    _pwd_inflight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pwd_executor, fn, *args)
+    finally:
+        _pwd_inflight -= 1
+
+def _verify_sync(senha: str, senha_hash: str) -> bool:
+    try:
+        return bcrypt_sha256.verify(senha, senha_hash)
+    except ValueError:
+        # hash vazio ou em formato desconhecido
+        return False
+
+async def hash_password(senha: str) -> str:
+    return await _run_pwd(bcrypt_sha256.hash, senha)
+
+async def verify_password(senha: str, senha_hash: str) -> bool:
+    return await _run_pwd(_verify_sync, senha, senha_hash)
+
+# ---------- IMPORTAÇÃO DE USUÁRIOS ----------
+# CSV (com cabeçalho) ou NDJSON, um usuário por linha. Por lote de
+# IMPORT_BATCH_SIZE linhas: senhas em texto passam pelo bcrypt num pool de
+# processos; senha_hash já em bcrypt_sha256 passa direto, e é o caminho
+# para dezenas de milhares de usuários por segundo (o bcrypt sozinho não
+# passa de algumas dezenas por núcleo). Depois, COPY para uma tabela
+# temporária e merge em tb_usuario/tb_conta numa transação, com erro por
+# linha para email/documento repetidos no arquivo ou já cadastrados.
+_IMPORT_COLUNAS = ("linha", "nome", "email", "telefone", "doc_cpf_cnpj", "senha_hash",
+                   "tipo_pessoa", "salario_mensal_cents")
+_IMPORT_LIMITES = {"nome": 120, "email": 120, "telefone": 20, "doc_cpf_cnpj": 20}
+_IMPORT_MAX_REGISTRO = 64 * 1024
+_import_executor = None
+
+_SQL_IMPORT_STAGING = """
+    CREATE TEMP TABLE tmp_importacao (
+        linha INT PRIMARY KEY, nome TEXT, email TEXT, telefone TEXT, doc_cpf_cnpj TEXT,
+        senha_hash TEXT, tipo_pessoa TEXT, salario_mensal_cents BIGINT,
+        id_usuario BIGINT, erro TEXT
+    ) ON COMMIT DROP
+"""
+
+_SQL_IMPORT_MERGE = """
+    ANALYZE tmp_importacao;
+
+    UPDATE tmp_importacao t SET erro = 'email repetido no arquivo'
+    FROM (SELECT linha, row_number() OVER (PARTITION BY email ORDER BY linha) AS n FROM tmp_importacao) d
+    WHERE d.linha = t.linha AND d.n > 1;
+
+    UPDATE tmp_importacao t SET erro = 'doc_cpf_cnpj repetido no arquivo'
+    FROM (SELECT linha, row_number() OVER (PARTITION BY doc_cpf_cnpj ORDER BY linha) AS n FROM tmp_importacao) d
+    WHERE d.linha = t.linha AND d.n > 1 AND t.erro IS NULL;
+
+    UPDATE tmp_importacao t SET erro = 'email já cadastrado'
+    FROM tb_usuario u WHERE u.email = t.email AND t.erro IS NULL;
+
+    UPDATE tmp_importacao t SET erro = 'doc_cpf_cnpj já cadastrado'
+    FROM tb_usuario u WHERE u.doc_cpf_cnpj = t.doc_cpf_cnpj AND t.erro IS NULL;
+
+    -- ON CONFLICT cobre cadastros feitos entre as checagens acima e o INSERT
+    WITH novos AS (
+        INSERT INTO tb_usuario (nome, email, telefone, doc_cpf_cnpj, senha_hash, tipo_pessoa)
+        SELECT nome, email, telefone, doc_cpf_cnpj, senha_hash, tipo_pessoa
+        FROM tmp_importacao WHERE erro IS NULL ORDER BY linha
+        ON CONFLICT DO NOTHING
+        RETURNING id_usuario, doc_cpf_cnpj
+    )
+    UPDATE tmp_importacao t SET id_usuario = n.id_usuario
+    FROM novos n WHERE n.doc_cpf_cnpj = t.doc_cpf_cnpj AND t.erro IS NULL;
+
+    UPDATE tmp_importacao SET erro = 'email ou doc_cpf_cnpj cadastrado durante a importação'
+    WHERE erro IS NULL AND id_usuario IS NULL;
+
+    INSERT INTO tb_conta (id_usuario, numero_conta, agencia, saldo_cents, salario_mensal_cents)
+    SELECT id_usuario, to_char(id_usuario, 'FM00000000'), '0001', 0, salario_mensal_cents
+    FROM tmp_importacao WHERE id_usuario IS NOT NULL ORDER BY linha;
+"""
+
+def _hash_senhas(senhas: list) -> list:
+    return [bcrypt_sha256.hash(s) for s in senhas]
+
+def _import_pool() -> ProcessPoolExecutor:
+    global _import_executor
+    if _import_executor is None:
+        # spawn: o worker já tem event loop e threads, que o fork copiaria pela metade
+        _import_executor = ProcessPoolExecutor(
+            IMPORT_HASH_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _import_executor
+
+def shutdown_import_pool():
+    global _import_executor
+    if _import_executor is not None:
+        _import_executor.shutdown(wait=False, cancel_futures=True)
+        _import_executor = None
+
+async def _linhas(chunks):
+    """Linhas (bytes, sem o \\n) de um stream de pedaços."""
+    resto = b""
+    async for chunk in chunks:
+        resto += chunk
+        *linhas, resto = resto.split(b"\n")
+        for linha in linhas:
+            yield linha
+    if resto:
+        yield resto
+
+async def _registros(linhas, formato: str):
+    """(número da linha no arquivo, registro, erro) para cada registro não vazio.
+
+    No NDJSON cada linha é um registro; no CSV um campo entre aspas pode ter
+    quebras de linha, então as linhas se juntam até as aspas fecharem e o
+    registro leva o número da primeira.
+    """
+    cabecalho = None
+    partes, aspas, inicio = [], 0, 0
+    n = 0
+    async for bruta in linhas:
+        n += 1
+        try:
+            if formato == "ndjson":
+                if not bruta.strip():
+                    continue
+                registro = orjson.loads(bruta)
+                if not isinstance(registro, dict):
+                    raise ValueError("esperado um objeto JSON")
+            else:
+                texto = bruta.decode("utf-8-sig" if n == 1 else "utf-8")
+                if not partes:
+                    texto = texto.rstrip("\r")
+                    if not texto.strip():
+                        continue
+                    inicio = n
+                partes.append(texto)
+                aspas += texto.count('"')
+                if aspas % 2:
+                    if sum(map(len, partes)) <= _IMPORT_MAX_REGISTRO:
+                        continue
+                    partes, aspas = [], 0
+                    raise ValueError(f"aspas sem fechar (registro com mais de {_IMPORT_MAX_REGISTRO} bytes)")
+                partes[-1] = partes[-1].rstrip("\r")
+                campos = next(csv.reader(["\n".join(partes)]))
+                partes, aspas = [], 0
+                if cabecalho is None:
+                    cabecalho = [c.strip().lower() for c in campos]
+                    continue
+                registro = dict(zip(cabecalho, campos))
+        except (ValueError, csv.Error) as e:
+            partes, aspas = [], 0
+            yield (inicio if formato == "csv" else n), None, f"linha ilegível: {e}"
+            continue
+        yield (inicio if formato == "csv" else n), registro, None
+    if partes:
+        yield inicio, None, "linha ilegível: aspas sem fechar no fim do arquivo"
+
+def _validar_importacao(registro: dict):
+    """(valores na ordem de _IMPORT_COLUNAS sem a linha, + senha em texto) ou erro."""
+    v = {k: str(registro.get(k) or "").strip() for k in _IMPORT_LIMITES}
+    if not (v["nome"] and v["email"] and v["doc_cpf_cnpj"]):
+        return None, "nome, email e doc_cpf_cnpj são obrigatórios"
+    for campo, limite in _IMPORT_LIMITES.items():
+        if len(v[campo]) > limite:
+            return None, f"{campo} excede {limite} caracteres"
+    tipo = str(registro.get("tipo_pessoa") or "PF").strip().upper()
+    if tipo not in ("PF", "PJ"):
+        return None, "tipo_pessoa deve ser PF ou PJ"
+    salario = _int_or_none(registro.get("salario_mensal_cents") or 0)
+    if salario is None or salario < 0:
+        return None, "salario_mensal_cents inválido"
+    senha_hash = registro.get("senha_hash") or None
+    senha = registro.get("senha") or None
+    if not isinstance(senha_hash, (str, type(None))) or not isinstance(senha, (str, type(None))):
+        return None, "senha e senha_hash devem ser texto"
+    if senha_hash is not None:
+        if not bcrypt_sha256.identify(senha_hash):
+            return None, "senha_hash não está em bcrypt_sha256"
+    elif senha is None:
+        return None, "senha ou senha_hash obrigatório"
+    return [v["nome"], v["email"], v["telefone"] or None, v["doc_cpf_cnpj"], senha_hash, tipo, salario,
+            senha], None
+
+async def _hash_lote(sem_hash: list, falhou) -> set:
+    """Preenche senha_hash dos itens; devolve as linhas cujo hash falhou."""
+    pedaco = -(-len(sem_hash) // (IMPORT_HASH_PROCESSES * 4))
+    partes = [sem_hash[i:i + pedaco] for i in range(0, len(sem_hash), pedaco)]
+    loop = asyncio.get_running_loop()
+    hashes = await asyncio.gather(
+        *(loop.run_in_executor(_import_pool(), _hash_senhas, [item[8] for item in parte]) for parte in partes),
+        return_exceptions=True,
+    )
+    if any(isinstance(r, BrokenProcessPool) for r in hashes):
+        shutdown_import_pool()  # o próximo lote sobe um pool novo
+    perdidas = set()
+    for parte, resultado in zip(partes, hashes):
+        if isinstance(resultado, BaseException):
+            # pool quebrado ou senha que o bcrypt recusa: só este pedaço falha
+            logger.error("hash de %d senhas da importação falhou: %r", len(parte), resultado)
+            for item in parte:
+                falhou(item[0], "não foi possível gerar o hash da senha")
+                perdidas.add(item[0])
+            continue
+        for item, senha_hash in zip(parte, resultado):
+            item[5] = senha_hash
+    return perdidas
+
+async def _importar_lote(conectar, lote: list, falhou) -> int:
+    sem_hash = [item for item in lote if item[5] is None]
+    if sem_hash:
+        perdidas = await _hash_lote(sem_hash, falhou)
+        if perdidas:
+            lote = [item for item in lote if item[0] not in perdidas]
+            if not lote:
+                return 0
+    try:
+        async with conectar() as con:
+            async with con.transaction():
+                await con.execute(_SQL_IMPORT_STAGING)
+                await con.copy_records_to_table(
+                    "tmp_importacao", records=[item[:8] for item in lote], columns=_IMPORT_COLUNAS
+                )
+                await con.execute(_SQL_IMPORT_MERGE)
+                erros = await con.fetch(
+                    "SELECT linha, erro FROM tmp_importacao WHERE erro IS NOT NULL ORDER BY linha"
+                )
+    except asyncpg.PostgresError as e:
+        # o lote inteiro voltou atrás: cada linha dele sai como falha
+        logger.exception("lote de importação com %d linhas falhou", len(lote))
+        for item in lote:
+            falhou(item[0], f"lote rejeitado pelo banco: {e}")
+        return 0
+    for r in erros:
+        falhou(r["linha"], r["erro"])
+    return len(lote) - len(erros)
+
+async def import_users(conectar, linhas, formato: str = "csv", lote: int = IMPORT_BATCH_SIZE) -> dict:
+    """Importa usuários (e uma conta para cada) de linhas CSV/NDJSON.
+
+    conectar() deve devolver um async context manager com uma conexão (ex.:
+    db_acquire); a conexão só é usada durante o COPY e o merge de cada lote.
+    """
+    resultado = {"importados": 0, "falhas": 0, "erros": []}
+
+    def falhou(linha, erro):
+        resultado["falhas"] += 1
+        if len(resultado["erros"]) < IMPORT_MAX_ERRORS:
+            resultado["erros"].append({"linha": linha, "erro": erro})
+
+    pendentes = []
+    async for n, registro, erro in _registros(linhas, formato):
+        valores = None
+        if erro is None:
+            valores, erro = _validar_importacao(registro)
+        if erro is not None:
+            falhou(n, erro)
+            continue
+        pendentes.append([n] + valores)
+        if len(pendentes) >= lote:
+            resultado["importados"] += await _importar_lote(conectar, pendentes, falhou)
+            pendentes = []
+    if pendentes:
+        resultado["importados"] += await _importar_lote(conectar, pendentes, falhou)
+    resultado["erros"].sort(key=lambda e: e["linha"])
+    return resultado
+
+# ---------- CACHES ----------
+class TTLCache:
+    """LRU limitado por tamanho, com expiração por TTL e contadores de hit/miss."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expira, value = item
+        if expira < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+_conta_cache = TTLCache(ACCOUNT_CACHE_SIZE, ACCOUNT_CACHE_TTL)
+
+async def resolve_conta(con, id_usuario: int):
+    """Conta (id_conta, salario_mensal_cents) do usuário, via cache.
+
+    Só resultados positivos entram no cache; a criação de conta invalida a
+    entrada do usuário.
+    """
+    conta = _conta_cache.get(id_usuario)
+    if conta is None:
+        conta = await con.fetchrow(
+            "SELECT id_conta, salario_mensal_cents FROM tb_conta WHERE id_usuario=$1",
+            id_usuario,
+        )
+        if conta is not None:
+            _conta_cache.set(id_usuario, conta)
+    return conta
+
+def invalidate_conta(id_usuario: int):
+    _conta_cache.invalidate(id_usuario)
+
+# ---------- CHAVES PIX ----------
+# Cada tipo de chave vai direto para uma consulta com índice; nada de
+# "doc = $1 OR id_conta::text = $1", que força seq scan no join.
+_pix_cache = TTLCache(PIX_CACHE_SIZE, PIX_CACHE_TTL)
+_PIX_PONTUACAO = re.compile(r"[.\-/\s]")
+
+_PIX_SQL_DOC = """
+    SELECT c.id_conta, u.nome
+    FROM tb_usuario u JOIN tb_conta c ON c.id_usuario = u.id_usuario
+    WHERE u.doc_cpf_cnpj = $1
+    ORDER BY c.id_conta
+    LIMIT 1
+"""
+_PIX_SQL_EMAIL = """
+    SELECT c.id_conta, u.nome
+    FROM tb_usuario u JOIN tb_conta c ON c.id_usuario = u.id_usuario
+    WHERE u.email = $1
+    ORDER BY c.id_conta
+    LIMIT 1
+"""
+_PIX_SQL_TELEFONE = """
+    SELECT c.id_conta, u.nome
+    FROM tb_usuario u JOIN tb_conta c ON c.id_usuario = u.id_usuario
+    WHERE u.telefone = $1
+    ORDER BY c.id_conta
+    LIMIT 1
+"""
+_PIX_SQL_CONTA = """
+    SELECT c.id_conta, u.nome
+    FROM tb_conta c JOIN tb_usuario u ON u.id_usuario = c.id_usuario
+    WHERE c.id_conta = $1
+"""
+
+def classify_pix_key(identificador: str) -> str:
+    """'email', 'telefone', 'cpf', 'cnpj', 'conta' ou 'doc' (documento livre)."""
+    s = identificador.strip()
+    if "@" in s:
+        return "email"
+    if s.startswith("+"):
+        return "telefone"
+    digitos = _PIX_PONTUACAO.sub("", s)
+    if digitos.isdigit():
+        if len(digitos) == 11:
+            return "cpf"
+        if len(digitos) == 14:
+            return "cnpj"
+        if len(digitos) <= 18:
+            return "conta"
+    return "doc"
+
+async def resolve_pix_key(con, identificador: str):
+    """(id_conta, nome) do titular da chave, ou None."""
+    chave = identificador.strip()
+    destino = _pix_cache.get(chave)
+    if destino is not None:
+        return destino
+
+    tipo = classify_pix_key(chave)
+    if tipo == "email":
+        row = await con.fetchrow(_PIX_SQL_EMAIL, chave)
+    elif tipo == "telefone":
+        row = await con.fetchrow(_PIX_SQL_TELEFONE, chave)
+    elif tipo == "conta":
+        # números curtos são id de conta, mas documentos fora do padrão
+        # (ex.: cadastros antigos) continuam valendo
+        row = await con.fetchrow(_PIX_SQL_CONTA, int(_PIX_PONTUACAO.sub("", chave)))
+        if row is None:
+            row = await con.fetchrow(_PIX_SQL_DOC, chave)
+    else:
+        row = await con.fetchrow(_PIX_SQL_DOC, chave)
+
+    if row is None:
+        return None
+    destino = (row["id_conta"], row["nome"])
+    _pix_cache.set(chave, destino)
+    return destino
+
+_PIX_SQL_LOTE = {
+    coluna: f"""
+        SELECT DISTINCT ON (u.{coluna}) u.{coluna} AS chave, c.id_conta, u.nome
+        FROM tb_usuario u JOIN tb_conta c ON c.id_usuario = u.id_usuario
+        WHERE u.{coluna} = ANY($1::text[])
+        ORDER BY u.{coluna}, c.id_conta
+    """
+    for coluna in ("email", "telefone", "doc_cpf_cnpj")
+}
+_PIX_SQL_CONTA_LOTE = """
+    SELECT c.id_conta, u.nome
+    FROM tb_conta c JOIN tb_usuario u ON u.id_usuario = c.id_usuario
+    WHERE c.id_conta = ANY($1::bigint[])
+"""
+
+async def resolve_pix_keys(con, identificadores) -> dict:
+    """resolve_pix_key para vários identificadores: no máximo uma consulta
+    por tipo de chave, não uma por chave. {identificador: (id_conta, nome) ou None}."""
+    destinos, por_coluna, contas = {}, {"email": set(), "telefone": set(), "doc_cpf_cnpj": set()}, {}
+    for identificador in set(identificadores):
+        chave = identificador.strip()
+        destino = _pix_cache.get(chave)
+        if destino is not None:
+            destinos[identificador] = destino
+            continue
+        tipo = classify_pix_key(chave)
+        if tipo == "conta":
+            contas.setdefault(int(_PIX_PONTUACAO.sub("", chave)), set()).add(chave)
+        else:
+            por_coluna["doc_cpf_cnpj" if tipo in ("cpf", "cnpj", "doc") else tipo].add(chave)
+
+    achados = {}
+    if contas:
+        for r in await con.fetch(_PIX_SQL_CONTA_LOTE, list(contas)):
+            for chave in contas.pop(r["id_conta"]):
+                achados[chave] = (r["id_conta"], r["nome"])
+        # como em resolve_pix_key: número que não é conta ainda vale como documento
+        for chaves in contas.values():
+            por_coluna["doc_cpf_cnpj"].update(chaves)
+    for coluna, chaves in por_coluna.items():
+        if chaves:
+            for r in await con.fetch(_PIX_SQL_LOTE[coluna], list(chaves)):
+                achados[r["chave"]] = (r["id_conta"], r["nome"])
+
+    for chave, destino in achados.items():
+        _pix_cache.set(chave, destino)
+    for identificador in set(identificadores):
+        if identificador not in destinos:
+            destinos[identificador] = achados.get(identificador.strip())
+    return destinos
+
+# ---------- EXPORTAÇÃO ----------
+# Cursor de servidor + StreamingResponse: a memória fica em um lote de
+# EXPORT_FETCH_SIZE linhas, não importa o tamanho do resultado.
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+def _orjson_default(v):
+    if isinstance(v, asyncpg.Record):
+        return dict(v)
+    if isinstance(v, Decimal):
+        # mesmo critério do jsonable_encoder: sem casas decimais vira inteiro
+        return int(v) if v.as_tuple().exponent >= 0 else float(v)
+    raise TypeError(f"Tipo não serializável: {type(v).__name__}")
+
+def _linhas_json(rows: list) -> list:
+    """Records de um mesmo resultado: nomes das colunas lidos uma vez só.
+
+    O orjson precisa de um dict para escrever um objeto; dict(record) busca
+    cada coluna pelo nome, aqui os valores saem em ordem e só são pareados
+    com a tupla de nomes (dataclass com slots e bytes montados valor a valor
+    mediram mais lentos que isso).
+    """
+    if not rows or not isinstance(rows[0], asyncpg.Record):
+        return rows
+    chaves = tuple(rows[0].keys())
+    return [dict(zip(chaves, r.values())) for r in rows]
+
+def records_response(conteudo, **kwargs) -> Response:
+    """Resposta JSON direto de Records do asyncpg (soltos ou dentro de dict/list).
+
+    Pula jsonable_encoder e a validação do response_model, que para listas
+    longas custam mais que a consulta. Listas de Records (no topo ou como
+    valor de um dict) passam por _linhas_json; o orjson só chama
+    _orjson_default para Record avulso e Decimal, date/datetime saem em ISO
+    como antes.
+    """
+    if isinstance(conteudo, list):
+        conteudo = _linhas_json(conteudo)
+    elif isinstance(conteudo, dict):
+        conteudo = {k: _linhas_json(v) if isinstance(v, list) else v for k, v in conteudo.items()}
+    return Response(orjson.dumps(conteudo, default=_orjson_default), media_type="application/json", **kwargs)
+
+def _json_default(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    raise TypeError(f"Tipo não serializável: {type(v).__name__}")
+
+def _csv_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+async def _export_rows(sql: str, args: list, formato: str, user_id: Optional[int]):
+    # só leitura: vai para a réplica pelas mesmas regras de db_read
+    async with db_read(user_id) as con:
+        async with con.transaction(readonly=True):
+            buf = io.StringIO()
+            writer = csv.writer(buf) if formato == "csv" else None
+            # as colunas vêm do statement preparado, não da primeira linha:
+            # exportação vazia ainda sai com cabeçalho
+            stmt = await con.prepare(sql)
+            if writer is not None:
+                writer.writerow([a.name for a in stmt.get_attributes()])
+            pendentes = 0
+            async for r in stmt.cursor(*args, prefetch=EXPORT_FETCH_SIZE):
+                if writer is not None:
+                    writer.writerow([_csv_value(v) for v in r.values()])
+                else:
+                    buf.write(json.dumps(dict(r), default=_json_default, ensure_ascii=False))
+                    buf.write("\n")
+                pendentes += 1
+                if pendentes >= EXPORT_FETCH_SIZE:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+                    pendentes = 0
+            if buf.tell():
+                yield buf.getvalue()
+
+def export_response(sql: str, args: list, formato: str, nome: str,
+                    user_id: Optional[int] = None) -> StreamingResponse:
+    if formato not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido (use csv ou ndjson)")
+    return StreamingResponse(
+        _export_rows(sql, args, formato, user_id),
+        media_type=EXPORT_FORMATS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nome}.{formato}"'},
+    )
+
+# ---------- IDEMPOTÊNCIA ----------
+# A chave é gravada em tb_idempotencia na MESMA transação da operação:
+# um retry concorrente espera no índice único e, quando a primeira
+# transação confirma, recebe a resposta gravada em vez de executar de novo.
+# Respostas já confirmadas ficam num cache local para replays sem SQL.
+_idem_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+_SQL_IDEM_RESERVA = """
+    INSERT INTO tb_idempotencia AS i (id_usuario, rota, chave, hash_requisicao, expira_em)
+    VALUES ($1, $2, $3, $4, now() + make_interval(secs => $5))
+    ON CONFLICT (id_usuario, rota, chave) DO UPDATE
+        SET hash_requisicao = EXCLUDED.hash_requisicao,
+            status_code = NULL,
+            resposta = NULL,
+            criado_em = now(),
+            expira_em = EXCLUDED.expira_em
+        WHERE i.expira_em < now()
+    RETURNING true
+"""
+
+class Idempotencia:
+    def __init__(self, con, key=None):
+        self.con = con
+        self.key = key
+        self.replay = None
+        self.resposta = None
+
+    async def salvar(self, resposta: dict) -> dict:
+        """Grava a resposta junto com a operação; sem chave, só devolve."""
+        if self.key is not None:
+            await self.con.execute(
+                """
+                UPDATE tb_idempotencia SET status_code = 200, resposta = $4::jsonb
+                WHERE id_usuario = $1 AND rota = $2 AND chave = $3
+                """,
+                *self.key,
+                json.dumps(resposta, default=_json_default),
+            )
+            self.resposta = resposta
+        return resposta
+
+def _idem_key(rota: str, user_id: Optional[int], chave: str):
+    if len(chave) > IDEMPOTENCY_KEY_MAX_LEN:
+        raise HTTPException(status_code=400, detail="Idempotency-Key muito longa")
+    return (user_id or 0, rota, chave)
+
+def _idem_fingerprint(body: BaseModel) -> str:
+    return hashlib.sha256(body.model_dump_json().encode()).hexdigest()
+
+def _idem_response(armazenado, fingerprint: str) -> ORJSONResponse:
+    hash_requisicao, resposta = armazenado
+    if hash_requisicao != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key já utilizada com outra requisição",
+        )
+    return ORJSONResponse(content=resposta, headers={"Idempotent-Replayed": "true"})
+
+def idempotency_replay(rota: str, user_id: Optional[int], chave: Optional[str], body: BaseModel):
+    """Resposta gravada no cache local, sem tocar no banco; None se não houver."""
+    if not chave:
+        return None
+    armazenado = _idem_cache.get(_idem_key(rota, user_id, chave))
+    if armazenado is None:
+        return None
+    return _idem_response(armazenado, _idem_fingerprint(body))
+
+@asynccontextmanager
+async def idempotent(con, rota: str, user_id: Optional[int], chave: Optional[str], body: BaseModel):
+    """Reserva a chave e roda a operação na mesma transação.
+
+    Se a chave já tiver resposta, idem.replay traz a resposta gravada e o
+    handler deve devolvê-la sem executar nada. Erros desfazem a reserva, de
+    modo que um retry depois de uma falha executa de novo.
+    """
+    if not chave:
+        yield Idempotencia(con)
+        return
+    key = _idem_key(rota, user_id, chave)
+    fingerprint = _idem_fingerprint(body)
+    idem = Idempotencia(con)
+    async with con.transaction():
+        nova = await con.fetchval(_SQL_IDEM_RESERVA, *key, fingerprint, IDEMPOTENCY_TTL)
+        if not nova:
+            row = await con.fetchrow(
+                """
+                SELECT hash_requisicao, resposta FROM tb_idempotencia
+                WHERE id_usuario = $1 AND rota = $2 AND chave = $3
+                """,
+                *key,
+            )
+            armazenado = (row["hash_requisicao"], json.loads(row["resposta"]))
+            _idem_cache.set(key, armazenado)
+            idem.replay = _idem_response(armazenado, fingerprint)
+            yield idem
+            return
+        idem.key = key
+        yield idem
+    if idem.resposta is not None:
+        _idem_cache.set(key, (fingerprint, idem.resposta))
+
+async def cleanup_idempotency(con, lote: int = IDEMPOTENCY_CLEANUP_BATCH) -> int:
+    """Apaga chaves expiradas em lotes de até `lote` linhas."""
+    total = 0
+    while True:
+        status = await con.execute(
+            """
+            DELETE FROM tb_idempotencia
+            WHERE ctid = ANY(ARRAY(
+                SELECT ctid FROM tb_idempotencia
+                WHERE expira_em < now()
+                LIMIT $1
+            ))
+            """,
+            lote,
+        )
+        apagadas = int(status.split()[-1])
+        total += apagadas
+        if apagadas < lote:
+            return total
+
+# ---------- AUDITORIA ----------
+async def drain_audit_queue(con, lote: int = AUDIT_DRAIN_BATCH) -> int:
+    """Move a fila de auditoria para tb_auditoria, um lote por transação."""
+    total = 0
+    while True:
+        movidas = await con.fetchval("SELECT fn_drenar_auditoria($1)", lote)
+        total += movidas
+        if movidas < lote:
+            return total
+
+# ---------- CONTAS QUENTES ----------
+async def fold_pending_credits(con) -> int:
+    """Consolida os créditos pendentes, uma transação curta por conta."""
+    contas = await con.fetch("SELECT DISTINCT id_conta FROM tb_credito_pendente")
+    total = 0
+    for r in contas:
+        total += await con.fetchval("SELECT fn_consolidar_creditos($1)", r["id_conta"])
+    return total
+
+# ---------- FATURAMENTO ----------
+async def fold_pending_billing(con) -> int:
+    """Consolida tb_faturamento_pendente em tb_faturamento_mensal (linhas consumidas)."""
+    return await con.fetchval("SELECT fn_consolidar_faturamento()")
+
+# ---------- ATRASOS ----------
+async def update_arrears(con):
+    """(entraram, sairam) do atraso; None se outra execução está em andamento."""
+    row = await con.fetchrow("SELECT entraram, sairam FROM fn_atualizar_atrasos()")
+    if row["entraram"] is None:
+        return None
+    return row["entraram"], row["sairam"]
+
+# ---------- LISTEN/NOTIFY ----------
+# Cada worker mantém uma conexão dedicada (fora do pool) em LISTEN nos canais
+# registrados com on_notify. Ao (re)conectar, os callbacks recebem None:
+# avisos podem ter se perdido enquanto a conexão estava fora.
+CANAL_CACHE = "finpay_cache"
+_ouvintes = {}
+_escutando = False  # LISTEN ativo agora: quem depende de avisos confere isto
+
+def on_notify(canal: str, callback):
+    _ouvintes.setdefault(canal, []).append(callback)
+
+def _despachar(con, pid, canal, payload):
+    for callback in _ouvintes.get(canal, ()):
+        try:
+            callback(payload)
+        except Exception:
+            logger.exception("callback de NOTIFY em %s falhou", canal)
+
+async def _escutar():
+    global _escutando
+    espera = 1
+    while True:
+        con = None
+        try:
+            con = await asyncpg.connect(DATABASE_URL)
+            caiu = asyncio.get_running_loop().create_future()
+            con.add_termination_listener(lambda _c: caiu.done() or caiu.set_result(None))
+            for canal in _ouvintes:
+                await con.add_listener(canal, _despachar)
+                _despachar(con, None, canal, None)
+            _escutando = True
+            espera = 1
+            await caiu
+            logger.warning("conexão de LISTEN caiu; reconectando")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("conexão de LISTEN falhou")
+        finally:
+            _escutando = False
+            if con is not None and not con.is_closed():
+                await con.close()
+        await asyncio.sleep(espera)
+        espera = min(espera * 2, 30)
+
+def _invalidar_caches(payload):
+    """Avisos de sql/14-notificacoes-cache.sql: 'conta:<id_usuario>' ou 'pix'."""
+    if payload is None:
+        _conta_cache.clear()
+        _pix_cache.clear()
+        return
+    tipo, _, valor = payload.partition(":")
+    if tipo == "conta":
+        _conta_cache.invalidate(int(valor))
+    elif tipo == "pix":
+        _pix_cache.clear()
+
+on_notify(CANAL_CACHE, _invalidar_caches)
+
+# ---------- RÉPLICA DE LEITURA ----------
+# Endpoints só de leitura usam db_read(): vão para a réplica, menos quando
+#  - o usuário escreveu há menos de READ_YOUR_WRITES_WINDOW s (o middleware
+#    marca toda resposta < 400 de POST/PUT/PATCH/DELETE com X-User-Id; com
+#    réplica, a marca é repassada aos outros workers por NOTIFY);
+#  - o atraso da réplica passou de REPLICA_MAX_LAG ou não pôde ser medido;
+#  - o LISTEN acabou de reconectar (marcas de outros workers podem ter se
+#    perdido): tudo no primário por uma janela.
+CANAL_ESCRITA = "finpay_escrita"
+_escritas = TTLCache(READ_YOUR_WRITES_CACHE_SIZE, READ_YOUR_WRITES_WINDOW)
+_usuario_req = contextvars.ContextVar("finpay_usuario", default=None)
+_replica_lag = None
+_primario_ate = 0.0
+_leituras = {}
+_avisos_pendentes = set()
+
+_SQL_ATRASO_REPLICA = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END::float8
+"""
+
+def _rota_leitura(user_id):
+    """(pool, motivo); pool None = primário."""
+    if app.state.read_pool is None:
+        return None, "sem_replica"
+    if _replica_lag is None or _replica_lag > REPLICA_MAX_LAG:
+        return None, "atraso"
+    if time.monotonic() < _primario_ate:
+        return None, "reconexao"
+    if user_id is not None and _escritas.get(user_id) is not None:
+        return None, "escrita_recente"
+    return app.state.read_pool, "replica"
+
+@asynccontextmanager
+async def db_read(user_id: Optional[int] = None):
+    """Conexão para leitura; user_id padrão vem do X-User-Id da requisição."""
+    if user_id is None:
+        user_id = _usuario_req.get()
+    pool, motivo = _rota_leitura(user_id)
+    chave = ("primario" if pool is None else "replica", motivo)
+    _leituras[chave] = _leituras.get(chave, 0) + 1
+    async with db_acquire(pool) as con:
+        yield con
+
+async def _avisar_escrita(user_id: int):
+    try:
+        async with db_acquire() as con:
+            await con.execute("SELECT pg_notify($1, $2)", CANAL_ESCRITA, str(user_id))
+    except Exception:
+        logger.exception("falha ao avisar escrita do usuário %s", user_id)
+
+def marcar_escrita(user_id: int):
+    _escritas.set(user_id, True)
+    if DATABASE_READ_URL and WEB_CONCURRENCY > 1:
+        tarefa = asyncio.create_task(_avisar_escrita(user_id))
+        _avisos_pendentes.add(tarefa)
+        tarefa.add_done_callback(_avisos_pendentes.discard)
+
+def _escrita_remota(payload):
+    global _primario_ate
+    if payload is None:
+        _primario_ate = time.monotonic() + READ_YOUR_WRITES_WINDOW
+    else:
+        _escritas.set(int(payload), True)
+
+async def _monitorar_replica():
+    global _replica_lag
+    while True:
+        try:
+            async with db_acquire(app.state.read_pool) as con:
+                _replica_lag = await con.fetchval(_SQL_ATRASO_REPLICA)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if _replica_lag is not None:
+                logger.exception("réplica indisponível; leituras vão para o primário")
+            _replica_lag = None
+        await asyncio.sleep(REPLICA_LAG_CHECK_INTERVAL)
+
+class ReadYourWritesMiddleware:
+    _ESCRITA = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        user_id = None
+        for nome, valor in scope["headers"]:
+            if nome == b"x-user-id":
+                user_id = _int_or_none(valor.decode("latin-1"))
+                break
+        if scope["method"] not in self._ESCRITA:
+            token = _usuario_req.set(user_id)
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                _usuario_req.reset(token)
+
+        async def _send(mensagem):
+            if mensagem["type"] == "http.response.start" and user_id and mensagem["status"] < 400:
+                marcar_escrita(user_id)
+            await send(mensagem)
+
+        await self.app(scope, receive, _send)
+
+# sempre ligado: o dashboard também consulta a marca de escrita recente
+app.add_middleware(ReadYourWritesMiddleware)
+if DATABASE_READ_URL:
+    on_notify(CANAL_ESCRITA, _escrita_remota)
+
+# CORS por último (o último registrado fica por fora): preflight responde
+# antes do limite de taxa, e os 429 também levam Access-Control-Allow-Origin
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,10 +1544,274 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-async def get_pool():
-    if not hasattr(app.state, "pool"):
-        app.state.pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
-    return app.state.pool
+# ---------- DASHBOARD (ETag) ----------
+# _dash_cache: id_usuario -> (id_conta, etag, instante da leitura). Um 304
+# sai sem SQL se não houve movimento na conta depois da leitura: o gatilho
+# de sql/17-notificacoes-movimento.sql avisa id_conta em finpay_mov a cada
+# transação/empréstimo/parcela, e _mov_recente guarda quando. Toda entrada
+# do dashboard semeia a marca da conta (0.0 = sem movimento) e as duas têm
+# o mesmo TTL: marca ausente quer dizer que o LRU a descartou, e aí a conta
+# conta como movimentada (sem 304) em vez de confiar no ETag.
+CANAL_MOVIMENTO = "finpay_mov"
+_dash_cache = TTLCache(DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_TTL)
+_mov_recente = TTLCache(DASHBOARD_CACHE_SIZE * 4, DASHBOARD_CACHE_TTL)
+_mov_reset_em = 0.0
+
+def _movimento(payload):
+    global _mov_reset_em
+    if payload is None:
+        _mov_reset_em = time.monotonic()
+        _dash_cache.clear()
+    else:
+        _mov_recente.set(int(payload), time.monotonic())
+
+on_notify(CANAL_MOVIMENTO, _movimento)
+
+def dashboard_etag(user_id: int) -> Optional[str]:
+    """ETag ainda válido do dashboard do usuário, sem ir ao banco.
+
+    Sem LISTEN ativo (NOTIFY_LISTENER=0 ou conexão caída) créditos de
+    outros usuários não chegam a _mov_recente: sempre None, recalcula.
+    """
+    if not _escutando:
+        return None
+    entrada = _dash_cache.get(user_id)
+    if entrada is None:
+        return None
+    id_conta, etag, lido_em = entrada
+    movido = _mov_recente.get(id_conta)
+    if lido_em <= _mov_reset_em or movido is None or movido >= lido_em:
+        _dash_cache.invalidate(user_id)
+        return None
+    return etag
+
+def guardar_dashboard(user_id: int, id_conta: int, etag: str, lido_em: float):
+    # renova o TTL da marca sem apagar um movimento já avisado
+    _mov_recente.set(id_conta, _mov_recente.get(id_conta) or 0.0)
+    _dash_cache.set(user_id, (id_conta, etag, lido_em))
+
+# ---------- EVENTOS (SSE) ----------
+# Todos os assinantes de um worker são alimentados pelo LISTEN único de
+# _escutar: um aviso de finpay_mov para uma conta com assinantes entra em
+# _sse_pendentes, e _publicar_eventos busca saldo e transações novas dessas
+# contas numa consulta só. O mesmo quadro SSE, já formatado, vai para a fila
+# de cada assinante. Fila cheia é sinal de cliente lento: a assinatura é
+# encerrada, o EventSource reconecta e recebe o saldo atual.
+class _CanalConta:
+    __slots__ = ("filas", "desde", "vistos")
+
+    def __init__(self):
+        self.filas = set()
+        self.desde = None   # None: primeiro retrato, transações já existentes não são enviadas
+        self.vistos = {}    # id_transacao -> lido_em da leitura que o enviou
+
+_canais = {}
+_sse_pendentes = set()
+_sse_acordar = asyncio.Event()
+_sse_assinantes = 0
+_sse_eventos = 0
+_sse_descartados = 0
+
+# Transações com criado_em >= desde; desde fica SSE_TX_LOOKBACK s antes da
+# última leitura porque criado_em é o início da transação que inseriu, não o
+# commit. A deduplicação é pelo id: cada id enviado fica em vistos até que a
+# folga passe da leitura que o trouxe (criado_em <= lido_em < desde, então
+# ele não volta mais), comparando datetimes do próprio banco, sem texto.
+_SQL_EVENTOS = """
+    SELECT x.id_conta, fn_saldo_conta(x.id_conta) AS saldo_cents, localtimestamp AS lido_em,
+           coalesce(n.lista, '[]') AS transacoes
+    FROM unnest($1::bigint[], $2::timestamp[]) AS x(id_conta, desde)
+    LEFT JOIN LATERAL (
+        SELECT json_agg(t ORDER BY t.criado_em, t.id_transacao)::text AS lista
+        FROM (
+            (SELECT id_transacao, criado_em, tipo, status, valor_cents, id_conta_de, id_conta_para,
+                    id_comerciante
+             FROM tb_transacao
+             WHERE id_conta_de = x.id_conta
+               AND criado_em >= coalesce(x.desde, localtimestamp - make_interval(secs => $3))
+             ORDER BY criado_em DESC, id_transacao DESC LIMIT $4)
+            UNION
+            (SELECT id_transacao, criado_em, tipo, status, valor_cents, id_conta_de, id_conta_para,
+                    id_comerciante
+             FROM tb_transacao
+             WHERE id_conta_para = x.id_conta
+               AND criado_em >= coalesce(x.desde, localtimestamp - make_interval(secs => $3))
+             ORDER BY criado_em DESC, id_transacao DESC LIMIT $4)
+        ) t
+    ) n ON TRUE
+"""
+_SSE_LOTE = 500
+
+def _sse_quadro(evento: str, dados) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, default=str)}\n\n"
+
+def _fechar_fila(fila):
+    while not fila.empty():
+        fila.get_nowait()
+    fila.put_nowait(None)
+
+def _sse_enviar(canal, quadro: str):
+    global _sse_eventos, _sse_descartados
+    for fila in list(canal.filas):
+        try:
+            fila.put_nowait(quadro)
+            _sse_eventos += 1
+        except asyncio.QueueFull:
+            canal.filas.discard(fila)
+            _fechar_fila(fila)
+            _sse_descartados += 1
+
+def _sse_entregar(row):
+    canal = _canais.get(row["id_conta"])
+    if canal is None:
+        return
+    primeiro = canal.desde is None
+    canal.desde = row["lido_em"] - timedelta(seconds=SSE_TX_LOOKBACK)
+    for t in json.loads(row["transacoes"]):
+        if t["id_transacao"] in canal.vistos:
+            continue
+        canal.vistos[t["id_transacao"]] = row["lido_em"]
+        if not primeiro:
+            _sse_enviar(canal, _sse_quadro("transacao", t))
+    canal.vistos = {k: v for k, v in canal.vistos.items() if v >= canal.desde}
+    _sse_enviar(canal, _sse_quadro("saldo", {"id_conta": row["id_conta"], "saldo_cents": row["saldo_cents"]}))
+
+async def _publicar_eventos():
+    while True:
+        await _sse_acordar.wait()
+        _sse_acordar.clear()
+        contas = [c for c in _sse_pendentes if c in _canais]
+        _sse_pendentes.clear()
+        for i in range(0, len(contas), _SSE_LOTE):
+            lote = contas[i:i + _SSE_LOTE]
+            desdes = [_canais[c].desde for c in lote]
+            try:
+                # primário: a réplica pode ainda não ter a transação avisada
+                async with db_acquire() as con:
+                    rows = await con.fetch(_SQL_EVENTOS, lote, desdes, SSE_TX_LOOKBACK, SSE_TX_MAX)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("falha ao buscar eventos de %d contas", len(lote))
+                _sse_pendentes.update(contas[i:])
+                await asyncio.sleep(1)
+                _sse_acordar.set()
+                break
+            for row in rows:
+                _sse_entregar(row)
+
+def _movimento_sse(payload):
+    if payload is None:
+        # LISTEN reconectou: avisos podem ter se perdido, relê todas as contas
+        _sse_pendentes.update(_canais)
+    else:
+        id_conta = int(payload)
+        if id_conta not in _canais:
+            return
+        _sse_pendentes.add(id_conta)
+    if _sse_pendentes:
+        _sse_acordar.set()
+
+on_notify(CANAL_MOVIMENTO, _movimento_sse)
+
+async def sse_stream(id_conta: int):
+    global _sse_assinantes
+    canal = _canais.get(id_conta)
+    if canal is None:
+        canal = _canais[id_conta] = _CanalConta()
+    fila = asyncio.Queue(SSE_QUEUE_SIZE)
+    canal.filas.add(fila)
+    _sse_assinantes += 1
+    # retrato inicial (saldo atual) vem pelo mesmo caminho dos avisos
+    _sse_pendentes.add(id_conta)
+    _sse_acordar.set()
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                quadro = await asyncio.wait_for(fila.get(), SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                quadro = ": ping\n\n"
+            if quadro is None:
+                return
+            yield quadro
+    finally:
+        _sse_assinantes -= 1
+        canal.filas.discard(fila)
+        if not canal.filas and _canais.get(id_conta) is canal:
+            del _canais[id_conta]
+
+def _encerrar_eventos():
+    for canal in _canais.values():
+        for fila in canal.filas:
+            _fechar_fila(fila)
+
+def _encerrar_eventos_no_sinal():
+    # Streams SSE não terminam sozinhos: sem isso o uvicorn esperaria por eles
+    # até o GRACEFUL_TIMEOUT do gunicorn e mataria o worker sem fechar o pool.
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGTERM, signal.SIGINT):
+        anterior = signal.getsignal(sinal)
+        if not callable(anterior):
+            continue
+
+        def _handler(signum, frame, anterior=anterior):
+            loop.call_soon_threadsafe(_encerrar_eventos)
+            anterior(signum, frame)
+
+        signal.signal(sinal, _handler)
+
+# ---------- TAREFAS PERIÓDICAS ----------
+async def _periodic(nome: str, intervalo: float, tarefa):
+    # com vários workers, só quem pegar o advisory lock roda a rodada
+    chave = f"finpay:{nome}"
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            async with db_acquire() as con:
+                if not await con.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", chave):
+                    continue
+                try:
+                    await tarefa(con)
+                finally:
+                    await con.execute("SELECT pg_advisory_unlock(hashtext($1))", chave)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("tarefa periódica %s falhou", nome)
+
+def start_background_tasks():
+    tarefas = []
+    if IDEMPOTENCY_CLEANUP_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(
+            _periodic("idempotencia", IDEMPOTENCY_CLEANUP_INTERVAL, cleanup_idempotency)
+        ))
+    if AUDIT_MODE == "async" and AUDIT_DRAIN_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(
+            _periodic("auditoria", AUDIT_DRAIN_INTERVAL, drain_audit_queue)
+        ))
+    if HOT_ACCOUNT_FOLD_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(
+            _periodic("contas_quentes", HOT_ACCOUNT_FOLD_INTERVAL, fold_pending_credits)
+        ))
+    if FATURAMENTO_FOLD_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(
+            _periodic("faturamento", FATURAMENTO_FOLD_INTERVAL, fold_pending_billing)
+        ))
+    if RATE_LIMIT_BACKEND == "postgres" and RATE_LIMIT_CLEANUP_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(
+            _periodic("limite_taxa", RATE_LIMIT_CLEANUP_INTERVAL, cleanup_rate_limits)
+        ))
+    if ARREARS_JOB_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(
+            _periodic("atrasos", ARREARS_JOB_INTERVAL, update_arrears)
+        ))
+    if NOTIFY_LISTENER and _ouvintes:
+        tarefas.append(asyncio.create_task(_escutar()))
+    tarefas.append(asyncio.create_task(_publicar_eventos()))
+    if DATABASE_READ_URL:
+        tarefas.append(asyncio.create_task(_monitorar_replica()))
+    return tarefas
 
 # ---------- MODELS ----------
 class CreateUser(BaseModel):
@@ -100,6 +1873,13 @@ class LoanSim(BaseModel):
     @classmethod
     def _coerce_int2(cls, v): return _int_or_none(v)
 
+class LoanGrid(BaseModel):
+    principal_cents: Optional[int] = None
+    principais_cents: Optional[List[int]] = None
+    @field_validator('principal_cents', mode='before')
+    @classmethod
+    def _coerce_int(cls, v): return _int_or_none(v)
+
 class Deposit(BaseModel):
     valor_cents: int
     id_conta: Optional[int] = None
@@ -122,6 +1902,22 @@ class Transfer(BaseModel):
     @classmethod
     def _coerce_int(cls, v): return _int_or_none(v)
 
+class BatchPaymentItem(BaseModel):
+    id_comerciante: int
+    valor_cents: int
+    referencia: Optional[str] = None
+    @field_validator('id_comerciante', 'valor_cents', mode='before')
+    @classmethod
+    def _coerce_int(cls, v): return _int_or_none(v)
+
+class PaymentBatch(BaseModel):
+    itens: List[BatchPaymentItem]
+    atomico: bool = True
+
+class TransferBatch(BaseModel):
+    itens: List[Transfer]
+    atomico: bool = True
+
 class UtilityPayment(BaseModel):
     id_comerciante: int
     valor_cents: int
@@ -129,6 +1925,178 @@ class UtilityPayment(BaseModel):
     @classmethod
     def _coerce_int(cls, v): return _int_or_none(v)
 
+# ---------- RESPOSTAS ----------
+# Modelos de resposta: documentam o OpenAPI e, nas rotas que devolvem dict,
+# fazem a serialização tipada (Decimal de NUMERIC vira float). Rotas de
+# lista devolvem records_response e usam o modelo só como documentação.
+class Health(BaseModel):
+    status: str
+
+class UserCreated(BaseModel):
+    id_usuario: int
+    id_conta: int
+
+class LoginOut(BaseModel):
+    id_usuario: int
+
+class AccountCreated(BaseModel):
+    id_conta: int
+
+class AccountOut(BaseModel):
+    id_conta: int
+    nome: str
+    numero_conta: str
+    agencia: str
+    saldo_cents: int
+    status: str
+
+class SummaryOut(BaseModel):
+    # {} quando o usuário não tem conta (response_model_exclude_unset)
+    id_conta: Optional[int] = None
+    numero_conta: Optional[str] = None
+    agencia: Optional[str] = None
+    saldo_cents: Optional[int] = None
+    tipo_pessoa: Optional[str] = None
+
+class TransactionOut(BaseModel):
+    id_transacao: int
+    criado_em: datetime
+    tipo: str
+    status: str
+    valor_cents: int
+    referencia: Optional[str] = None
+    id_conta_de: Optional[int] = None
+    id_conta_para: Optional[int] = None
+    id_comerciante: Optional[int] = None
+
+class StatementItem(TransactionOut):
+    direcao: str  # 'debito' ou 'credito', do ponto de vista da conta
+
+class StatementPage(BaseModel):
+    id_conta: int
+    itens: List[StatementItem]
+    proximo_cursor: Optional[str] = None
+
+class LoanOut(BaseModel):
+    # {} quando não há empréstimo ativo (response_model_exclude_unset)
+    id_emprestimo: Optional[int] = None
+    id_conta: Optional[int] = None
+    principal_cents: Optional[int] = None
+    juros_aa_pct: Optional[float] = None
+    prazo_meses: Optional[int] = None
+    status: Optional[str] = None
+    iniciado_em: Optional[date] = None
+    criado_em: Optional[datetime] = None
+
+class InstallmentOut(BaseModel):
+    id_parcela: int
+    num_parcela: int
+    vencimento: date
+    valor_cents: int
+    pago: bool
+
+class DashboardOut(BaseModel):
+    resumo: Optional[SummaryOut] = None
+    emprestimo: Optional[LoanOut] = None
+    parcelas: List[InstallmentOut]
+    transacoes: List[StatementItem]
+
+class OverdueLoanOut(BaseModel):
+    id_emprestimo: int
+    id_conta: int
+    id_usuario: int
+    principal_cents: int
+    prazo_meses: int
+    iniciado_em: date
+    parcelas_vencidas: int
+    valor_vencido_cents: int
+    primeiro_vencimento: date
+    dias_em_atraso: int
+
+class OverduePage(BaseModel):
+    itens: List[OverdueLoanOut]
+    proximo_cursor: Optional[int] = None
+
+class DepositOut(BaseModel):
+    status: str
+    id_conta: int
+    id_transacao: int
+    creditado_cents: int
+
+class TransactionRef(BaseModel):
+    id_transacao: int
+
+class TransferOut(BaseModel):
+    id_transacao: int
+    nome_destino: Optional[str] = None
+    valor_cents: int
+
+class BatchItemOut(BaseModel):
+    indice: int
+    id_transacao: Optional[int] = None
+    erro: Optional[str] = None
+
+class BatchOut(BaseModel):
+    # atomico=True traz total_cents; atomico=False traz falhas
+    status: str
+    confirmados: int
+    total_cents: Optional[int] = None
+    falhas: Optional[int] = None
+    itens: List[BatchItemOut]
+
+class LoanSimOut(BaseModel):
+    juros_aa_pct: float
+    parcela_max_limit_cents: int
+    principal_max_cents: int
+    pmt_cents: int
+    juros_mensal_pct: float
+    validation_ok: bool
+
+class LoanGridPrazo(BaseModel):
+    prazo_meses: int
+    juros_aa_pct: float
+    juros_mensal_pct: float
+    principal_max_cents: int
+    pmt_cents: Optional[int] = None
+    validation_ok: Optional[bool] = None
+
+class LoanGridLinha(BaseModel):
+    principal_cents: int
+    pmt_cents: List[int]
+    validation_ok: List[bool]
+
+class LoanGridOut(BaseModel):
+    parcela_max_limit_cents: int
+    prazos: List[LoanGridPrazo]
+    grade: List[LoanGridLinha]
+
+class LoanCreated(BaseModel):
+    id_emprestimo: int
+
+class StatusOut(BaseModel):
+    status: str
+
+class PayFullOut(BaseModel):
+    status: str
+    id_emprestimo: int
+
+class ImportRowError(BaseModel):
+    linha: int
+    erro: str
+
+class ImportOut(BaseModel):
+    importados: int
+    falhas: int
+    # no máximo IMPORT_MAX_ERRORS linhas; falhas tem o total
+    erros: List[ImportRowError]
+
+class FaturamentoOut(BaseModel):
+    id_comerciante: int
+    nome_fantasia: str
+    mes: date
+    total_cents: int
+    qtde: int
+
 
 # NOVO: Função para determinar juros anual dinâmico
 def get_dynamic_interest_aa(prazo_meses: int) -> float:
@@ -158,18 +2126,128 @@ def calculate_pmt_cents(principal_cents: int, juros_aa_pct: float, prazo_meses:
         
     return int(round(pmt))
 
+# Elegibilidade do empréstimo: função pura, sem banco. Usada por
+# /loans/simulate e /loans/create com o salário que o handler já leu.
+def avaliar_emprestimo(salario_mensal_cents: int, principal_cents: Optional[int], prazo_meses: int) -> dict:
+    # 1. Limite de parcela: 30% do salário
+    parcela_max_limit = int(round(salario_mensal_cents * 0.30))
+
+    # 2. Definir Juros Dinâmico
+    juros_aa_pct = get_dynamic_interest_aa(prazo_meses)
+    jm = monthly_rate_from_aa(juros_aa_pct)
+
+    # 3. Calcular Limite Máximo
+    if jm == 0:
+        principal_max = parcela_max_limit * prazo_meses
+    else:
+        principal_max = int(
+            round(
+                parcela_max_limit
+                * (((1 + jm) ** prazo_meses - 1)
+                   / (jm * (1 + jm) ** prazo_meses))
+            )
+        )
+
+    # 4. Calcular Parcela para o valor SOLICITADO pelo usuário
+    if principal_cents is None or principal_cents <= 0:
+        pmt_cents = 0
+    else:
+        pmt_cents = calculate_pmt_cents(principal_cents, juros_aa_pct, prazo_meses)
+
+    return {
+        "juros_aa_pct": juros_aa_pct,
+        "parcela_max_limit_cents": parcela_max_limit,
+        "principal_max_cents": principal_max,
+        "pmt_cents": pmt_cents,
+        "juros_mensal_pct": jm * 100.0,
+        "validation_ok": principal_cents is not None and principal_cents <= principal_max,
+    }
+
+# Grade de ofertas: os fatores do Sistema Price dependem só do prazo, então
+# são calculados uma vez para 1..LOAN_PRAZO_MAX. Cada linha guarda os mesmos
+# termos intermediários de avaliar_emprestimo/calculate_pmt_cents, o que
+# garante centavos idênticos aos do caminho escalar.
+def _fatores_prazo(prazo: int):
+    juros_aa_pct = get_dynamic_interest_aa(prazo)
+    jm = monthly_rate_from_aa(juros_aa_pct)
+    if jm == 0:
+        return (prazo, juros_aa_pct, jm, None, None, None)
+    num = jm * (1 + jm) ** prazo
+    den = (1 + jm) ** prazo - 1
+    fator_max = ((1 + jm) ** prazo - 1) / (jm * (1 + jm) ** prazo)
+    return (prazo, juros_aa_pct, jm, num, den, fator_max)
+
+_FATORES_PRAZO = tuple(_fatores_prazo(n) for n in range(1, LOAN_PRAZO_MAX + 1))
+
+def _pmt_grade(principal_cents: int):
+    """PMT de um principal para todos os prazos, numa passada."""
+    if principal_cents <= 0:
+        return [0] * LOAN_PRAZO_MAX
+    return [
+        int(round(principal_cents / prazo)) if num is None
+        else int(round(principal_cents * num / den))
+        for prazo, _, _, num, den, _ in _FATORES_PRAZO
+    ]
+
+@functools.lru_cache(maxsize=LOAN_GRID_CACHE_SIZE)
+def tabela_ofertas(salario_mensal_cents: int):
+    """(parcela_max, linhas por prazo) para um salário; cacheado por salário."""
+    parcela_max_limit = int(round(salario_mensal_cents * 0.30))
+    linhas = tuple(
+        (
+            prazo,
+            juros_aa_pct,
+            jm * 100.0,
+            parcela_max_limit * prazo if fator_max is None
+            else int(round(parcela_max_limit * fator_max)),
+        )
+        for prazo, juros_aa_pct, jm, _, _, fator_max in _FATORES_PRAZO
+    )
+    return parcela_max_limit, linhas
+
 
 # ---------- LIFECYCLE ----------
-@app.on_event("startup")
 async def startup():
-    await get_pool()
-
-@app.get("/health")
+    app.state.pool = await create_db_pool()
+    app.state.read_pool = None
+    if DATABASE_READ_URL:
+        app.state.read_pool = await create_db_pool(DATABASE_READ_URL, DB_READ_POOL_MAX_SIZE)
+    app.state.tasks = start_background_tasks()
+    _encerrar_eventos_no_sinal()
+
+async def shutdown():
+    _encerrar_eventos()
+    for tarefa in app.state.tasks:
+        tarefa.cancel()
+    await asyncio.gather(*app.state.tasks, return_exceptions=True)
+    await _fechar_pool(app.state.pool)
+    if app.state.read_pool is not None:
+        await _fechar_pool(app.state.read_pool)
+    _pwd_executor.shutdown(wait=False, cancel_futures=True)
+    shutdown_import_pool()
+
+@app.get("/health", response_model=Health)
 async def health():
     return {"status": "ok"}
 
+@app.get("/stats/pool", response_model=Dict[str, Any])
+async def get_pool_stats():
+    return pool_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/caches", response_model=Dict[str, Any])
+async def cache_stats():
+    return {
+        "contas": _conta_cache.stats(),
+        "pix": _pix_cache.stats(),
+        "idempotencia": _idem_cache.stats(),
+    }
+
 # ---------- AUTH ----------
-@app.post("/auth/register")
+@app.post("/auth/register", response_model=UserCreated)
 async def auth_register(body: Register):
     sql_user = """
         INSERT INTO tb_usuario (nome,email,telefone,doc_cpf_cnpj,senha_hash, tipo_pessoa)
@@ -181,8 +2259,8 @@ async def auth_register(body: Register):
         VALUES ($1::bigint, to_char($1::bigint, 'FM00000000'), '0001', 0, $2::bigint)
         RETURNING id_conta
     """
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    senha_hash = await hash_password(body.senha)
+    async with db_acquire() as con:
         tr = con.transaction()
         await tr.start()
         try:
@@ -192,30 +2270,34 @@ async def auth_register(body: Register):
                 body.email,
                 body.telefone,
                 body.doc_cpf_cnpj,
-                bcrypt_sha256.hash(body.senha),
+                senha_hash,
                 body.tipo_pessoa
             )
             cid = await con.fetchval(sql_account, uid, body.salario_mensal_cents)
             await tr.commit()
+            invalidate_conta(uid)
+            # o cadastro não traz X-User-Id, então o middleware não marca:
+            # sem isso, a primeira leitura da conta nova pode cair na réplica
+            marcar_escrita(uid)
             return {"id_usuario": uid, "id_conta": cid}
         except Exception as e:
             await tr.rollback()
             raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/auth/login")
+@app.post("/auth/login", response_model=LoginOut)
 async def auth_login(body: Login):
     q = "SELECT id_usuario, senha_hash FROM tb_usuario WHERE doc_cpf_cnpj=$1"
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_acquire() as con:
         row = await con.fetchrow(q, body.doc_cpf_cnpj)
-        if not row:
-            raise HTTPException(status_code=401, detail="CPF/CNPJ ou senha inválidos")
-        if not bcrypt_sha256.verify(body.senha, row["senha_hash"] or ""):
-            raise HTTPException(status_code=401, detail="CPF/CNPJ ou senha inválidos")
-        return {"id_usuario": row["id_usuario"]}
+    # a conexão volta ao pool antes do bcrypt
+    if not row:
+        raise HTTPException(status_code=401, detail="CPF/CNPJ ou senha inválidos")
+    if not await verify_password(body.senha, row["senha_hash"] or ""):
+        raise HTTPException(status_code=401, detail="CPF/CNPJ ou senha inválidos")
+    return {"id_usuario": row["id_usuario"]}
 
 # ---------- USERS/ACCOUNTS ----------
-@app.post("/users")
+@app.post("/users", response_model=UserCreated)
 async def create_user(body: CreateUser):
     sql_user = """
         INSERT INTO tb_usuario (nome,email,telefone,doc_cpf_cnpj,senha_hash, tipo_pessoa)
@@ -227,8 +2309,8 @@ async def create_user(body: CreateUser):
         VALUES ($1::bigint, to_char($1::bigint, 'FM00000000'), '0001', 0, 0)
         RETURNING id_conta
     """
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    senha_hash = await hash_password("changeme")
+    async with db_acquire() as con:
         tr = con.transaction()
         await tr.start()
         try:
@@ -238,67 +2320,338 @@ async def create_user(body: CreateUser):
                 body.email,
                 body.telefone,
                 body.doc_cpf_cnpj,
-                bcrypt_sha256.hash("changeme"),
+                senha_hash,
                 body.tipo_pessoa
             )
             cid = await con.fetchval(sql_account, uid)
             await tr.commit()
+            invalidate_conta(uid)
+            # o cadastro não traz X-User-Id, então o middleware não marca:
+            # sem isso, a primeira leitura da conta nova pode cair na réplica
+            marcar_escrita(uid)
             return {"id_usuario": uid, "id_conta": cid}
         except Exception as e:
             await tr.rollback()
             raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/accounts")
+@app.post("/users/import", response_model=ImportOut)
+async def import_users_endpoint(
+    request: Request,
+    formato: Optional[str] = Query(default=None, pattern="^(csv|ndjson)$"),
+    x_import_token: Optional[str] = Header(default=None, alias="X-Import-Token"),
+):
+    """Importação em lote: corpo CSV (com cabeçalho) ou NDJSON, lido em stream.
+
+    Colunas: nome, email, doc_cpf_cnpj, senha ou senha_hash (bcrypt_sha256) e,
+    opcionais, telefone, tipo_pessoa, salario_mensal_cents.
+    """
+    if not IMPORT_TOKEN or not hmac.compare_digest(x_import_token or "", IMPORT_TOKEN):
+        raise HTTPException(status_code=403, detail="Importação não autorizada")
+    if formato is None:
+        formato = "ndjson" if "ndjson" in request.headers.get("content-type", "") else "csv"
+    return await import_users(db_acquire, _linhas(request.stream()), formato)
+
+@app.post("/accounts", response_model=AccountCreated)
 async def create_account(body: CreateAccount):
     q = """
         INSERT INTO tb_conta (id_usuario, numero_conta, agencia, saldo_cents)
         VALUES ($1, LPAD(($1)::text,8,'0'), '0001', 0)
         RETURNING id_conta
     """
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_acquire() as con:
         try:
             cid = await con.fetchval(q, body.id_usuario)
+            invalidate_conta(body.id_usuario)
             return {"id_conta": cid}
         except Exception as e:
             raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/accounts/{id_conta}")
+@app.get("/accounts/{id_conta}", response_model=AccountOut)
 async def get_account(id_conta: int):
     q = """
-        SELECT c.id_conta, u.nome, c.numero_conta, c.agencia, c.saldo_cents, c.status
+        SELECT c.id_conta, u.nome, c.numero_conta, c.agencia, fn_saldo_conta(c.id_conta) AS saldo_cents, c.status
         FROM tb_conta c
         JOIN tb_usuario u ON u.id_usuario=c.id_usuario
         WHERE c.id_conta=$1
     """
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_read() as con:
         row = await con.fetchrow(q, id_conta)
         if not row:
             raise HTTPException(status_code=404, detail="Conta não encontrada")
         return dict(row)
 
-@app.get("/me/summary/{id_usuario}")
+@app.get("/me/summary/{id_usuario}", response_model=SummaryOut, response_model_exclude_unset=True)
 async def me_summary(id_usuario: int):
     q = """
-        SELECT c.id_conta, c.numero_conta, c.agencia, c.saldo_cents, u.tipo_pessoa
+        SELECT c.id_conta, c.numero_conta, c.agencia, fn_saldo_conta(c.id_conta) AS saldo_cents, u.tipo_pessoa
         FROM tb_conta c
         JOIN tb_usuario u ON u.id_usuario=c.id_usuario
         WHERE c.id_usuario=$1
         LIMIT 1
     """
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_read(id_usuario) as con:
         row = await con.fetchrow(q, id_usuario)
         if not row:
             return {}
         return dict(row)
 
+# ---------- DASHBOARD ----------
+# Uma consulta, uma ida ao banco: o JSON sai pronto do Postgres e vai direto
+# para a resposta.
+_SQL_DASHBOARD = """
+    WITH conta AS (
+        SELECT c.id_conta, c.numero_conta, c.agencia, fn_saldo_conta(c.id_conta) AS saldo_cents,
+               u.tipo_pessoa
+        FROM tb_conta c
+        JOIN tb_usuario u ON u.id_usuario = c.id_usuario
+        WHERE c.id_usuario = $1
+        ORDER BY c.id_conta
+        LIMIT 1
+    ),
+    emprestimo AS (
+        SELECT e.*
+        FROM tb_emprestimo e
+        JOIN tb_conta c ON c.id_conta = e.id_conta
+        WHERE c.id_usuario = $1 AND e.status NOT IN ('paid', 'cancelled')
+        ORDER BY e.criado_em DESC
+        LIMIT 1
+    ),
+    parcelas AS (
+        SELECT p.id_parcela, p.num_parcela, p.vencimento, p.valor_cents, p.pago
+        FROM tb_parcela p
+        WHERE p.id_emprestimo = (SELECT id_emprestimo FROM emprestimo)
+    ),
+    recentes AS (
+        SELECT * FROM (
+            (SELECT t.id_transacao, t.criado_em, t.tipo, t.status, t.valor_cents, t.referencia,
+                    t.id_conta_de, t.id_conta_para, t.id_comerciante, 'debito' AS direcao
+             FROM tb_transacao t
+             WHERE t.id_conta_de = (SELECT id_conta FROM conta)
+             ORDER BY t.criado_em DESC, t.id_transacao DESC LIMIT $2)
+            UNION ALL
+            (SELECT t.id_transacao, t.criado_em, t.tipo, t.status, t.valor_cents, t.referencia,
+                    t.id_conta_de, t.id_conta_para, t.id_comerciante, 'credito' AS direcao
+             FROM tb_transacao t
+             WHERE t.id_conta_para = (SELECT id_conta FROM conta)
+               AND t.id_conta_de IS DISTINCT FROM t.id_conta_para
+             ORDER BY t.criado_em DESC, t.id_transacao DESC LIMIT $2)
+        ) s
+        ORDER BY criado_em DESC, id_transacao DESC
+        LIMIT $2
+    )
+    SELECT (SELECT id_conta FROM conta) AS id_conta,
+           json_build_object(
+               'resumo', (SELECT row_to_json(conta) FROM conta),
+               'emprestimo', (SELECT row_to_json(emprestimo) FROM emprestimo),
+               'parcelas', coalesce((SELECT json_agg(parcelas ORDER BY num_parcela) FROM parcelas), '[]'),
+               'transacoes', coalesce((SELECT json_agg(recentes ORDER BY criado_em DESC, id_transacao DESC)
+                                       FROM recentes), '[]')
+           )::text AS corpo
+"""
+
+def _dashboard_headers(etag: str) -> dict:
+    # o navegador revalida com If-None-Match; Vary separa usuários no cache
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "X-User-Id"}
+
+@app.get("/me/dashboard", response_model=DashboardOut)
+async def me_dashboard(
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+    if_none_match: Optional[str] = Header(default=None, alias="If-None-Match"),
+):
+    """Resumo, empréstimo ativo, parcelas e transações recentes em uma chamada."""
+    user_id = _int_or_none(x_user_id)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+
+    if if_none_match and _escritas.get(user_id) is None:
+        etag = dashboard_etag(user_id)
+        if etag is not None and etag == if_none_match:
+            return Response(status_code=304, headers=_dashboard_headers(etag))
+
+    # primário de propósito: um ETag calculado sobre a réplica atrasada
+    # ficaria válido até o próximo movimento
+    lido_em = time.monotonic()
+    async with db_acquire() as con:
+        row = await con.fetchrow(_SQL_DASHBOARD, user_id, DASHBOARD_RECENT_TX)
+    corpo = row["corpo"].encode()
+    etag = '"' + hashlib.blake2b(corpo, digest_size=16).hexdigest() + '"'
+    if row["id_conta"] is not None:
+        guardar_dashboard(user_id, row["id_conta"], etag, lido_em)
+    if etag == if_none_match:
+        return Response(status_code=304, headers=_dashboard_headers(etag))
+    return Response(corpo, media_type="application/json", headers=_dashboard_headers(etag))
+
+# ---------- EXTRATO ----------
+_STATEMENT_COLS = """
+    t.id_transacao, t.criado_em, t.tipo, t.status, t.valor_cents, t.referencia,
+    t.id_conta_de, t.id_conta_para, t.id_comerciante
+"""
+
+def encode_cursor(criado_em: datetime, id_transacao: int) -> str:
+    raw = f"{criado_em.isoformat()}|{id_transacao}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        criado_em, id_transacao = raw.split("|")
+        return datetime.fromisoformat(criado_em), int(id_transacao)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def statement_query(
+    id_conta: int,
+    tipo: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    apos: Optional[tuple] = None,
+    limite: Optional[int] = None,
+):
+    """SQL + argumentos do extrato, do mais recente para o mais antigo.
+
+    Cada lado (débito/crédito) é lido pelo seu índice
+    (id_conta_x, criado_em DESC, id_transacao DESC) e os dois são
+    intercalados; a página seguinte parte do par (criado_em, id_transacao)
+    do último item, sem OFFSET.
+    """
+    args = [id_conta]
+    cond = []
+    if tipo is not None:
+        args.append(tipo)
+        cond.append(f"t.tipo = ${len(args)}::transaction_type")
+    if de is not None:
+        args.append(de)
+        cond.append(f"t.criado_em >= ${len(args)}")
+    if ate is not None:
+        args.append(ate)
+        cond.append(f"t.criado_em < ${len(args)}")
+    if apos is not None:
+        args.append(apos[0])
+        args.append(apos[1])
+        cond.append(f"(t.criado_em, t.id_transacao) < (${len(args) - 1}, ${len(args)})")
+    extra = "".join(f" AND {c}" for c in cond)
+    order = " ORDER BY criado_em DESC, id_transacao DESC"
+    lim = ""
+    if limite is not None:
+        args.append(limite)
+        lim = f" LIMIT ${len(args)}"
+    sql = f"""
+        SELECT * FROM (
+            (SELECT {_STATEMENT_COLS}, 'debito' AS direcao
+             FROM tb_transacao t
+             WHERE t.id_conta_de = $1{extra}
+             ORDER BY t.criado_em DESC, t.id_transacao DESC{lim})
+            UNION ALL
+            (SELECT {_STATEMENT_COLS}, 'credito' AS direcao
+             FROM tb_transacao t
+             WHERE t.id_conta_para = $1 AND t.id_conta_de IS DISTINCT FROM $1{extra}
+             ORDER BY t.criado_em DESC, t.id_transacao DESC{lim})
+        ) s{order}{lim}
+    """
+    return sql, args
+
+def _sem_fuso(v: Optional[datetime]) -> Optional[datetime]:
+    # criado_em é TIMESTAMP sem fuso (UTC); "...Z"/"+03:00" viram UTC ingênuo
+    if v is not None and v.tzinfo is not None:
+        return v.astimezone(timezone.utc).replace(tzinfo=None)
+    return v
+
+def validate_statement_filters(tipo: Optional[str], de: Optional[datetime], ate: Optional[datetime]):
+    """(de, ate) sem fuso horário, já validados."""
+    if tipo is not None and tipo not in TRANSACTION_TYPES:
+        raise HTTPException(status_code=400, detail="Tipo de transação inválido")
+    de, ate = _sem_fuso(de), _sem_fuso(ate)
+    if de is not None and ate is not None and de >= ate:
+        raise HTTPException(status_code=400, detail="Intervalo de datas inválido")
+    return de, ate
+
+async def check_account_owner(con, id_conta: int, user_id: Optional[int]):
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    conta = await resolve_conta(con, user_id)
+    if conta is not None and conta["id_conta"] == id_conta:
+        return
+    dono = await con.fetchval(
+        "SELECT 1 FROM tb_conta WHERE id_conta=$1 AND id_usuario=$2",
+        id_conta,
+        user_id,
+    )
+    if not dono:
+        raise HTTPException(status_code=404, detail="Conta não encontrada")
+
+@app.get("/accounts/{id_conta}/events", response_class=StreamingResponse)
+async def account_events(
+    id_conta: int,
+    user_id: Optional[int] = Query(default=None),
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+):
+    """Server-Sent Events de saldo e transações da conta.
+
+    O EventSource do navegador não manda cabeçalhos, então o usuário pode vir
+    em ?user_id=. Atrás do nginx, X-Accel-Buffering: no desliga o buffer do
+    proxy para este stream.
+    """
+    user_id = _int_or_none(x_user_id) or user_id
+    if _sse_assinantes >= SSE_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Limite de conexões de eventos atingido",
+                            headers={"Retry-After": "5"})
+    async with db_read(user_id) as con:
+        await check_account_owner(con, id_conta, user_id)
+    return StreamingResponse(
+        sse_stream(id_conta),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/accounts/{id_conta}/statement", response_model=StatementPage)
+async def account_statement(
+    id_conta: int,
+    tipo: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(default=50, ge=1),
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+):
+    user_id = _int_or_none(x_user_id)
+    de, ate = validate_statement_filters(tipo, de, ate)
+    limite = min(limite, STATEMENT_PAGE_MAX)
+    apos = decode_cursor(cursor) if cursor else None
+
+    sql, args = statement_query(id_conta, tipo, de, ate, apos, limite + 1)
+    async with db_read(user_id) as con:
+        await check_account_owner(con, id_conta, user_id)
+        rows = await con.fetch(sql, *args)
+
+    proximo = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        ultimo = rows[-1]
+        proximo = encode_cursor(ultimo["criado_em"], ultimo["id_transacao"])
+    return records_response({"id_conta": id_conta, "itens": rows, "proximo_cursor": proximo})
+
+@app.get("/accounts/{id_conta}/statement/export", response_class=StreamingResponse)
+async def export_statement(
+    id_conta: int,
+    formato: str = "csv",
+    tipo: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+):
+    user_id = _int_or_none(x_user_id)
+    de, ate = validate_statement_filters(tipo, de, ate)
+    async with db_read(user_id) as con:
+        await check_account_owner(con, id_conta, user_id)
+    sql, args = statement_query(id_conta, tipo, de, ate)
+    return export_response(sql, args, formato, f"extrato-{id_conta}", user_id)
+
 # ---------- DEPÓSITO ----------
-@app.post("/accounts/deposit")
+@app.post("/accounts/deposit", response_model=DepositOut)
 async def deposit(
     body: Deposit,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
 ):
     user_id = _int_or_none(x_user_id)
 
@@ -308,61 +2661,66 @@ async def deposit(
     if body.valor_cents is None or body.valor_cents <= 0:
         raise HTTPException(status_code=400, detail="Valor inválido para depósito")
 
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        tr = con.transaction()
-        await tr.start()
-        try:
-            id_conta = body.id_conta
-            if not id_conta:
-                row = await con.fetchrow(
-                    "SELECT id_conta FROM tb_conta WHERE id_usuario=$1",
-                    user_id,
+    replay = idempotency_replay("deposit", user_id, idempotency_key, body)
+    if replay is not None:
+        return replay
+
+    async with db_acquire() as con:
+        async with idempotent(con, "deposit", user_id, idempotency_key, body) as idem:
+            if idem.replay is not None:
+                return idem.replay
+            tr = con.transaction()
+            await tr.start()
+            try:
+                id_conta = body.id_conta
+                if not id_conta:
+                    row = await resolve_conta(con, user_id)
+                    if not row:
+                        raise HTTPException(status_code=400, detail="Conta não localizada")
+                    id_conta = row["id_conta"]
+
+                tid = await con.fetchval(
+                    """
+                    INSERT INTO tb_transacao (id_conta_para, tipo, valor_cents, status, referencia)
+                    VALUES ($1, 'deposit', $2, 'confirmed', $3)
+                    RETURNING id_transacao
+                    """,
+                    id_conta,
+                    body.valor_cents,
+                    body.referencia or "DEP-API",
                 )
-                if not row:
-                    raise HTTPException(status_code=400, detail="Conta não localizada")
-                id_conta = row["id_conta"]
-
-            tid = await con.fetchval(
-                """
-                INSERT INTO tb_transacao (id_conta_para, tipo, valor_cents, status, referencia)
-                VALUES ($1, 'deposit', $2, 'confirmed', $3)
-                RETURNING id_transacao
-                """,
-                id_conta,
-                body.valor_cents,
-                body.referencia or "DEP-API",
-            )
 
-            await tr.commit()
-            return {
-                "status": "ok",
-                "id_conta": id_conta,
-                "id_transacao": tid,
-                "creditado_cents": body.valor_cents,
-            }
-
-        except HTTPException:
-            await tr.rollback()
-            raise
-        except asyncpg.PostgresError as db_err:
-            await tr.rollback()
-            raise HTTPException(
-                status_code=400,
-                detail=f"Falha no depósito: {db_err}",
-            )
-        except Exception as e:
-            await tr.rollback()
-            raise HTTPException(
-                status_code=400,
-                detail=f"Falha no depósito: {e}",
-            )
+                resposta = await idem.salvar({
+                    "status": "ok",
+                    "id_conta": id_conta,
+                    "id_transacao": tid,
+                    "creditado_cents": body.valor_cents,
+                })
+                await tr.commit()
+                return resposta
+
+            except HTTPException:
+                await tr.rollback()
+                raise
+            except asyncpg.PostgresError as db_err:
+                await tr.rollback()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Falha no depósito: {db_err}",
+                )
+            except Exception as e:
+                await tr.rollback()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Falha no depósito: {e}",
+                )
 
 # ---------- PAGAMENTOS ----------
-@app.post("/payments")
+@app.post("/payments", response_model=TransactionRef)
 async def make_payment(
     body: Payment,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
 ):
     user_id = _int_or_none(x_user_id)
     q = """
@@ -370,38 +2728,40 @@ async def make_payment(
         VALUES ($1, $2, 'payment', $3, 'confirmed', $4)
         RETURNING id_transacao
     """
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        try:
-            if user_id:
-                c = await con.fetchrow(
-                    "SELECT id_conta FROM tb_conta WHERE id_usuario=$1",
-                    user_id,
+    replay = idempotency_replay("payments", user_id, idempotency_key, body)
+    if replay is not None:
+        return replay
+
+    async with db_acquire() as con:
+        async with idempotent(con, "payments", user_id, idempotency_key, body) as idem:
+            if idem.replay is not None:
+                return idem.replay
+            try:
+                if user_id:
+                    c = await resolve_conta(con, user_id)
+                    if not c:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="Conta não localizada para o usuário",
+                        )
+                    body.id_conta_de = c["id_conta"]
+                tid = await con.fetchval(
+                    q,
+                    body.id_conta_de,
+                    body.id_comerciante,
+                    body.valor_cents,
+                    body.referencia or "API-PAY",
                 )
-                if not c:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Conta não localizada para o usuário",
-                    )
-                body.id_conta_de = c["id_conta"]
-            tid = await con.fetchval(
-                q,
-                body.id_conta_de,
-                body.id_comerciante,
-                body.valor_cents,
-                body.referencia or "API-PAY",
-            )
-            return {"id_transacao": tid}
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
+                return await idem.salvar({"id_transacao": tid})
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/payments/utility")
+@app.post("/payments/utility", response_model=TransactionRef)
 async def make_utility_payment(
     body: UtilityPayment,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
     
     if user_id is None:
         raise HTTPException(status_code=401, detail="Não autenticado")
@@ -409,12 +2769,9 @@ async def make_utility_payment(
     if body.id_comerciante not in ALLOWED_UTILITY_MERCHANT_IDS:
         raise HTTPException(status_code=400, detail="ID de comerciante de utilidade inválido.")
     
-    async with pool.acquire() as con:
+    async with db_acquire() as con:
         try:
-            conta_origem = await con.fetchrow(
-                "SELECT id_conta FROM tb_conta WHERE id_usuario=$1",
-                user_id,
-            )
+            conta_origem = await resolve_conta(con, user_id)
             if not conta_origem:
                 raise HTTPException(status_code=400, detail="Conta de origem não localizada.")
             id_conta_de = conta_origem["id_conta"]
@@ -438,147 +2795,325 @@ async def make_utility_payment(
             raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/transfers")
+@app.post("/transfers", response_model=TransferOut)
 async def make_transfer(
     body: Transfer,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Não autenticado")
-
-        if body.valor_cents <= 0:
-            raise HTTPException(status_code=400, detail="Valor de transferência inválido")
-
-        try:
-            conta_origem = await con.fetchrow(
-                "SELECT id_conta FROM tb_conta WHERE id_usuario=$1",
-                user_id,
-            )
-            if not conta_origem:
-                raise HTTPException(status_code=400, detail="Conta de origem não localizada.")
-            id_conta_de = conta_origem["id_conta"]
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Não autenticado")
 
-            conta_destino = await con.fetchrow(
-                """
-                SELECT c.id_conta, u.nome
-                FROM tb_conta c JOIN tb_usuario u ON c.id_usuario = u.id_usuario
-                WHERE u.doc_cpf_cnpj = $1 OR c.id_conta::text = $1
-                """,
-                body.identificador,
-            )
-            if not conta_destino:
-                raise HTTPException(status_code=404, detail="Chave Pix (CPF, CNPJ ou ID) não encontrada.")
+    if body.valor_cents is None or body.valor_cents <= 0:
+        raise HTTPException(status_code=400, detail="Valor de transferência inválido")
+
+    replay = idempotency_replay("transfers", user_id, idempotency_key, body)
+    if replay is not None:
+        return replay
+
+    async with db_acquire() as con:
+        async with idempotent(con, "transfers", user_id, idempotency_key, body) as idem:
+            if idem.replay is not None:
+                return idem.replay
+            try:
+                conta_origem = await resolve_conta(con, user_id)
+                if not conta_origem:
+                    raise HTTPException(status_code=400, detail="Conta de origem não localizada.")
+                id_conta_de = conta_origem["id_conta"]
+
+                conta_destino = await resolve_pix_key(con, body.identificador)
+                if not conta_destino:
+                    raise HTTPException(status_code=404, detail="Chave Pix (CPF, CNPJ ou ID) não encontrada.")
             
-            id_conta_para = conta_destino["id_conta"]
-            nome_destino = conta_destino["nome"]
+                id_conta_para, nome_destino = conta_destino
+
+                if id_conta_de == id_conta_para:
+                    raise HTTPException(status_code=400, detail="Não é possível transferir para a mesma conta.")
+
+                tid = await con.fetchval(
+                    """
+                    INSERT INTO tb_transacao (id_conta_de, id_conta_para, tipo, valor_cents, status, referencia)
+                    VALUES ($1, $2, 'transfer', $3, 'confirmed', 'PIX-' || $4)
+                    RETURNING id_transacao
+                    """,
+                    id_conta_de,
+                    id_conta_para,
+                    body.valor_cents,
+                    body.identificador,
+                )
 
-            if id_conta_de == id_conta_para:
-                raise HTTPException(status_code=400, detail="Não é possível transferir para a mesma conta.")
+                return await idem.salvar({
+                    "id_transacao": tid,
+                    "nome_destino": nome_destino,
+                    "valor_cents": body.valor_cents,
+                })
+
+            except asyncpg.exceptions.RaiseError as db_err:
+                raise HTTPException(status_code=400, detail=str(db_err))
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Erro ao processar transferência: {e}")
+
+# ---------- LOTES ----------
+# Um acquire, uma resolução de conta e uma única ida ao banco para o lote
+# inteiro. atomico=True: INSERT multi-linha numa transação (tudo ou nada).
+# atomico=False: fn_inserir_lote, com resultado por item.
+# O id vem da sequência junto com o ordinal do item (CTE materializada,
+# nextval uma vez por linha): a ordem de alocação não precisa bater com a
+# do lote para devolver cada id no índice certo.
+_SQL_LOTE_ATOMICO = """
+    WITH i AS MATERIALIZED (
+        SELECT nextval('tb_transacao_id_transacao_seq') AS id_transacao, i.*
+        FROM unnest($3::bigint[], $4::bigint[], $5::bigint[], $6::text[])
+             WITH ORDINALITY AS i(id_conta_para, id_comerciante, valor_cents, referencia, n)
+    ), novas AS (
+        INSERT INTO tb_transacao (id_transacao, id_conta_de, id_conta_para, id_comerciante, tipo,
+                                  valor_cents, status, referencia)
+        SELECT id_transacao, $1, id_conta_para, id_comerciante, $2::transaction_type,
+               valor_cents, 'confirmed', referencia
+        FROM i ORDER BY n
+        RETURNING id_transacao
+    )
+    SELECT i.n, i.id_transacao FROM i JOIN novas USING (id_transacao) ORDER BY i.n
+"""
+
+def _check_batch_size(itens: list):
+    if not itens:
+        raise HTTPException(status_code=400, detail="Lote vazio")
+    if len(itens) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Lote excede o limite de {BATCH_MAX_ITEMS} itens",
+        )
 
-            tid = await con.fetchval(
-                """
-                INSERT INTO tb_transacao (id_conta_de, id_conta_para, tipo, valor_cents, status, referencia)
-                VALUES ($1, $2, 'transfer', $3, 'confirmed', 'PIX-' || $4)
-                RETURNING id_transacao
-                """,
-                id_conta_de,
-                id_conta_para,
-                body.valor_cents,
-                body.identificador,
-            )
+async def _insert_batch(con, tipo, id_conta_de, contas_para, comerciantes, valores, referencias, atomico):
+    if atomico:
+        try:
+            async with con.transaction():
+                rows = await con.fetch(
+                    _SQL_LOTE_ATOMICO,
+                    id_conta_de, tipo, contas_para, comerciantes, valores, referencias,
+                )
+        except asyncpg.PostgresError as db_err:
+            raise HTTPException(status_code=400, detail=f"Lote rejeitado: {db_err}")
+        return {
+            "status": "ok",
+            "confirmados": len(rows),
+            "total_cents": sum(valores),
+            "itens": [{"indice": r["n"] - 1, "id_transacao": r["id_transacao"]} for r in rows],
+        }
 
-            return {
-                "id_transacao": tid,
-                "nome_destino": nome_destino,
-                "valor_cents": body.valor_cents,
-            }
+    rows = await con.fetch(
+        "SELECT ordem, transacao, erro FROM fn_inserir_lote($1::transaction_type, $2, $3, $4, $5, $6)",
+        tipo, id_conta_de, contas_para, comerciantes, valores, referencias,
+    )
+    itens = []
+    confirmados = 0
+    for r in rows:
+        if r["erro"] is None:
+            confirmados += 1
+            itens.append({"indice": r["ordem"] - 1, "id_transacao": r["transacao"]})
+        else:
+            itens.append({"indice": r["ordem"] - 1, "erro": r["erro"]})
+    return {
+        "status": "ok" if confirmados == len(rows) else "parcial",
+        "confirmados": confirmados,
+        "falhas": len(rows) - confirmados,
+        "itens": itens,
+    }
+
+@app.post("/payments/batch", response_model=BatchOut, response_model_exclude_unset=True)
+async def make_payment_batch(
+    body: PaymentBatch,
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+):
+    user_id = _int_or_none(x_user_id)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    _check_batch_size(body.itens)
+
+    erros = []
+    for i, item in enumerate(body.itens):
+        if item.id_comerciante is None:
+            erros.append({"indice": i, "erro": "Comerciante obrigatório"})
+        elif item.valor_cents is None or item.valor_cents <= 0:
+            erros.append({"indice": i, "erro": "Valor inválido"})
+    if erros:
+        raise HTTPException(status_code=400, detail=erros)
+
+    async with db_acquire() as con:
+        conta = await resolve_conta(con, user_id)
+        if not conta:
+            raise HTTPException(status_code=400, detail="Conta não localizada para o usuário")
+
+        comerciantes = [item.id_comerciante for item in body.itens]
+        existentes = {
+            r["id_comerciante"]
+            for r in await con.fetch(
+                "SELECT id_comerciante FROM tb_comerciante WHERE id_comerciante = ANY($1::bigint[])",
+                list(set(comerciantes)),
+            )
+        }
+        erros = [
+            {"indice": i, "erro": "Comerciante não encontrado"}
+            for i, c in enumerate(comerciantes)
+            if c not in existentes
+        ]
+        if erros:
+            raise HTTPException(status_code=400, detail=erros)
+
+        return await _insert_batch(
+            con,
+            "payment",
+            conta["id_conta"],
+            [None] * len(body.itens),
+            comerciantes,
+            [item.valor_cents for item in body.itens],
+            [item.referencia or "API-PAY" for item in body.itens],
+            body.atomico,
+        )
 
-        except asyncpg.exceptions.RaiseError as db_err:
-            raise HTTPException(status_code=400, detail=str(db_err))
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao processar transferência: {e}")
+@app.post("/transfers/batch", response_model=BatchOut, response_model_exclude_unset=True)
+async def make_transfer_batch(
+    body: TransferBatch,
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+):
+    user_id = _int_or_none(x_user_id)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    _check_batch_size(body.itens)
+
+    erros = [
+        {"indice": i, "erro": "Valor de transferência inválido"}
+        for i, item in enumerate(body.itens)
+        if item.valor_cents is None or item.valor_cents <= 0
+    ]
+    if erros:
+        raise HTTPException(status_code=400, detail=erros)
+
+    async with db_acquire() as con:
+        conta = await resolve_conta(con, user_id)
+        if not conta:
+            raise HTTPException(status_code=400, detail="Conta de origem não localizada.")
+        id_conta_de = conta["id_conta"]
+
+        destinos = await resolve_pix_keys(con, [item.identificador for item in body.itens])
+
+        contas_para = []
+        for i, item in enumerate(body.itens):
+            destino = destinos[item.identificador]
+            if destino is None:
+                erros.append({"indice": i, "erro": "Chave Pix não encontrada"})
+            elif destino[0] == id_conta_de:
+                erros.append({"indice": i, "erro": "Não é possível transferir para a mesma conta"})
+            else:
+                contas_para.append(destino[0])
+        if erros:
+            raise HTTPException(status_code=400, detail=erros)
+
+        return await _insert_batch(
+            con,
+            "transfer",
+            id_conta_de,
+            contas_para,
+            [None] * len(body.itens),
+            [item.valor_cents for item in body.itens],
+            [f"PIX-{item.identificador}" for item in body.itens],
+            body.atomico,
+        )
 
 # ---------- EMPRÉSTIMOS ----------
 def monthly_rate_from_aa(aa_pct: float) -> float:
     return float((1 + aa_pct / 100.0) ** (1.0 / 12.0) - 1.0)
 
-@app.post("/loans/simulate")
+@app.post("/loans/simulate", response_model=LoanSimOut)
 async def simulate_loan(
     body: LoanSim,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Não autenticado")
-        
-        if body.prazo_meses is None or body.prazo_meses <= 0:
-            raise HTTPException(status_code=400, detail="Prazo inválido")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    
+    if body.prazo_meses is None or body.prazo_meses <= 0:
+        raise HTTPException(status_code=400, detail="Prazo inválido")
 
-        # 1. Obter Salário Mensal para calcular LIMITE MÁXIMO
-        c = await con.fetchrow(
-            "SELECT salario_mensal_cents FROM tb_conta WHERE id_usuario=$1",
-            user_id,
-        )
-        if not c:
-            raise HTTPException(status_code=400, detail="Conta não localizada")
-        
-        salario = c["salario_mensal_cents"]
-        parcela_max_limit = int(round(salario * 0.30))
+    # Salário Mensal para calcular LIMITE MÁXIMO
+    async with db_acquire() as con:
+        c = await resolve_conta(con, user_id)
+    if not c:
+        raise HTTPException(status_code=400, detail="Conta não localizada")
 
-        # 2. Definir Juros Dinâmico
-        juros_aa_pct = get_dynamic_interest_aa(body.prazo_meses)
-        jm = monthly_rate_from_aa(juros_aa_pct)
+    return avaliar_emprestimo(c["salario_mensal_cents"], body.principal_cents, body.prazo_meses)
 
-        # 3. Calcular Limite Máximo
-        if jm == 0:
-            principal_max = parcela_max_limit * body.prazo_meses
-        else:
-            principal_max = int(
-                round(
-                    parcela_max_limit
-                    * (((1 + jm) ** body.prazo_meses - 1)
-                       / (jm * (1 + jm) ** body.prazo_meses))
-                )
-            )
+@app.post("/loans/simulate/grid", response_model=LoanGridOut)
+async def simulate_loan_grid(
+    body: LoanGrid,
+    x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+):
+    user_id = _int_or_none(x_user_id)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    principais = body.principais_cents or []
+    if len(principais) > LOAN_GRID_MAX_PRINCIPAIS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {LOAN_GRID_MAX_PRINCIPAIS} valores por simulação",
+        )
 
-        # 4. Calcular Parcela para o valor SOLICITADO pelo usuário
-        if body.principal_cents is None or body.principal_cents <= 0:
-             pmt_cents = 0
-        else:
-             pmt_cents = calculate_pmt_cents(
-                 body.principal_cents, juros_aa_pct, body.prazo_meses
-             )
-        
-        return {
+    async with db_acquire() as con:
+        c = await resolve_conta(con, user_id)
+    if not c:
+        raise HTTPException(status_code=400, detail="Conta não localizada")
+
+    parcela_max_limit, linhas = tabela_ofertas(c["salario_mensal_cents"])
+    pmts = _pmt_grade(body.principal_cents) if body.principal_cents else None
+    prazos = []
+    for k, (prazo, juros_aa_pct, juros_mensal_pct, principal_max) in enumerate(linhas):
+        item = {
+            "prazo_meses": prazo,
             "juros_aa_pct": juros_aa_pct,
-            "parcela_max_limit_cents": parcela_max_limit,
+            "juros_mensal_pct": juros_mensal_pct,
             "principal_max_cents": principal_max,
-            "pmt_cents": pmt_cents,
-            "juros_mensal_pct": jm * 100.0,
-            "validation_ok": body.principal_cents <= principal_max
         }
-
-@app.post("/loans/create")
+        if pmts is not None:
+            item["pmt_cents"] = pmts[k]
+            item["validation_ok"] = body.principal_cents <= principal_max
+        prazos.append(item)
+
+    grade = []
+    for principal in principais:
+        grade.append({
+            "principal_cents": principal,
+            "pmt_cents": _pmt_grade(principal),
+            "validation_ok": [principal <= linha[3] for linha in linhas],
+        })
+
+    # só tipos nativos: vai direto para o orjson, sem validar a grade inteira
+    return ORJSONResponse({
+        "parcela_max_limit_cents": parcela_max_limit,
+        "prazos": prazos,
+        "grade": grade,
+    })
+
+@app.post("/loans/create", response_model=LoanCreated)
 async def create_loan2(
     body: LoanRequest,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Não autenticado")
-        c = await con.fetchrow(
-            "SELECT id_conta, salario_mensal_cents FROM tb_conta WHERE id_usuario=$1",
-            user_id,
-        )
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Não autenticado")
+    if body.prazo_meses is None or body.prazo_meses <= 0:
+        raise HTTPException(status_code=400, detail="Prazo inválido")
+    if body.principal_cents is None or body.principal_cents <= 0:
+        raise HTTPException(status_code=400, detail="Valor inválido")
+
+    # Uma conexão e uma leitura de salário (via resolve_conta) por criação
+    async with db_acquire() as con:
+        c = await resolve_conta(con, user_id)
         if not c:
             raise HTTPException(status_code=400, detail="Conta não localizada")
         id_conta = c["id_conta"]
@@ -596,16 +3131,10 @@ async def create_loan2(
                 detail="Usuário já possui empréstimo ativo",
             )
         
-        # 1. Determinar Juros e simular limite para validação
-        juros_final = get_dynamic_interest_aa(body.prazo_meses)
-        
-        # Simula a validação de limite
-        sim = await simulate_loan(
-            LoanSim(principal_cents=body.principal_cents, prazo_meses=body.prazo_meses),
-            x_user_id=user_id,
-        )
+        # Juros e validação de limite, sem nova ida ao banco
+        sim = avaliar_emprestimo(c["salario_mensal_cents"], body.principal_cents, body.prazo_meses)
 
-        if body.principal_cents > sim["principal_max_cents"]:
+        if not sim["validation_ok"]:
             raise HTTPException(
                 status_code=400,
                 detail="Valor solicitado excede o limite permitido pela renda",
@@ -619,7 +3148,7 @@ async def create_loan2(
                 """,
                 id_conta,
                 body.principal_cents,
-                juros_final,
+                sim["juros_aa_pct"],
                 body.prazo_meses,
             )
             await con.execute("CALL sp_conceder_emprestimo($1)", id_emp)
@@ -627,13 +3156,12 @@ async def create_loan2(
         except Exception as e:
             raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/loans/current")
+@app.get("/loans/current", response_model=LoanOut, response_model_exclude_unset=True)
 async def current_loan(
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_read(user_id) as con:
         if not user_id:
             return {}
         row = await con.fetchrow(
@@ -650,10 +3178,44 @@ async def current_loan(
         )
         return dict(row) if row else {}
 
-@app.get("/loans/{id_emprestimo}/installments")
+@app.get("/loans/overdue", response_model=OverduePage)
+async def list_overdue_loans(
+    cursor: Optional[int] = None,
+    limite: int = Query(default=100, ge=1),
+):
+    """Empréstimos em atraso (status mantido pelo job), paginados por id."""
+    limite = min(limite, OVERDUE_PAGE_MAX)
+    async with db_read() as con:
+        rows = await con.fetch(
+            """
+            SELECT e.id_emprestimo, e.id_conta, c.id_usuario, e.principal_cents, e.prazo_meses,
+                   e.iniciado_em, a.parcelas_vencidas, a.valor_vencido_cents, a.primeiro_vencimento,
+                   CURRENT_DATE - a.primeiro_vencimento AS dias_em_atraso
+            FROM tb_emprestimo e
+            JOIN tb_conta c ON c.id_conta = e.id_conta
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) AS parcelas_vencidas, SUM(p.valor_cents) AS valor_vencido_cents,
+                       MIN(p.vencimento) AS primeiro_vencimento
+                FROM tb_parcela p
+                WHERE p.id_emprestimo = e.id_emprestimo AND p.pago = FALSE
+                  AND p.vencimento < CURRENT_DATE
+            ) a
+            WHERE e.status = 'in_arrears' AND e.id_emprestimo > $1
+            ORDER BY e.id_emprestimo
+            LIMIT $2
+            """,
+            cursor or 0,
+            limite + 1,
+        )
+    proximo = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        proximo = rows[-1]["id_emprestimo"]
+    return records_response({"itens": rows, "proximo_cursor": proximo})
+
+@app.get("/loans/{id_emprestimo}/installments", response_model=List[InstallmentOut])
 async def list_installments(id_emprestimo: int):
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_read() as con:
         rows = await con.fetch(
             """
             SELECT id_parcela, num_parcela, vencimento, valor_cents, pago
@@ -663,47 +3225,47 @@ async def list_installments(id_emprestimo: int):
             """,
             id_emprestimo,
         )
-        return [dict(r) for r in rows]
+    return records_response(rows)
 
-@app.post("/installments/pay")
+@app.post("/installments/pay", response_model=StatusOut)
 async def pay_installment(
     body: PayInstallment,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        try:
-            if user_id and (not body.id_conta or body.id_conta == 0):
-                c = await con.fetchrow(
-                    "SELECT id_conta FROM tb_conta WHERE id_usuario=$1",
-                    user_id,
-                )
-                if not c:
-                    raise HTTPException(status_code=400, detail="Conta não localizada")
-                body.id_conta = c["id_conta"]
-            await con.execute("CALL sp_pagar_parcela($1,$2)", body.id_parcela, body.id_conta)
-            return {"status": "ok"}
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
+    replay = idempotency_replay("installments", user_id, idempotency_key, body)
+    if replay is not None:
+        return replay
+
+    async with db_acquire() as con:
+        async with idempotent(con, "installments", user_id, idempotency_key, body) as idem:
+            if idem.replay is not None:
+                return idem.replay
+            try:
+                if user_id and (not body.id_conta or body.id_conta == 0):
+                    c = await resolve_conta(con, user_id)
+                    if not c:
+                        raise HTTPException(status_code=400, detail="Conta não localizada")
+                    body.id_conta = c["id_conta"]
+                await con.execute("CALL sp_pagar_parcela($1,$2)", body.id_parcela, body.id_conta)
+                return await idem.salvar({"status": "ok"})
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/loans/pay_full")
+@app.post("/loans/pay_full", response_model=PayFullOut)
 async def pay_full_loan(
     body: PayFullLoan,
     x_user_id: Optional[int] = Header(default=None, alias="X-User-Id"),
 ):
     user_id = _int_or_none(x_user_id)
-    pool = await get_pool()
-    async with pool.acquire() as con:
+    async with db_acquire() as con:
         try:
             if not user_id:
                 raise HTTPException(status_code=401, detail="Não autenticado")
                 
             if not body.id_conta or body.id_conta == 0:
-                c = await con.fetchrow(
-                    "SELECT id_conta FROM tb_conta WHERE id_usuario=$1",
-                    user_id,
-                )
+                c = await resolve_conta(con, user_id)
                 if not c:
                     raise HTTPException(status_code=400, detail="Conta não localizada")
                 body.id_conta = c["id_conta"]
@@ -715,10 +3277,44 @@ async def pay_full_loan(
                 raise HTTPException(status_code=400, detail=str(e))
             raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/reports/faturamento-mensal")
-async def report_faturamento():
-    q = "SELECT * FROM vw_faturamento_mensal ORDER BY mes DESC, total_cents DESC"
-    pool = await get_pool()
-    async with pool.acquire() as con:
-        rows = await con.fetch(q)
-        return [dict(r) for r in rows]
\ No newline at end of file
+def faturamento_query(
+    id_comerciante: Optional[int] = None,
+    mes_de: Optional[date] = None,
+    mes_ate: Optional[date] = None,
+):
+    """Consulta ao agregado mensal; mes_de/mes_ate são inclusivos."""
+    args = []
+    cond = []
+    if id_comerciante is not None:
+        args.append(id_comerciante)
+        cond.append(f"id_comerciante = ${len(args)}")
+    if mes_de is not None:
+        args.append(mes_de.replace(day=1))
+        cond.append(f"mes >= ${len(args)}")
+    if mes_ate is not None:
+        args.append(mes_ate.replace(day=1))
+        cond.append(f"mes <= ${len(args)}")
+    where = f" WHERE {' AND '.join(cond)}" if cond else ""
+    q = f"SELECT * FROM vw_faturamento_mensal{where} ORDER BY mes DESC, total_cents DESC"
+    return q, args
+
+@app.get("/reports/faturamento-mensal", response_model=List[FaturamentoOut])
+async def report_faturamento(
+    id_comerciante: Optional[int] = None,
+    mes_de: Optional[date] = None,
+    mes_ate: Optional[date] = None,
+):
+    q, args = faturamento_query(id_comerciante, mes_de, mes_ate)
+    async with db_read() as con:
+        rows = await con.fetch(q, *args)
+    return records_response(rows)
+
+@app.get("/reports/faturamento-mensal/export", response_class=StreamingResponse)
+async def export_faturamento(
+    formato: str = "csv",
+    id_comerciante: Optional[int] = None,
+    mes_de: Optional[date] = None,
+    mes_ate: Optional[date] = None,
+):
+    q, args = faturamento_query(id_comerciante, mes_de, mes_ate)
+    return export_response(q, args, formato, "faturamento-mensal")
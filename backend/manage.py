@@ -0,0 +1,390 @@
+"""Comandos de manutenção da FinPay.
+
+    python manage.py rebuild-faturamento [--de 2024-01] [--ate 2024-06]
+    python manage.py conceder-emprestimos [--lote 5000]
+    python manage.py limpar-idempotencia [--lote 5000]
+    python manage.py drenar-auditoria [--lote 5000]
+    python manage.py criar-particoes [--meses 3]
+    python manage.py arquivar-particoes --antes 2023-01 [--schema arquivo | --apagar]
+    python manage.py verificar-particoes [--conta 1]
+    python manage.py conta-quente --conta 11 [--desligar]
+    python manage.py consolidar-creditos
+    python manage.py consolidar-faturamento
+    python manage.py atualizar-atrasos
+    python manage.py importar-usuarios usuarios.csv [--formato ndjson] [--lote 20000]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+import asyncpg
+
+from main import (
+    DATABASE_URL,
+    IMPORT_BATCH_SIZE,
+    cleanup_idempotency,
+    drain_audit_queue,
+    _linhas,
+    fold_pending_billing,
+    fold_pending_credits,
+    import_users,
+    shutdown_import_pool,
+    statement_query,
+    update_arrears,
+)
+
+TABELAS_PARTICIONADAS = ("tb_transacao", "tb_auditoria")
+
+
+def _mes(v: str) -> date:
+    ano, mes = v.split("-")[:2]
+    return date(int(ano), int(mes), 1)
+
+
+def _somar_meses(d: date, meses: int) -> date:
+    n = d.year * 12 + d.month - 1 + meses
+    return date(n // 12, n % 12 + 1, 1)
+
+
+async def _particoes(con, tabela):
+    """[(nome, mês)] das partições mensais (<tabela>_pAAAAMM), em ordem."""
+    rows = await con.fetch(
+        """
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass AND c.relname ~ '_p[0-9]{6}$'
+        ORDER BY c.relname
+        """,
+        tabela,
+    )
+    return [(r["relname"], _mes(f"{r['relname'][-6:-2]}-{r['relname'][-2:]}")) for r in rows]
+
+
+async def rebuild_faturamento(args):
+    ate = args.ate
+    if ate is not None:
+        # --ate é inclusivo; a função recebe o limite exclusivo
+        ate = date(ate.year + ate.month // 12, ate.month % 12 + 1, 1)
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        linhas = await con.fetchval("SELECT fn_rebuild_faturamento_mensal($1, $2)", args.de, ate)
+        print(f"faturamento mensal reconstruído: {linhas} linhas")
+    finally:
+        await con.close()
+
+
+async def conceder_emprestimos(args):
+    """Concede todos os empréstimos 'approved', um lote por transação."""
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        ultimo = 0
+        total = 0
+        while True:
+            ids = [
+                r["id_emprestimo"]
+                for r in await con.fetch(
+                    """
+                    SELECT id_emprestimo FROM tb_emprestimo
+                    WHERE status = 'approved' AND id_emprestimo > $1
+                    ORDER BY id_emprestimo
+                    LIMIT $2
+                    """,
+                    ultimo,
+                    args.lote,
+                )
+            ]
+            if not ids:
+                break
+            async with con.transaction():
+                total += await con.fetchval("SELECT fn_conceder_emprestimos($1::bigint[])", ids)
+            ultimo = ids[-1]
+        print(f"empréstimos concedidos: {total}")
+    finally:
+        await con.close()
+
+
+async def limpar_idempotencia(args):
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        print(f"chaves de idempotência removidas: {await cleanup_idempotency(con, args.lote)}")
+    finally:
+        await con.close()
+
+
+async def drenar_auditoria(args):
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        print(f"eventos de auditoria gravados: {await drain_audit_queue(con, args.lote)}")
+    finally:
+        await con.close()
+
+
+async def criar_particoes(args):
+    """Garante partições do mês corrente até --meses à frente.
+
+    Linhas de um mês sem partição que caíram na default são movidas para a
+    partição nova na mesma transação (sql/20); a função avisa por NOTICE.
+    """
+    inicio = date.today().replace(day=1)
+    fim = _somar_meses(inicio, args.meses)
+    con = await asyncpg.connect(DATABASE_URL)
+    con.add_log_listener(lambda _con, aviso: print(aviso.message))
+    try:
+        for tabela in TABELAS_PARTICIONADAS:
+            criadas = await con.fetchval(
+                "SELECT fn_criar_particoes_mensais($1, $2, $3)", tabela, inicio, fim
+            )
+            print(f"{tabela}: {criadas} partições criadas até {fim:%Y-%m}")
+    finally:
+        await con.close()
+
+
+async def arquivar_particoes(args):
+    """Desanexa as partições de meses anteriores a --antes.
+
+    Por padrão as move para o schema --schema (consultáveis, fora das
+    varreduras da tabela principal); com --apagar, remove de vez.
+    """
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        if not args.apagar:
+            await con.execute(f'CREATE SCHEMA IF NOT EXISTS "{args.schema}"')
+        for tabela in TABELAS_PARTICIONADAS:
+            for nome, mes in await _particoes(con, tabela):
+                if mes >= args.antes:
+                    continue
+                async with con.transaction():
+                    await con.execute(f'ALTER TABLE {tabela} DETACH PARTITION "{nome}"')
+                    if args.apagar:
+                        await con.execute(f'DROP TABLE "{nome}"')
+                    else:
+                        await con.execute(f'ALTER TABLE "{nome}" SET SCHEMA "{args.schema}"')
+                destino = "apagada" if args.apagar else f"-> {args.schema}.{nome}"
+                print(f"{tabela}: {nome} {destino}")
+    finally:
+        await con.close()
+
+
+def _relacoes_do_plano(no, acc):
+    if "Relation Name" in no:
+        acc.add(no["Relation Name"])
+    for filho in no.get("Plans", []):
+        _relacoes_do_plano(filho, acc)
+    return acc
+
+
+async def _particoes_lidas(con, sql, *args):
+    plano = json.loads(await con.fetchval("EXPLAIN (FORMAT JSON) " + sql, *args))
+    return sorted(r for r in _relacoes_do_plano(plano[0]["Plan"], set()) if r.startswith("tb_transacao_"))
+
+
+async def verificar_particoes(args):
+    """Confere que as consultas quentes só leem as partições do período."""
+    hoje = date.today().replace(day=1)
+    proximo = _somar_meses(hoje, 1)
+    esperada = f"tb_transacao_p{hoje:%Y%m}"
+    de = datetime(hoje.year, hoje.month, 1)
+    ate = datetime(proximo.year, proximo.month, 1)
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        checagens = {}
+
+        sql, sql_args = statement_query(args.conta, de=de, ate=ate, limite=50)
+        lidas = await _particoes_lidas(con, sql, *sql_args)
+        checagens["extrato_mes_corrente"] = {"particoes": lidas, "ok": lidas == [esperada]}
+
+        lidas = await _particoes_lidas(
+            con,
+            """
+            SELECT t.id_comerciante, date_trunc('month', t.criado_em)::date, SUM(t.valor_cents), COUNT(*)
+            FROM tb_transacao t
+            WHERE t.tipo = 'payment' AND t.status = 'confirmed' AND t.id_comerciante IS NOT NULL
+              AND t.criado_em >= $1 AND t.criado_em < $2
+            GROUP BY t.id_comerciante, date_trunc('month', t.criado_em)
+            """,
+            de,
+            ate,
+        )
+        checagens["rebuild_faturamento_mes_corrente"] = {"particoes": lidas, "ok": lidas == [esperada]}
+
+        # Inserções (e o gatilho de saldo) caem na partição do mês de
+        # criado_em; linhas na default indicam partição faltando.
+        na_default = await con.fetchval("SELECT count(*) FROM tb_transacao_default")
+        existentes = {nome for nome, _ in await _particoes(con, "tb_transacao")}
+        faltando = [
+            f"tb_transacao_p{m:%Y%m}" for m in (hoje, proximo)
+            if f"tb_transacao_p{m:%Y%m}" not in existentes
+        ]
+        checagens["insercao_roteada"] = {
+            "linhas_na_default": na_default,
+            "particoes_faltando": faltando,
+            "ok": na_default == 0 and not faltando,
+        }
+
+        print(json.dumps(checagens, indent=2, ensure_ascii=False))
+        if not all(c["ok"] for c in checagens.values()):
+            sys.exit(1)
+    finally:
+        await con.close()
+
+
+async def conta_quente(args):
+    """Liga/desliga o modo conta quente; ao desligar, consolida os pendentes.
+
+    Um crédito que leu conta_quente = TRUE antes da troca ainda pode gravar
+    um pendente depois dela. Todo crédito já tem FOR KEY SHARE na conta (FK
+    de tb_transacao.id_conta_para, checada antes de fn_valida_saldo), então
+    o FOR UPDATE, numa transação depois da troca, espera esses créditos
+    terminarem, e os seguintes já leem FALSE.
+    """
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        async with con.transaction():
+            status = await con.execute(
+                "UPDATE tb_conta SET conta_quente = $2 WHERE id_conta = $1", args.conta, not args.desligar
+            )
+            if status == "UPDATE 0":
+                print(f"conta {args.conta} não encontrada")
+                sys.exit(1)
+        consolidado = 0
+        if args.desligar:
+            async with con.transaction():
+                await con.execute("SELECT 1 FROM tb_conta WHERE id_conta = $1 FOR UPDATE", args.conta)
+                consolidado = await con.fetchval("SELECT fn_consolidar_creditos($1)", args.conta)
+        estado = "desligado" if args.desligar else "ligado"
+        print(f"conta {args.conta}: modo conta quente {estado} (consolidado {consolidado} centavos)")
+    finally:
+        await con.close()
+
+
+async def consolidar_creditos(args):
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        print(f"créditos pendentes consolidados: {await fold_pending_credits(con)} centavos")
+    finally:
+        await con.close()
+
+
+async def consolidar_faturamento(args):
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        print(f"pagamentos pendentes consolidados no faturamento: {await fold_pending_billing(con)}")
+    finally:
+        await con.close()
+
+
+async def atualizar_atrasos(args):
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        resultado = await update_arrears(con)
+        if resultado is None:
+            print("outra execução do job de atraso está em andamento")
+            sys.exit(1)
+        print(f"empréstimos em atraso: +{resultado[0]} / -{resultado[1]}")
+    finally:
+        await con.close()
+
+
+async def _pedacos(arquivo):
+    f = sys.stdin.buffer if arquivo == "-" else open(arquivo, "rb")
+    try:
+        while True:
+            pedaco = f.read(1 << 20)
+            if not pedaco:
+                return
+            yield pedaco
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+async def importar_usuarios(args):
+    """Mesma importação de POST /users/import, direto do arquivo (ou stdin)."""
+    formato = args.formato
+    if formato is None:
+        formato = "ndjson" if args.arquivo.endswith((".ndjson", ".jsonl")) else "csv"
+    con = await asyncpg.connect(DATABASE_URL)
+
+    @asynccontextmanager
+    async def conectar():
+        yield con
+
+    try:
+        t0 = time.perf_counter()
+        resultado = await import_users(conectar, _linhas(_pedacos(args.arquivo)), formato, args.lote)
+        segundos = time.perf_counter() - t0
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+        print(f"{resultado['importados']} usuários em {segundos:.1f}s "
+              f"({resultado['importados'] / max(segundos, 1e-6):.0f}/s)", file=sys.stderr)
+        if resultado["falhas"]:
+            sys.exit(1)
+    finally:
+        shutdown_import_pool()
+        await con.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("rebuild-faturamento", help="reconstrói tb_faturamento_mensal a partir de tb_transacao")
+    p.add_argument("--de", type=_mes, help="primeiro mês (AAAA-MM)")
+    p.add_argument("--ate", type=_mes, help="último mês, inclusivo (AAAA-MM)")
+    p.set_defaults(func=rebuild_faturamento)
+
+    p = sub.add_parser("conceder-emprestimos", help="concede em lote os empréstimos com status 'approved'")
+    p.add_argument("--lote", type=int, default=5000, help="empréstimos por transação")
+    p.set_defaults(func=conceder_emprestimos)
+
+    p = sub.add_parser("limpar-idempotencia", help="remove chaves de idempotência expiradas")
+    p.add_argument("--lote", type=int, default=5000, help="linhas por DELETE")
+    p.set_defaults(func=limpar_idempotencia)
+
+    p = sub.add_parser("drenar-auditoria", help="move a fila de auditoria (modo async) para tb_auditoria")
+    p.add_argument("--lote", type=int, default=5000, help="eventos por transação")
+    p.set_defaults(func=drenar_auditoria)
+
+    p = sub.add_parser("criar-particoes", help="cria partições mensais futuras de tb_transacao e tb_auditoria")
+    p.add_argument("--meses", type=int, default=3, help="meses à frente do corrente")
+    p.set_defaults(func=criar_particoes)
+
+    p = sub.add_parser("arquivar-particoes", help="desanexa partições antigas de tb_transacao e tb_auditoria")
+    p.add_argument("--antes", type=_mes, required=True, help="arquiva meses anteriores a este (AAAA-MM)")
+    p.add_argument("--schema", default="arquivo", help="schema de destino das partições desanexadas")
+    p.add_argument("--apagar", action="store_true", help="apaga em vez de mover para --schema")
+    p.set_defaults(func=arquivar_particoes)
+
+    p = sub.add_parser("verificar-particoes", help="confere o partition pruning das consultas principais")
+    p.add_argument("--conta", type=int, default=1, help="conta usada no plano do extrato")
+    p.set_defaults(func=verificar_particoes)
+
+    p = sub.add_parser("conta-quente", help="créditos da conta viram pendentes consolidados em segundo plano")
+    p.add_argument("--conta", type=int, required=True, help="id_conta")
+    p.add_argument("--desligar", action="store_true", help="volta ao crédito direto no saldo")
+    p.set_defaults(func=conta_quente)
+
+    p = sub.add_parser("consolidar-creditos", help="incorpora ao saldo os créditos pendentes das contas quentes")
+    p.set_defaults(func=consolidar_creditos)
+
+    p = sub.add_parser("consolidar-faturamento", help="incorpora ao faturamento mensal os pagamentos pendentes")
+    p.set_defaults(func=consolidar_faturamento)
+
+    p = sub.add_parser("atualizar-atrasos", help="marca/desmarca em lote os empréstimos em atraso")
+    p.set_defaults(func=atualizar_atrasos)
+
+    p = sub.add_parser("importar-usuarios", help="importa usuários (e contas) de um CSV/NDJSON via COPY")
+    p.add_argument("arquivo", help="arquivo CSV com cabeçalho ou NDJSON; - lê do stdin")
+    p.add_argument("--formato", choices=("csv", "ndjson"), help="padrão: pela extensão do arquivo")
+    p.add_argument("--lote", type=int, default=IMPORT_BATCH_SIZE, help="linhas por COPY + merge")
+    p.set_defaults(func=importar_usuarios)
+
+    args = ap.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Job de atraso em volume: fn_atualizar_atrasos e vw_emprestimos_em_atraso.
+
+Cria um schema descartável (bench_atraso) com --emprestimos empréstimos de
+24 parcelas (ordem de milhões de parcelas), metade delas já pagas, e mede:
+a primeira execução do job (marca os atrasados), uma segunda (nada muda),
+e a view antiga (EXISTS correlacionado) x a nova. Remove o schema no fim.
+
+    python bench/arrears_job.py --emprestimos 200000
+"""
+import argparse
+import asyncio
+
+import asyncpg
+
+from _comum import DATABASE_URL, agora_ms, imprimir
+
+VIEW_ANTIGA = """
+    SELECT count(*) FROM tb_emprestimo e
+    JOIN tb_conta c ON c.id_conta = e.id_conta
+    WHERE EXISTS (
+      SELECT 1 FROM tb_parcela p
+      WHERE p.id_emprestimo = e.id_emprestimo AND p.pago = FALSE AND p.vencimento < CURRENT_DATE
+    )
+"""
+
+# mesma consulta da vw_emprestimos_em_atraso (a view em si aponta para public)
+VIEW_NOVA = """
+    SELECT count(*) FROM (
+      SELECT id_emprestimo, COUNT(*), SUM(valor_cents), MIN(vencimento)
+      FROM tb_parcela
+      WHERE pago = FALSE AND vencimento < CURRENT_DATE
+      GROUP BY id_emprestimo
+    ) a
+    JOIN tb_emprestimo e ON e.id_emprestimo = a.id_emprestimo
+    JOIN tb_conta c ON c.id_conta = e.id_conta
+"""
+
+
+async def _seed(con, emprestimos):
+    await con.execute("DROP SCHEMA IF EXISTS bench_atraso CASCADE; CREATE SCHEMA bench_atraso")
+    await con.execute("SET search_path = bench_atraso, public")
+    for tabela in ("tb_usuario", "tb_conta", "tb_emprestimo", "tb_parcela"):
+        await con.execute(f"CREATE TABLE {tabela} (LIKE public.{tabela} INCLUDING ALL)")
+    await con.execute(
+        f"""
+        INSERT INTO tb_usuario (id_usuario, nome, email, doc_cpf_cnpj, senha_hash)
+        SELECT g, 'U' || g, 'u' || g || '@atraso', 'A' || g, '' FROM generate_series(1, {emprestimos}) g;
+        INSERT INTO tb_conta (id_conta, id_usuario, numero_conta, agencia)
+        SELECT g, g, 'A' || g, '0001' FROM generate_series(1, {emprestimos}) g;
+        INSERT INTO tb_emprestimo (id_emprestimo, id_conta, principal_cents, juros_aa_pct, prazo_meses,
+                                   status, iniciado_em)
+        SELECT g, g, 1200000, 0, 24, 'disbursed', CURRENT_DATE - (g % 700)
+        FROM generate_series(1, {emprestimos}) g;
+        INSERT INTO tb_parcela (id_emprestimo, num_parcela, vencimento, valor_cents, pago)
+        SELECT e.id_emprestimo, n, (e.iniciado_em + make_interval(months => n))::date, 50000,
+               n <= (e.id_emprestimo % 24) AND (e.id_emprestimo % 3 <> 0)
+        FROM tb_emprestimo e, generate_series(1, 24) n;
+        ANALYZE tb_conta; ANALYZE tb_emprestimo; ANALYZE tb_parcela;
+        """
+    )
+
+
+async def _tempo(con, sql):
+    t0 = agora_ms()
+    valor = await con.fetchrow(sql)
+    return round(agora_ms() - t0, 1), dict(valor)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--emprestimos", type=int, default=200_000)
+    args = ap.parse_args()
+
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        await _seed(con, args.emprestimos)
+        parcelas = await con.fetchval("SELECT count(*) FROM tb_parcela")
+        job1 = await _tempo(con, "SELECT * FROM fn_atualizar_atrasos()")
+        job2 = await _tempo(con, "SELECT * FROM fn_atualizar_atrasos()")
+        antiga = await _tempo(con, VIEW_ANTIGA)
+        nova = await _tempo(con, VIEW_NOVA)
+        imprimir({
+            "emprestimos": args.emprestimos,
+            "parcelas": parcelas,
+            "job_primeira_ms": job1,
+            "job_segunda_ms": job2,
+            "view_antiga_ms": antiga,
+            "view_nova_ms": nova,
+        })
+    finally:
+        await con.execute("DROP SCHEMA IF EXISTS bench_atraso CASCADE")
+        await con.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
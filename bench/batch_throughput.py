@@ -0,0 +1,73 @@
+"""Itens por segundo: /payments e /transfers item a item x endpoints de lote.
+
+Usa um usuário existente (X-User-Id) e credita saldo suficiente antes:
+
+    python bench/batch_throughput.py --usuario 1 --chave 00000000002 --itens 5000
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from _comum import API_URL, agora_ms, imprimir
+
+
+async def _individual(client, path, payloads, concorrencia):
+    fila = list(payloads)
+    ok = 0
+
+    async def worker():
+        nonlocal ok
+        while fila:
+            r = await client.post(path, json=fila.pop())
+            ok += r.status_code == 200
+
+    t0 = agora_ms()
+    await asyncio.gather(*(worker() for _ in range(concorrencia)))
+    seg = (agora_ms() - t0) / 1000
+    return {"itens": len(payloads), "ok": ok, "segundos": seg, "itens_por_s": len(payloads) / seg}
+
+
+async def _lote(client, path, payloads, tamanho, atomico):
+    ok = 0
+    t0 = agora_ms()
+    for i in range(0, len(payloads), tamanho):
+        r = await client.post(path, json={"itens": payloads[i:i + tamanho], "atomico": atomico})
+        if r.status_code == 200:
+            ok += r.json()["confirmados"]
+    seg = (agora_ms() - t0) / 1000
+    return {"itens": len(payloads), "ok": ok, "segundos": seg, "itens_por_s": len(payloads) / seg}
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--usuario", type=int, default=1)
+    ap.add_argument("--chave", default="00000000002", help="chave Pix do destinatário")
+    ap.add_argument("--comerciante", type=int, default=1)
+    ap.add_argument("--itens", type=int, default=5000)
+    ap.add_argument("--lote", type=int, default=1000)
+    ap.add_argument("--concorrencia", type=int, default=20)
+    args = ap.parse_args()
+
+    headers = {"X-User-Id": str(args.usuario)}
+    async with httpx.AsyncClient(base_url=API_URL, headers=headers, timeout=120) as client:
+        r = await client.post("/accounts/deposit", json={"valor_cents": args.itens * 4 * 100})
+        r.raise_for_status()
+
+        pagamentos = [
+            {"id_comerciante": args.comerciante, "valor_cents": 100, "referencia": f"BENCH-{i}"}
+            for i in range(args.itens)
+        ]
+        transferencias = [{"identificador": args.chave, "valor_cents": 100} for _ in range(args.itens)]
+        pagamentos_unit = [dict(p, id_conta_de=0) for p in pagamentos]
+
+        imprimir({
+            "payments_individual": await _individual(client, "/payments", pagamentos_unit, args.concorrencia),
+            "payments_batch_atomico": await _lote(client, "/payments/batch", pagamentos, args.lote, True),
+            "transfers_individual": await _individual(client, "/transfers", transferencias, args.concorrencia),
+            "transfers_batch_por_item": await _lote(client, "/transfers/batch", transferencias, args.lote, False),
+        })
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
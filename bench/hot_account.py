@@ -0,0 +1,113 @@
+"""Contenção em conta quente: centenas de transferências simultâneas para a mesma conta.
+
+Cadastra --pagadores clientes, deposita em cada um e dispara --rodadas
+transferências de cada pagador para uma única conta de destino, primeiro
+com conta_quente desligado (todas disputam o lock da linha de destino) e
+depois ligado (créditos viram pendentes). No fim confere que o saldo lido
+pela API bate com o total recebido. Sai com código 1 se não bater.
+
+    python bench/hot_account.py --pagadores 300 --rodadas 5
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+
+import asyncpg
+import httpx
+
+from _comum import API_URL, DATABASE_URL, agora_ms, imprimir, resumo
+
+VALOR = 100
+
+
+async def _cadastrar(client, sufixo, i):
+    r = await client.post("/auth/register", json={
+        "nome": f"Pagador {i}",
+        "email": f"hot-{sufixo}-{i}@bench",
+        "doc_cpf_cnpj": f"HT{sufixo}{i:06d}",
+        "senha": "hot",
+        "salario_mensal_cents": 0,
+    })
+    r.raise_for_status()
+    uid = r.json()["id_usuario"]
+    r = await client.post(
+        "/accounts/deposit",
+        json={"valor_cents": 10_000_000},
+        headers={"X-User-Id": str(uid)},
+    )
+    r.raise_for_status()
+    return uid
+
+
+async def _transferir(client, uid, destino, rodadas, amostras, status):
+    for _ in range(rodadas):
+        t0 = agora_ms()
+        r = await client.post(
+            "/transfers",
+            json={"identificador": str(destino), "valor_cents": VALOR},
+            headers={"X-User-Id": str(uid)},
+        )
+        amostras.append(agora_ms() - t0)
+        status[r.status_code] = status.get(r.status_code, 0) + 1
+
+
+async def _rodada(client, ids, destino, rodadas):
+    amostras, status = [], {}
+    t0 = agora_ms()
+    await asyncio.gather(*(_transferir(client, uid, destino, rodadas, amostras, status) for uid in ids))
+    duracao = (agora_ms() - t0) / 1000
+    return {"status": status, "latencia": resumo(amostras, duracao)}
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pagadores", type=int, default=300)
+    ap.add_argument("--rodadas", type=int, default=5, help="transferências por pagador em cada modo")
+    args = ap.parse_args()
+
+    sufixo = uuid.uuid4().hex[:6]
+    limites = httpx.Limits(max_connections=args.pagadores + 10)
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        async with httpx.AsyncClient(base_url=API_URL, limits=limites, timeout=120) as client:
+            r = await client.post("/auth/register", json={
+                "nome": "Arrecadação Bench",
+                "email": f"hot-{sufixo}-destino@bench",
+                "doc_cpf_cnpj": f"HT{sufixo}DEST",
+                "senha": "hot",
+                "salario_mensal_cents": 0,
+            })
+            r.raise_for_status()
+            destino = r.json()["id_conta"]
+            ids = await asyncio.gather(*(_cadastrar(client, sufixo, i) for i in range(args.pagadores)))
+
+            await con.execute("UPDATE tb_conta SET conta_quente = FALSE WHERE id_conta = $1", destino)
+            normal = await _rodada(client, ids, destino, args.rodadas)
+
+            await con.execute("UPDATE tb_conta SET conta_quente = TRUE WHERE id_conta = $1", destino)
+            quente = await _rodada(client, ids, destino, args.rodadas)
+            pendentes = await con.fetchval(
+                "SELECT count(*) FROM tb_credito_pendente WHERE id_conta = $1", destino
+            )
+
+            recebido = VALOR * (normal["status"].get(200, 0) + quente["status"].get(200, 0))
+            saldo_api = (await client.get(f"/accounts/{destino}")).json()["saldo_cents"]
+    finally:
+        await con.close()
+
+    imprimir({
+        "pagadores": args.pagadores,
+        "conta_destino": destino,
+        "conta_normal": normal,
+        "conta_quente": quente,
+        "pendentes_na_leitura": pendentes,
+        "recebido_cents": recebido,
+        "saldo_api_cents": saldo_api,
+    })
+    if saldo_api != recebido:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
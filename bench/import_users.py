@@ -0,0 +1,81 @@
+"""Importação em lote: POST /users/import com --usuarios linhas em stream.
+
+Gera um CSV com e-mails/documentos únicos por execução e envia em stream
+(o arquivo nunca fica inteiro na memória). Por padrão todas as linhas vêm
+com senha_hash pronto (um só hash bcrypt_sha256 reaproveitado), que é o
+caminho rápido; --fracao-texto manda essa fração com senha em texto, para
+medir o custo do bcrypt no pool de processos. --duplicados repete e-mails
+de linhas anteriores, que devem voltar como falha. A API precisa de
+IMPORT_TOKEN, e este script o lê da mesma variável.
+
+    IMPORT_TOKEN=... python bench/import_users.py --usuarios 200000 --fracao-texto 0.01
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import uuid
+
+import httpx
+from passlib.hash import bcrypt_sha256
+
+from _comum import API_URL, agora_ms, imprimir
+
+CABECALHO = "nome,email,telefone,doc_cpf_cnpj,senha,senha_hash,tipo_pessoa,salario_mensal_cents\n"
+
+
+async def _csv(usuarios, fracao_texto, duplicados, senha_hash, sufixo, linhas_por_pedaco=5000):
+    rnd = random.Random(1)
+    pedaco = [CABECALHO]
+    for i in range(usuarios):
+        n = rnd.randrange(i) if duplicados and i and rnd.random() < duplicados else i
+        texto = rnd.random() < fracao_texto
+        pedaco.append(
+            f"Importado {i},imp-{sufixo}-{n}@bench,,IM{sufixo}{i:09d},"
+            f"{'imp' if texto else ''},{'' if texto else senha_hash},PF,{rnd.randrange(1, 2_000_000)}\n"
+        )
+        if len(pedaco) >= linhas_por_pedaco:
+            yield "".join(pedaco).encode()
+            pedaco = []
+    if pedaco:
+        yield "".join(pedaco).encode()
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--usuarios", type=int, default=200_000)
+    ap.add_argument("--fracao-texto", type=float, default=0.0, help="fração de linhas com senha em texto")
+    ap.add_argument("--duplicados", type=float, default=0.0, help="fração de linhas com e-mail repetido")
+    args = ap.parse_args()
+
+    token = os.getenv("IMPORT_TOKEN")
+    if not token:
+        sys.exit("defina IMPORT_TOKEN (o mesmo da API)")
+    sufixo = uuid.uuid4().hex[:6]
+    senha_hash = bcrypt_sha256.hash("imp")
+
+    async with httpx.AsyncClient(base_url=API_URL, timeout=None) as client:
+        t0 = agora_ms()
+        r = await client.post(
+            "/users/import",
+            content=_csv(args.usuarios, args.fracao_texto, args.duplicados, senha_hash, sufixo),
+            headers={"X-Import-Token": token, "Content-Type": "text/csv"},
+        )
+        duracao_s = (agora_ms() - t0) / 1000
+        r.raise_for_status()
+        resultado = r.json()
+
+    imprimir({
+        "usuarios": args.usuarios,
+        "fracao_texto": args.fracao_texto,
+        "importados": resultado["importados"],
+        "falhas": resultado["falhas"],
+        "exemplos_erros": resultado["erros"][:5],
+        "duracao_s": round(duracao_s, 1),
+        "usuarios_por_s": round(resultado["importados"] / duracao_s),
+    })
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
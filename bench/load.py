@@ -0,0 +1,214 @@
+"""Load generator: mistura de cenários contra os endpoints reais da API.
+
+Lê as faixas de ids de bench/seed.py (--seed) e mantém --clientes usuários
+virtuais em laço fechado por --segundos. Cada iteração sorteia um cenário
+pelos pesos de --mix. Gera JSON com throughput e p50/p95/p99 por endpoint.
+Para comparar versões, use --comparar com o JSON de uma rodada anterior.
+
+loan_create usa um usuário diferente a cada chamada (do fim da faixa do
+seed para trás); quem já tem empréstimo ativo (de rodadas anteriores)
+recebe 400, contado à parte em loan_create_ativo para não misturar a
+rejeição com a criação.
+
+    python bench/load.py --clientes 200 --segundos 60 --saida depois.json --comparar antes.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+
+import httpx
+
+from _comum import API_URL, agora_ms, imprimir, resumo
+
+MIX_PADRAO = "login=10,deposit=15,transfer=25,statement=25,loan_simulate=10,loan_create=5,report=10"
+
+
+def _mix(texto):
+    pesos = {}
+    for parte in texto.split(","):
+        nome, peso = parte.split("=")
+        if nome not in CENARIOS:
+            raise SystemExit(f"cenário desconhecido: {nome} (use {', '.join(CENARIOS)})")
+        pesos[nome] = float(peso)
+    return pesos
+
+
+class Usuario:
+    def __init__(self, seed, rnd, i=None):
+        self.rnd = rnd
+        self.seed = seed
+        if i is None:
+            i = rnd.randint(0, seed["usuarios"][1] - seed["usuarios"][0])
+        self.id_usuario = seed["usuarios"][0] + i
+        self.id_conta = seed["contas"][0] + i
+        self.doc = seed["doc_formato"].format(id_usuario=self.id_usuario)
+        self.headers = {"X-User-Id": str(self.id_usuario)}
+
+    def outra_conta(self):
+        return self.rnd.randint(*self.seed["contas"])
+
+
+async def login(client, u):
+    return await client.post("/auth/login", json={"doc_cpf_cnpj": u.doc, "senha": u.seed["senha"]})
+
+
+async def deposit(client, u):
+    return await client.post(
+        "/accounts/deposit", json={"valor_cents": u.rnd.randint(100, 10_000)}, headers=u.headers
+    )
+
+
+async def transfer(client, u):
+    return await client.post(
+        "/transfers",
+        json={"identificador": str(u.outra_conta()), "valor_cents": u.rnd.randint(100, 5_000)},
+        headers=u.headers,
+    )
+
+
+async def statement(client, u):
+    return await client.get(f"/accounts/{u.id_conta}/statement", headers=u.headers)
+
+
+async def loan_simulate(client, u):
+    return await client.post("/loans/simulate", json={
+        "principal_cents": u.rnd.randint(10, 500) * 1_000,
+        "prazo_meses": u.rnd.choice((6, 12, 24, 36, 48)),
+    }, headers=u.headers)
+
+
+async def loan_create(client, u):
+    return await client.post(
+        "/loans/create",
+        json={"id_conta": 0, "principal_cents": u.rnd.randint(10, 200) * 1_000,
+              "juros_aa_pct": 0, "prazo_meses": 12},
+        headers=u.headers,
+    )
+
+
+async def report(client, u):
+    return await client.get(
+        "/reports/faturamento-mensal", params={"id_comerciante": u.rnd.choice(u.seed["comerciantes"])}
+    )
+
+
+CENARIOS = {f.__name__: f for f in (login, deposit, transfer, statement, loan_simulate, loan_create, report)}
+
+
+def _emprestimo_ativo(r):
+    return r.status_code == 400 and "empréstimo ativo" in r.text
+
+
+async def _cliente(client, seed, pesos, rnd, fim, amostras, status, sem_emprestimo):
+    nomes, ps = list(pesos), list(pesos.values())
+    total = seed["usuarios"][1] - seed["usuarios"][0] + 1
+    while agora_ms() < fim:
+        nome = rnd.choices(nomes, ps)[0]
+        # cada loan_create pega um usuário ainda não usado nesta rodada
+        u = Usuario(seed, rnd, total - 1 - next(sem_emprestimo) % total if nome == "loan_create" else None)
+        t0 = agora_ms()
+        try:
+            r = await CENARIOS[nome](client, u)
+            codigo = r.status_code
+            if nome == "loan_create" and _emprestimo_ativo(r):
+                nome = "loan_create_ativo"
+        except httpx.HTTPError as e:
+            codigo = type(e).__name__
+        amostras[nome].append(agora_ms() - t0)
+        status[nome][codigo] = status[nome].get(codigo, 0) + 1
+
+
+def _comparar(atual, anterior):
+    delta = {}
+    for nome, r in atual["endpoints"].items():
+        antes = anterior.get("endpoints", {}).get(nome)
+        if not antes:
+            continue
+        delta[nome] = {
+            k: round(r[k] - antes[k], 2)
+            for k in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+            if r.get(k) is not None and antes.get(k) is not None
+        }
+    return delta
+
+
+async def executar(base_url, seed, pesos, clientes, segundos, aquecimento=5, semente=1):
+    """Roda a mistura e devolve o resultado (o mesmo JSON da linha de comando)."""
+    limites = httpx.Limits(max_connections=clientes + 10)
+    nomes = list(pesos) + (["loan_create_ativo"] if "loan_create" in pesos else [])
+    sem_emprestimo = itertools.count()
+    async with httpx.AsyncClient(base_url=base_url, limits=limites, timeout=30) as client:
+        async def fase(duracao, base):
+            amostras = {n: [] for n in nomes}
+            status = {n: {} for n in nomes}
+            fim = agora_ms() + duracao * 1000
+            await asyncio.gather(*(
+                _cliente(client, seed, pesos, random.Random(base + i), fim, amostras, status, sem_emprestimo)
+                for i in range(clientes)
+            ))
+            return amostras, status
+
+        if aquecimento > 0:
+            await fase(aquecimento, semente * 1_000_003)
+        t0 = agora_ms()
+        amostras, status = await fase(segundos, semente)
+        duracao = (agora_ms() - t0) / 1000
+
+    endpoints = {}
+    for nome in nomes:
+        r = resumo(amostras[nome], duracao)
+        r["status"] = {str(k): v for k, v in sorted(status[nome].items(), key=str)}
+        endpoints[nome] = r
+    total = sum(len(a) for a in amostras.values())
+    return {
+        "api_url": base_url,
+        "clientes": clientes,
+        "segundos": round(duracao, 1),
+        "mix": pesos,
+        "throughput_rps": total / duracao,
+        "endpoints": endpoints,
+    }
+
+
+def falhou(resultado):
+    """Algum 5xx ou erro de transporte."""
+    return any(
+        k.startswith("5") or not k.isdigit()
+        for r in resultado["endpoints"].values() for k in r["status"]
+    )
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seed", default=os.path.join(os.path.dirname(__file__), "seed.json"))
+    ap.add_argument("--clientes", type=int, default=100)
+    ap.add_argument("--segundos", type=float, default=60)
+    ap.add_argument("--aquecimento", type=float, default=5, help="segundos descartados antes da medição")
+    ap.add_argument("--mix", default=MIX_PADRAO)
+    ap.add_argument("--semente", type=int, default=1)
+    ap.add_argument("--saida", help="grava o JSON também neste arquivo")
+    ap.add_argument("--comparar", help="JSON de uma rodada anterior")
+    args = ap.parse_args()
+
+    with open(args.seed) as f:
+        seed = json.load(f)
+    resultado = await executar(
+        API_URL, seed, _mix(args.mix), args.clientes, args.segundos, args.aquecimento, args.semente
+    )
+    if args.comparar:
+        with open(args.comparar) as f:
+            resultado["delta"] = _comparar(resultado, json.load(f))
+    if args.saida:
+        with open(args.saida, "w") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    imprimir(resultado)
+    if falhou(resultado):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""Microbenchmark: grade de ofertas (1..60 meses) x 60 chamadas escalares.
+
+Não precisa de API nem banco; importa backend/main.py direto.
+
+    python bench/loan_grid.py --salarios 2000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import main as api  # noqa: E402
+
+from _comum import imprimir  # noqa: E402
+
+
+def escalar(salario, principal):
+    return [api.avaliar_emprestimo(salario, principal, n) for n in range(1, api.LOAN_PRAZO_MAX + 1)]
+
+
+def grade(salario, principal):
+    return api.tabela_ofertas(salario), api._pmt_grade(principal)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--salarios", type=int, default=2000, help="salários distintos")
+    ap.add_argument("--repeticoes", type=int, default=5)
+    args = ap.parse_args()
+
+    casos = [(random.randint(100_000, 5_000_000), random.randint(10_000, 10_000_000)) for _ in range(args.salarios)]
+
+    # mesmos centavos nos dois caminhos
+    for salario, principal in casos[:200]:
+        (_, linhas), pmts = grade(salario, principal)
+        for k, sim in enumerate(escalar(salario, principal)):
+            assert sim["principal_max_cents"] == linhas[k][3] and sim["pmt_cents"] == pmts[k]
+
+    def rodar(fn):
+        return min(timeit.repeat(lambda: [fn(s, p) for s, p in casos], number=1, repeat=args.repeticoes))
+
+    api.tabela_ofertas.cache_clear()
+    t_escalar = rodar(escalar)
+    api.tabela_ofertas.cache_clear()
+    t_grade_fria = min(timeit.repeat(
+        lambda: (api.tabela_ofertas.cache_clear(), [grade(s, p) for s, p in casos]),
+        number=1, repeat=args.repeticoes,
+    ))
+    t_grade_cache = rodar(grade)
+
+    imprimir({
+        "salarios": args.salarios,
+        "us_por_grade_escalar": t_escalar / args.salarios * 1e6,
+        "us_por_grade_sem_cache": t_grade_fria / args.salarios * 1e6,
+        "us_por_grade_com_cache": t_grade_cache / args.salarios * 1e6,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Stress de /loans/create: muitas criações simultâneas não podem esgotar o pool.
+
+Cadastra --usuarios clientes novos e dispara todas as criações de uma vez
+(bem acima de DB_POOL_MAX_SIZE). Sai com código 1 se alguma criação
+ficar sem conexão (503/timeout) ou se o pool não voltar a ficar ocioso.
+
+    python bench/loan_stress.py --usuarios 200
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+
+import httpx
+
+from _comum import API_URL, agora_ms, imprimir, resumo
+
+
+async def _cadastrar(client, sufixo, i):
+    r = await client.post("/auth/register", json={
+        "nome": f"Stress {i}",
+        "email": f"stress-{sufixo}-{i}@bench",
+        "doc_cpf_cnpj": f"ST{sufixo}{i:06d}",
+        "senha": "stress",
+        "salario_mensal_cents": 1_000_000,
+    })
+    r.raise_for_status()
+    return r.json()["id_usuario"]
+
+
+async def _criar(client, id_usuario, amostras, status):
+    t0 = agora_ms()
+    r = await client.post(
+        "/loans/create",
+        json={"id_conta": 0, "principal_cents": 100_000, "juros_aa_pct": 0, "prazo_meses": 12},
+        headers={"X-User-Id": str(id_usuario)},
+    )
+    amostras.append(agora_ms() - t0)
+    status[r.status_code] = status.get(r.status_code, 0) + 1
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--usuarios", type=int, default=200)
+    args = ap.parse_args()
+
+    sufixo = uuid.uuid4().hex[:6]
+    limites = httpx.Limits(max_connections=args.usuarios + 10)
+    async with httpx.AsyncClient(base_url=API_URL, limits=limites, timeout=60) as client:
+        ids = await asyncio.gather(*(_cadastrar(client, sufixo, i) for i in range(args.usuarios)))
+
+        amostras, status = [], {}
+        t0 = agora_ms()
+        await asyncio.gather(*(_criar(client, uid, amostras, status) for uid in ids))
+        duracao = (agora_ms() - t0) / 1000
+
+        await asyncio.sleep(0.5)
+        pool = (await client.get("/stats/pool")).json()
+
+    imprimir({"status": status, "latencia": resumo(amostras, duracao), "pool": pool})
+    falhou = status.get(503, 0) or status.get(500, 0) or status.get(200, 0) != args.usuarios
+    if falhou or pool["in_use"] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""p99 de GET /accounts/{id_conta} durante uma enxurrada de logins.
+
+Rode uma vez contra a versão antiga e outra contra a nova e compare:
+
+    python bench/login_flood.py --conta 1 --doc 00000000001 --senha x
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from _comum import API_URL, agora_ms, imprimir, resumo
+
+
+async def _logins(client, doc, senha, fim):
+    while agora_ms() < fim:
+        try:
+            await client.post("/auth/login", json={"doc_cpf_cnpj": doc, "senha": senha})
+        except httpx.HTTPError:
+            pass
+
+
+async def _leituras(client, id_conta, fim, amostras):
+    while agora_ms() < fim:
+        t0 = agora_ms()
+        r = await client.get(f"/accounts/{id_conta}")
+        if r.status_code == 200:
+            amostras.append(agora_ms() - t0)
+        await asyncio.sleep(0.01)
+
+
+async def _fase(client, args, com_flood):
+    amostras = []
+    fim = agora_ms() + args.segundos * 1000
+    tarefas = [_leituras(client, args.conta, fim, amostras) for _ in range(args.leitores)]
+    if com_flood:
+        tarefas += [_logins(client, args.doc, args.senha, fim) for _ in range(args.logins)]
+    await asyncio.gather(*tarefas)
+    return resumo(amostras, args.segundos)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--conta", type=int, default=1)
+    ap.add_argument("--doc", default="00000000001")
+    ap.add_argument("--senha", default="senha-errada")
+    ap.add_argument("--logins", type=int, default=50, help="clientes de login concorrentes")
+    ap.add_argument("--leitores", type=int, default=5)
+    ap.add_argument("--segundos", type=float, default=15)
+    args = ap.parse_args()
+
+    limites = httpx.Limits(max_connections=args.logins + args.leitores + 10)
+    async with httpx.AsyncClient(base_url=API_URL, limits=limites, timeout=30) as client:
+        imprimir({
+            "sem_flood": await _fase(client, args, False),
+            "com_flood": await _fase(client, args, True),
+        })
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
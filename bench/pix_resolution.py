@@ -0,0 +1,104 @@
+"""Resolução de chave Pix: consulta antiga (OR + cast) x consultas por tipo.
+
+Cria um schema descartável (bench_pix) com 1M usuários/contas, mede as duas
+estratégias direto no Postgres e remove o schema no fim.
+
+    python bench/pix_resolution.py --linhas 1000000 --amostras 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+import asyncpg
+
+from _comum import DATABASE_URL, agora_ms, imprimir, resumo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+SQL_ANTIGO = """
+    SELECT c.id_conta, u.nome
+    FROM tb_conta c JOIN tb_usuario u ON c.id_usuario = u.id_usuario
+    WHERE u.doc_cpf_cnpj = $1 OR c.id_conta::text = $1
+"""
+
+
+async def _seed(con, linhas):
+    await con.execute("DROP SCHEMA IF EXISTS bench_pix CASCADE; CREATE SCHEMA bench_pix")
+    await con.execute("SET search_path = bench_pix, public")
+    await con.execute("CREATE TABLE tb_usuario (LIKE public.tb_usuario INCLUDING ALL)")
+    await con.execute("CREATE TABLE tb_conta (LIKE public.tb_conta INCLUDING ALL)")
+    await con.execute(
+        """
+        INSERT INTO tb_usuario (id_usuario, nome, email, telefone, doc_cpf_cnpj, senha_hash)
+        SELECT g, 'Usuário ' || g, 'u' || g || '@bench', '+55 11 9' || LPAD(g::text, 8, '0'),
+               LPAD(g::text, 11, '0'), ''
+        FROM generate_series(1, $1) g
+        """,
+        linhas,
+    )
+    await con.execute(
+        """
+        INSERT INTO tb_conta (id_conta, id_usuario, numero_conta, agencia, saldo_cents)
+        SELECT g, g, LPAD(g::text, 8, '0'), '0001', 0 FROM generate_series(1, $1) g
+        """,
+        linhas,
+    )
+    await con.execute("CREATE INDEX ON tb_usuario (telefone)")
+    await con.execute("ANALYZE tb_usuario; ANALYZE tb_conta")
+
+
+async def _medir(con, chaves, resolver):
+    amostras = []
+    for chave in chaves:
+        t0 = agora_ms()
+        await resolver(chave)
+        amostras.append(agora_ms() - t0)
+    return resumo(amostras)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--linhas", type=int, default=1_000_000)
+    ap.add_argument("--amostras", type=int, default=2000)
+    args = ap.parse_args()
+
+    import main as api
+
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        await _seed(con, args.linhas)
+        ids = [random.randint(1, args.linhas) for _ in range(args.amostras)]
+        docs = [str(i).zfill(11) for i in ids]
+        contas = [str(i) for i in ids]
+
+        async def antigo(chave):
+            return await con.fetchrow(SQL_ANTIGO, chave)
+
+        async def novo(chave):
+            api._pix_cache.clear()
+            return await api.resolve_pix_key(con, chave)
+
+        async def novo_cache(chave):
+            return await api.resolve_pix_key(con, chave)
+
+        plano = "\n".join(
+            r[0] for r in await con.fetch("EXPLAIN " + SQL_ANTIGO, docs[0])
+        )
+        imprimir({
+            "linhas": args.linhas,
+            "plano_antigo": plano,
+            "antigo_cpf": await _medir(con, docs[: args.amostras // 10], antigo),
+            "antigo_conta": await _medir(con, contas[: args.amostras // 10], antigo),
+            "novo_cpf": await _medir(con, docs, novo),
+            "novo_conta": await _medir(con, contas, novo),
+            "novo_cpf_com_cache": await _medir(con, docs, novo_cache),
+        })
+    finally:
+        await con.execute("DROP SCHEMA IF EXISTS bench_pix CASCADE")
+        await con.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""Roteamento para a réplica: read-your-writes e distribuição das leituras.
+
+Com a API apontando DATABASE_READ_URL para uma réplica (docker compose
+--profile replica), cada cliente deposita e lê o próprio saldo logo em
+seguida (tem que ver o depósito: janela de read-your-writes), depois lê
+contas alheias e relatórios (devem ir para a réplica). Sai com código 1 se
+alguma leitura logo após a escrita vier velha.
+
+    python bench/read_replica.py --clientes 50 --rodadas 20
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+
+import httpx
+
+from _comum import API_URL, agora_ms, imprimir, resumo
+
+
+async def _cadastrar(client, sufixo, i):
+    r = await client.post("/auth/register", json={
+        "nome": f"Réplica {i}",
+        "email": f"rep-{sufixo}-{i}@bench",
+        "doc_cpf_cnpj": f"RP{sufixo}{i:06d}",
+        "senha": "rep",
+        "salario_mensal_cents": 0,
+    })
+    r.raise_for_status()
+    return r.json()
+
+
+async def _cliente(client, conta, rodadas, outra, amostras, velhas):
+    headers = {"X-User-Id": str(conta["id_usuario"])}
+    saldo = 0
+    for _ in range(rodadas):
+        r = await client.post("/accounts/deposit", json={"valor_cents": 100}, headers=headers)
+        r.raise_for_status()
+        saldo += 100
+        t0 = agora_ms()
+        lido = (await client.get(f"/me/summary/{conta['id_usuario']}", headers=headers)).json()
+        amostras["proprio"].append(agora_ms() - t0)
+        if lido.get("saldo_cents") != saldo:
+            velhas.append((conta["id_conta"], saldo, lido.get("saldo_cents")))
+        t0 = agora_ms()
+        await client.get(f"/accounts/{outra}")
+        await client.get("/reports/faturamento-mensal")
+        amostras["alheio"].append(agora_ms() - t0)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clientes", type=int, default=50)
+    ap.add_argument("--rodadas", type=int, default=20)
+    args = ap.parse_args()
+
+    sufixo = uuid.uuid4().hex[:6]
+    limites = httpx.Limits(max_connections=args.clientes + 10)
+    async with httpx.AsyncClient(base_url=API_URL, limits=limites, timeout=60) as client:
+        contas = await asyncio.gather(*(_cadastrar(client, sufixo, i) for i in range(args.clientes)))
+        # deixa a janela de read-your-writes do cadastro expirar
+        await asyncio.sleep(6)
+        amostras, velhas = {"proprio": [], "alheio": []}, []
+        await asyncio.gather(*(
+            _cliente(client, c, args.rodadas, contas[(i + 1) % len(contas)]["id_conta"], amostras, velhas)
+            for i, c in enumerate(contas)
+        ))
+        pool = (await client.get("/stats/pool")).json()
+
+    imprimir({
+        "leitura_propria": resumo(amostras["proprio"]),
+        "leitura_alheia": resumo(amostras["alheio"]),
+        "leituras_velhas": len(velhas),
+        "exemplos_velhas": velhas[:5],
+        "pool_leitura": pool.get("leitura"),
+    })
+    if velhas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
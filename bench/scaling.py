@@ -0,0 +1,92 @@
+"""Curva de escala: throughput da mistura do load.py com 1, 2, 4... workers.
+
+Para cada contagem sobe um gunicorn local (backend/gunicorn.conf.py) numa
+porta própria, com o mesmo DB_CONNECTION_BUDGET dividido entre os workers,
+roda bench/load.py contra ele e derruba com SIGTERM (shutdown gracioso).
+Precisa do seed de bench/seed.py e de gunicorn instalado.
+
+    python bench/scaling.py --workers 1,2,4,8 --clientes 400 --segundos 30 --orcamento 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+
+import httpx
+
+from _comum import DATABASE_URL, imprimir
+from load import MIX_PADRAO, _mix, executar
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+
+async def _esperar_saude(url, limite_s=60):
+    async with httpx.AsyncClient(base_url=url, timeout=2) as client:
+        for _ in range(int(limite_s * 4)):
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"API em {url} não respondeu /health")
+
+
+async def _medir(workers, args, seed, pesos):
+    porta = args.porta + workers
+    env = dict(
+        os.environ,
+        DATABASE_URL=DATABASE_URL,
+        WEB_CONCURRENCY=str(workers),
+        DB_CONNECTION_BUDGET=str(args.orcamento),
+        BIND=f"127.0.0.1:{porta}",
+    )
+    proc = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=BACKEND, env=env)
+    try:
+        url = f"http://127.0.0.1:{porta}"
+        await _esperar_saude(url)
+        resultado = await executar(url, seed, pesos, args.clientes, args.segundos, args.aquecimento)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+    return resultado
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,2,4,8")
+    ap.add_argument("--clientes", type=int, default=400)
+    ap.add_argument("--segundos", type=float, default=30)
+    ap.add_argument("--aquecimento", type=float, default=5)
+    ap.add_argument("--orcamento", type=int, default=80, help="DB_CONNECTION_BUDGET total")
+    ap.add_argument("--porta", type=int, default=18000)
+    ap.add_argument("--mix", default=MIX_PADRAO)
+    ap.add_argument("--seed", default=os.path.join(os.path.dirname(__file__), "seed.json"))
+    args = ap.parse_args()
+
+    with open(args.seed) as f:
+        seed = json.load(f)
+    pesos = _mix(args.mix)
+
+    curva = []
+    base = None
+    for n in (int(w) for w in args.workers.split(",")):
+        r = await _medir(n, args, seed, pesos)
+        rps = r["throughput_rps"]
+        base = base or rps / n
+        curva.append({
+            "workers": n,
+            "throughput_rps": round(rps, 1),
+            "eficiencia": round(rps / (base * n), 2),
+            "p99_ms": {nome: e["p99_ms"] for nome, e in r["endpoints"].items()},
+        })
+        print(f"{n} workers: {rps:.0f} req/s", file=sys.stderr)
+
+    imprimir({"nucleos": os.cpu_count(), "clientes": args.clientes, "orcamento": args.orcamento, "curva": curva})
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""Carga de volume para benchmark: usuários, contas e transações via COPY.
+
+Grava direto nas tabelas públicas com COPY (copy_records_to_table), com
+session_replication_role = replica para não disparar gatilhos de saldo,
+auditoria e faturamento linha a linha; no fim reconstrói o faturamento
+mensal e roda ANALYZE. Os saldos iniciais são folgados para o load
+generator não esbarrar em saldo insuficiente.
+
+Escreve --saida (padrão bench/seed.json) com as faixas de ids e a senha,
+lido por bench/load.py. Rode contra um banco local descartável:
+
+    python bench/seed.py --usuarios 1000000 --transacoes 10000000 --meses 12
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+import asyncpg
+
+from _comum import DATABASE_URL, agora_ms
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+LOTE = 100_000
+SENHA = "bench"
+SALDO_INICIAL = 100_000_000
+SALARIO = 800_000
+
+
+async def _proximo_id(con, tabela, coluna):
+    return await con.fetchval(f"SELECT coalesce(max({coluna}), 0) + 1 FROM {tabela}")
+
+
+async def _ajustar_sequencia(con, tabela, coluna):
+    await con.execute(
+        f"SELECT setval(pg_get_serial_sequence('{tabela}', '{coluna}'), (SELECT max({coluna}) FROM {tabela}))"
+    )
+
+
+async def _copiar(con, tabela, colunas, gerar, total):
+    t0 = agora_ms()
+    for inicio in range(0, total, LOTE):
+        fim = min(total, inicio + LOTE)
+        await con.copy_records_to_table(tabela, records=gerar(inicio, fim), columns=colunas)
+        print(f"  {tabela}: {fim}/{total}", file=sys.stderr)
+    return round((agora_ms() - t0) / 1000, 1)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--usuarios", type=int, default=1_000_000)
+    ap.add_argument("--transacoes", type=int, default=10_000_000)
+    ap.add_argument("--meses", type=int, default=12, help="meses de histórico das transações")
+    ap.add_argument("--semente", type=int, default=42)
+    ap.add_argument("--saida", default=os.path.join(os.path.dirname(__file__), "seed.json"))
+    args = ap.parse_args()
+
+    from main import pwd_context
+
+    rnd = random.Random(args.semente)
+    senha_hash = pwd_context.hash(SENHA)
+
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        await con.execute("SET session_replication_role = replica")
+        comerciantes = [r["id_comerciante"] for r in await con.fetch("SELECT id_comerciante FROM tb_comerciante")]
+        u0 = await _proximo_id(con, "tb_usuario", "id_usuario")
+        c0 = await _proximo_id(con, "tb_conta", "id_conta")
+        t0 = await _proximo_id(con, "tb_transacao", "id_transacao")
+        n = args.usuarios
+        tempos = {}
+
+        def usuarios(inicio, fim):
+            for i in range(inicio, fim):
+                uid = u0 + i
+                yield (uid, f"Bench {uid}", f"seed{uid}@bench.finpay", None,
+                       f"9{uid:010d}", senha_hash, "PF")
+
+        tempos["tb_usuario"] = await _copiar(
+            con, "tb_usuario",
+            ["id_usuario", "nome", "email", "telefone", "doc_cpf_cnpj", "senha_hash", "tipo_pessoa"],
+            usuarios, n,
+        )
+
+        def contas(inicio, fim):
+            for i in range(inicio, fim):
+                yield (c0 + i, u0 + i, f"B{c0 + i:011d}", "0001", SALDO_INICIAL, SALARIO)
+
+        tempos["tb_conta"] = await _copiar(
+            con, "tb_conta",
+            ["id_conta", "id_usuario", "numero_conta", "agencia", "saldo_cents", "salario_mensal_cents"],
+            contas, n,
+        )
+
+        hoje = date.today().replace(day=1)
+        m = hoje.year * 12 + hoje.month - 1 - args.meses
+        inicio_hist = date(m // 12, m % 12 + 1, 1)
+        await con.execute(
+            "SELECT fn_criar_particoes_mensais('tb_transacao', $1, $2)", inicio_hist, hoje + timedelta(days=93)
+        )
+        agora = datetime.now()
+        janela_s = int((agora - datetime.combine(inicio_hist, datetime.min.time())).total_seconds())
+
+        def transacoes(inicio, fim):
+            for i in range(inicio, fim):
+                criado = agora - timedelta(seconds=rnd.randrange(janela_s))
+                de = c0 + rnd.randrange(n)
+                valor = rnd.randint(100, 50_000)
+                k = i % 4
+                if k == 0:
+                    linha = (de, None, rnd.choice(comerciantes), "payment")
+                elif k == 1:
+                    linha = (de, c0 + rnd.randrange(n), None, "transfer")
+                elif k == 2:
+                    linha = (None, de, None, "deposit")
+                else:
+                    linha = (de, None, None, "withdrawal")
+                yield (t0 + i, *linha, valor, "confirmed", f"SEED-{t0 + i}", criado, criado)
+
+        tempos["tb_transacao"] = await _copiar(
+            con, "tb_transacao",
+            ["id_transacao", "id_conta_de", "id_conta_para", "id_comerciante", "tipo",
+             "valor_cents", "status", "referencia", "criado_em", "confirmado_em"],
+            transacoes, args.transacoes,
+        )
+
+        await con.execute("SET session_replication_role = origin")
+        for tabela, coluna in (("tb_usuario", "id_usuario"), ("tb_conta", "id_conta"),
+                               ("tb_transacao", "id_transacao")):
+            await _ajustar_sequencia(con, tabela, coluna)
+        await con.execute("SELECT fn_rebuild_faturamento_mensal()")
+        await con.execute("ANALYZE tb_usuario; ANALYZE tb_conta; ANALYZE tb_transacao; ANALYZE tb_faturamento_mensal")
+    finally:
+        await con.close()
+
+    seed = {
+        "usuarios": [u0, u0 + n - 1],
+        "contas": [c0, c0 + n - 1],
+        "doc_formato": "9{id_usuario:010d}",
+        "senha": SENHA,
+        "comerciantes": comerciantes,
+        "transacoes": args.transacoes,
+        "tempos_s": tempos,
+    }
+    with open(args.saida, "w") as f:
+        json.dump(seed, f, indent=2)
+    print(json.dumps(seed, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""Custo de serialização por --linhas linhas (padrão 10k), sem HTTP.
+
+Busca linhas com o formato do extrato (StatementItem) e do faturamento
+(FaturamentoOut, com NUMERIC e date) geradas por generate_series, e mede:
+  - padrao:   dict(r) + jsonable_encoder + json.dumps (caminho antigo do FastAPI)
+  - modelo:   validação + serialização pelo response_model (pydantic) + orjson
+  - records:  records_response, orjson direto nos Records
+  - json_agg: o Postgres monta o JSON (tempo de banco, comparado ao fetch puro)
+Confere que todos os caminhos produzem o mesmo JSON.
+
+    python bench/serialization.py --linhas 10000 --repeticoes 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+import asyncpg
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import main as api  # noqa: E402
+
+from _comum import DATABASE_URL, imprimir  # noqa: E402
+
+CONJUNTOS = {
+    "extrato": (api.StatementItem, """
+        SELECT g::bigint AS id_transacao, localtimestamp - g * interval '1 minute' AS criado_em,
+               'transfer'::text AS tipo, 'confirmed'::text AS status, (g * 37 % 100000)::bigint AS valor_cents,
+               'PIX-' || g AS referencia, g::bigint AS id_conta_de, (g + 1)::bigint AS id_conta_para,
+               NULL::bigint AS id_comerciante, 'debito'::text AS direcao
+        FROM generate_series(1, $1) g
+    """),
+    "faturamento": (api.FaturamentoOut, """
+        SELECT (g % 500)::bigint AS id_comerciante, 'Loja ' || (g % 500) AS nome_fantasia,
+               (date '2020-01-01' + (g / 500) * interval '1 month')::date AS mes,
+               (g * 1234)::numeric AS total_cents, (g % 90)::bigint AS qtde
+        FROM generate_series(1, $1) g
+    """),
+}
+
+
+def _ms(fn, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn()
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(tempos), 2)
+
+
+def padrao(rows):
+    return json.dumps(jsonable_encoder([dict(r) for r in rows]), ensure_ascii=False,
+                      separators=(",", ":")).encode()
+
+
+def modelo(adaptador, rows):
+    validado = adaptador.validate_python([dict(r) for r in rows])
+    return orjson.dumps(adaptador.dump_python(validado, mode="json"))
+
+
+def records(rows):
+    return api.records_response(rows).body
+
+
+async def _medir_banco(con, sql, linhas, repeticoes):
+    agg = f"SELECT coalesce(json_agg(x), '[]')::text FROM ({sql}) x"
+    fetch, json_agg = [], []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        await con.fetch(sql, linhas)
+        fetch.append((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        await con.fetchval(agg, linhas)
+        json_agg.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(fetch), 2), round(statistics.median(json_agg), 2)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--linhas", type=int, default=10_000)
+    ap.add_argument("--repeticoes", type=int, default=20)
+    args = ap.parse_args()
+
+    resultado = {"linhas": args.linhas}
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        for nome, (modelo_resposta, sql) in CONJUNTOS.items():
+            rows = await con.fetch(sql, args.linhas)
+            adaptador = TypeAdapter(List[modelo_resposta])
+            saidas = {
+                "padrao": padrao(rows),
+                "modelo": modelo(adaptador, rows),
+                "records": records(rows),
+            }
+            referencia = json.loads(saidas["padrao"])
+            fetch_ms, json_agg_ms = await _medir_banco(con, sql, args.linhas, args.repeticoes)
+            resultado[nome] = {
+                "padrao_ms": _ms(lambda: padrao(rows), args.repeticoes),
+                "modelo_ms": _ms(lambda: modelo(adaptador, rows), args.repeticoes),
+                "records_ms": _ms(lambda: records(rows), args.repeticoes),
+                "banco_fetch_ms": fetch_ms,
+                "banco_json_agg_ms": json_agg_ms,
+                "bytes": len(saidas["records"]),
+                "mesmo_json": all(json.loads(s) == referencia for s in saidas.values()),
+            }
+    finally:
+        await con.close()
+    imprimir(resultado)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
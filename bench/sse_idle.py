@@ -0,0 +1,168 @@
+"""Assinantes SSE ociosos: custo por conexão e latência de fan-out.
+
+Abre --assinantes conexões em /accounts/{id}/events (contas do seed de
+bench/seed.py, --por-conta assinantes em cada), deixa todas ociosas por
+--ocioso segundos e depois faz --depositos depósitos em contas assinadas,
+medindo quanto tempo cada assinante leva para receber o saldo novo. Com
+--pid (worker do gunicorn, ou o uvicorn), mostra também o RSS antes/depois.
+Para medir por worker, suba a API com WEB_CONCURRENCY=1; a API e este script
+precisam de ulimit -n acima de --assinantes.
+
+    python bench/sse_idle.py --assinantes 10000 --por-conta 10 --ocioso 60 --depositos 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+from urllib.parse import urlsplit
+
+import httpx
+
+from _comum import API_URL, agora_ms, imprimir, resumo
+
+
+def _rss_kb(pid):
+    if not pid:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for linha in f:
+            if linha.startswith("VmRSS:"):
+                return int(linha.split()[1])
+    return None
+
+
+async def _metrica(client, nome):
+    for linha in (await client.get("/metrics")).text.splitlines():
+        if linha.startswith(nome + " "):
+            return float(linha.split()[1])
+    return None
+
+
+class Assinante:
+    """Conexão HTTP crua: 10k clientes httpx custariam mais que a própria API."""
+
+    def __init__(self, id_usuario, id_conta):
+        self.id_usuario = id_usuario
+        self.id_conta = id_conta
+        self.reader = self.writer = None
+
+    async def conectar(self, host, porta):
+        self.reader, self.writer = await asyncio.open_connection(host, porta)
+        self.writer.write(
+            f"GET /accounts/{self.id_conta}/events?user_id={self.id_usuario} HTTP/1.1\r\n"
+            f"Host: {host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+        )
+        status = await self.reader.readline()
+        if b" 200 " not in status:
+            raise RuntimeError(status.decode().strip())
+
+    async def ler(self, enviados, latencias):
+        # resposta chunked: cada quadro SSE chega inteiro num chunk, então
+        # basta olhar as linhas "event:"/"data:" e ignorar os tamanhos
+        evento = None
+        while True:
+            linha = await self.reader.readline()
+            if not linha:
+                return
+            linha = linha.decode().strip()
+            if linha.startswith("event:"):
+                evento = linha[6:].strip()
+            elif linha.startswith("data:") and evento == "saldo":
+                dados = json.loads(linha[5:])
+                t0 = enviados.get(dados["id_conta"])
+                if t0 is not None:
+                    latencias.append(agora_ms() - t0)
+
+    def fechar(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seed", default=os.path.join(os.path.dirname(__file__), "seed.json"))
+    ap.add_argument("--assinantes", type=int, default=10_000)
+    ap.add_argument("--por-conta", type=int, default=10)
+    ap.add_argument("--ocioso", type=float, default=60)
+    ap.add_argument("--depositos", type=int, default=200)
+    ap.add_argument("--concorrencia", type=int, default=200, help="conexões abertas em paralelo")
+    ap.add_argument("--pid", type=int, help="pid do worker da API para medir RSS")
+    args = ap.parse_args()
+
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+    with open(args.seed) as f:
+        seed = json.load(f)
+    url = urlsplit(API_URL)
+    host, porta = url.hostname, url.port or 80
+
+    contas = -(-args.assinantes // args.por_conta)
+    u0, c0 = seed["usuarios"][0], seed["contas"][0]
+    assinantes = [Assinante(u0 + i % contas, c0 + i % contas) for i in range(args.assinantes)]
+    enviados, latencias = {}, []
+
+    async with httpx.AsyncClient(base_url=API_URL, timeout=30) as client:
+        rss_antes = _rss_kb(args.pid)
+        sem = asyncio.Semaphore(args.concorrencia)
+        falhas = []
+
+        async def abrir(a):
+            async with sem:
+                try:
+                    await a.conectar(host, porta)
+                except Exception as e:
+                    falhas.append(str(e))
+                    a.writer = None
+
+        t0 = agora_ms()
+        await asyncio.gather(*(abrir(a) for a in assinantes))
+        conexao_s = (agora_ms() - t0) / 1000
+        abertos = [a for a in assinantes if a.writer is not None]
+        leitores = [asyncio.create_task(a.ler(enviados, latencias)) for a in abertos]
+        print(f"{len(abertos)} assinantes abertos em {conexao_s:.1f}s; ociosos por {args.ocioso:.0f}s",
+              file=sys.stderr)
+
+        await asyncio.sleep(args.ocioso)
+        rss_ocioso = _rss_kb(args.pid)
+        no_servidor = await _metrica(client, "finpay_sse_subscribers")
+
+        rnd = random.Random(1)
+        for _ in range(args.depositos):
+            i = rnd.randrange(contas)
+            enviados[c0 + i] = agora_ms()
+            r = await client.post("/accounts/deposit", json={"valor_cents": 100},
+                                  headers={"X-User-Id": str(u0 + i)})
+            r.raise_for_status()
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(2)
+        descartados = await _metrica(client, "finpay_sse_dropped_total")
+
+        for a in abertos:
+            a.fechar()
+        for t in leitores:
+            t.cancel()
+        await asyncio.gather(*leitores, return_exceptions=True)
+
+    imprimir({
+        "assinantes": args.assinantes,
+        "abertos": len(abertos),
+        "falhas": len(falhas),
+        "exemplos_falhas": falhas[:5],
+        "conexao_s": round(conexao_s, 1),
+        "assinantes_no_worker": no_servidor,
+        "rss_kb": {"antes": rss_antes, "ocioso": rss_ocioso},
+        "kb_por_assinante": (round((rss_ocioso - rss_antes) / len(abertos), 1)
+                             if rss_antes and rss_ocioso and abertos else None),
+        "entrega_saldo": resumo(latencias),
+        "entregas_esperadas": args.depositos * args.por_conta,
+        "descartados": descartados,
+    })
+    if falhas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,8 @@
+-- 05-pix-keys.sql — índices para resolução de chave Pix em /transfers
+-- doc_cpf_cnpj e email já têm índice único; id_conta é a PK.
+
+CREATE INDEX IF NOT EXISTS idx_usuario_telefone ON tb_usuario (telefone);
+-- tb_conta só tinha (id_usuario, numero_conta) via uq_conta_usuario, que já
+-- serve para buscas por id_usuario.
+
+ANALYZE tb_usuario;
@@ -0,0 +1,14 @@
+-- 06-statement-indexes.sql — índices para o extrato (GET /accounts/{id}/statement)
+-- Paginação por chave (criado_em, id_transacao) em cada lado da transação.
+-- CONCURRENTLY para não travar escrita em tb_transacao grande; não rode
+-- este arquivo dentro de uma transação.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transacao_de_data
+  ON tb_transacao (id_conta_de, criado_em DESC, id_transacao DESC)
+  WHERE id_conta_de IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transacao_para_data
+  ON tb_transacao (id_conta_para, criado_em DESC, id_transacao DESC)
+  WHERE id_conta_para IS NOT NULL;
+
+ANALYZE tb_transacao;
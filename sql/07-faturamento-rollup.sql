@@ -0,0 +1,85 @@
+-- 07-faturamento-rollup.sql — faturamento mensal por comerciante mantido de
+-- forma incremental, em vez de agregar tb_transacao inteira a cada consulta.
+
+CREATE TABLE IF NOT EXISTS tb_faturamento_mensal (
+  id_comerciante    BIGINT NOT NULL REFERENCES tb_comerciante(id_comerciante),
+  mes               DATE NOT NULL,
+  total_cents       BIGINT NOT NULL DEFAULT 0,
+  qtde              BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (id_comerciante, mes)
+);
+
+CREATE INDEX IF NOT EXISTS idx_faturamento_mes ON tb_faturamento_mensal (mes);
+
+CREATE OR REPLACE FUNCTION fn_faturamento_aplica(p_comerciante BIGINT, p_criado_em TIMESTAMP, p_valor BIGINT, p_qtde INT)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO tb_faturamento_mensal AS f (id_comerciante, mes, total_cents, qtde)
+  VALUES (p_comerciante, date_trunc('month', p_criado_em)::date, p_valor, p_qtde)
+  ON CONFLICT (id_comerciante, mes) DO UPDATE
+    SET total_cents = f.total_cents + EXCLUDED.total_cents,
+        qtde        = f.qtde + EXCLUDED.qtde;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Só pagamentos confirmados contam; um UPDATE que muda status/valor desfaz a
+-- contribuição antiga e aplica a nova.
+CREATE OR REPLACE FUNCTION fn_faturamento_mensal() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE','DELETE')
+     AND OLD.tipo = 'payment' AND OLD.status = 'confirmed' AND OLD.id_comerciante IS NOT NULL THEN
+    PERFORM fn_faturamento_aplica(OLD.id_comerciante, OLD.criado_em, -OLD.valor_cents, -1);
+  END IF;
+  IF TG_OP IN ('INSERT','UPDATE')
+     AND NEW.tipo = 'payment' AND NEW.status = 'confirmed' AND NEW.id_comerciante IS NOT NULL THEN
+    PERFORM fn_faturamento_aplica(NEW.id_comerciante, NEW.criado_em, NEW.valor_cents, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_faturamento_mensal ON tb_transacao;
+CREATE TRIGGER trg_faturamento_mensal
+AFTER INSERT OR DELETE OR UPDATE OF tipo, status, valor_cents, id_comerciante, criado_em ON tb_transacao
+FOR EACH ROW EXECUTE FUNCTION fn_faturamento_mensal();
+
+-- Reconstrói o agregado (tudo ou [p_de, p_ate) em meses) a partir do razão.
+-- Trava escrita em tb_transacao durante a reconstrução para não perder
+-- pagamentos confirmados no meio do caminho.
+CREATE OR REPLACE FUNCTION fn_rebuild_faturamento_mensal(p_de DATE DEFAULT NULL, p_ate DATE DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+  v_linhas BIGINT;
+BEGIN
+  LOCK TABLE tb_transacao IN SHARE MODE;
+
+  DELETE FROM tb_faturamento_mensal
+  WHERE (p_de IS NULL OR mes >= p_de) AND (p_ate IS NULL OR mes < p_ate);
+
+  INSERT INTO tb_faturamento_mensal (id_comerciante, mes, total_cents, qtde)
+  SELECT t.id_comerciante, date_trunc('month', t.criado_em)::date, SUM(t.valor_cents), COUNT(*)
+  FROM tb_transacao t
+  WHERE t.tipo = 'payment' AND t.status = 'confirmed' AND t.id_comerciante IS NOT NULL
+    AND (p_de IS NULL OR t.criado_em >= p_de)
+    AND (p_ate IS NULL OR t.criado_em < p_ate)
+  GROUP BY t.id_comerciante, date_trunc('month', t.criado_em);
+
+  GET DIAGNOSTICS v_linhas = ROW_COUNT;
+  RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A view passa a ler o agregado; mesmas colunas e tipos de antes.
+CREATE OR REPLACE VIEW vw_faturamento_mensal AS
+SELECT
+  f.id_comerciante,
+  m.nome_fantasia,
+  f.mes,
+  f.total_cents::numeric AS total_cents,
+  f.qtde
+FROM tb_faturamento_mensal f
+JOIN tb_comerciante m ON m.id_comerciante = f.id_comerciante;
+
+SELECT fn_rebuild_faturamento_mensal();
+
+GRANT SELECT ON tb_faturamento_mensal TO finpay_auditor;
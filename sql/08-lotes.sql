@@ -0,0 +1,32 @@
+-- 08-lotes.sql — inserção em lote para /payments/batch e /transfers/batch
+-- (modo por item). Cada item roda num subtransação própria dentro de uma
+-- única chamada: falhas (ex.: saldo insuficiente) ficam registradas no item
+-- e não desfazem os demais.
+
+CREATE OR REPLACE FUNCTION fn_inserir_lote(
+  p_tipo          transaction_type,
+  p_conta_de      BIGINT,
+  p_contas_para   BIGINT[],
+  p_comerciantes  BIGINT[],
+  p_valores       BIGINT[],
+  p_referencias   TEXT[]
+)
+RETURNS TABLE (ordem INT, transacao BIGINT, erro TEXT) AS $$
+DECLARE
+  i INT;
+BEGIN
+  FOR i IN 1..coalesce(array_length(p_valores, 1), 0) LOOP
+    ordem := i;
+    transacao := NULL;
+    erro := NULL;
+    BEGIN
+      INSERT INTO tb_transacao (id_conta_de, id_conta_para, id_comerciante, tipo, valor_cents, status, referencia)
+      VALUES (p_conta_de, p_contas_para[i], p_comerciantes[i], p_tipo, p_valores[i], 'confirmed', p_referencias[i])
+      RETURNING id_transacao INTO transacao;
+    EXCEPTION WHEN OTHERS THEN
+      erro := SQLERRM;
+    END;
+    RETURN NEXT;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,81 @@
+-- 09-parcelas-set-based.sql — geração do cronograma de parcelas em um único
+-- INSERT ... SELECT sobre generate_series, e concessão em lote.
+
+-- Gera (ou regera) as parcelas dos empréstimos informados, vencendo
+-- mensalmente a partir de p_inicio. Retorna o número de parcelas criadas.
+CREATE OR REPLACE FUNCTION fn_gerar_parcelas(p_ids BIGINT[], p_inicio DATE DEFAULT CURRENT_DATE)
+RETURNS BIGINT AS $$
+DECLARE
+  v_linhas BIGINT;
+BEGIN
+  DELETE FROM tb_parcela WHERE id_emprestimo = ANY(p_ids);
+
+  INSERT INTO tb_parcela (id_emprestimo, num_parcela, vencimento, valor_cents)
+  SELECT e.id_emprestimo, n, (p_inicio + make_interval(months => n))::date, v.pmt
+  FROM tb_emprestimo e
+  CROSS JOIN LATERAL (SELECT fn_pmt(e.principal_cents, e.juros_aa_pct, e.prazo_meses) AS pmt) v
+  CROSS JOIN LATERAL generate_series(1, e.prazo_meses) n
+  WHERE e.id_emprestimo = ANY(p_ids);
+
+  GET DIAGNOSTICS v_linhas = ROW_COUNT;
+  RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE PROCEDURE sp_conceder_emprestimo(p_id_emprestimo BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_conta BIGINT;
+  v_principal BIGINT;
+BEGIN
+  SELECT id_conta, principal_cents
+    INTO v_conta, v_principal
+  FROM tb_emprestimo WHERE id_emprestimo = p_id_emprestimo FOR UPDATE;
+
+  IF NOT FOUND THEN RAISE EXCEPTION 'Empréstimo % não encontrado', p_id_emprestimo; END IF;
+
+  UPDATE tb_emprestimo SET status='disbursed', iniciado_em = CURRENT_DATE WHERE id_emprestimo = p_id_emprestimo;
+
+  PERFORM fn_gerar_parcelas(ARRAY[p_id_emprestimo]);
+
+  INSERT INTO tb_transacao (id_conta_para, tipo, valor_cents, status, referencia)
+  VALUES (v_conta, 'loan_disbursement', v_principal, 'confirmed', 'EMPR-'||p_id_emprestimo);
+END;
+$$;
+
+-- Concede de uma vez todos os empréstimos 'approved' da lista: status,
+-- parcelas e desembolsos em três comandos, não um laço por empréstimo.
+-- Ids que não estão 'approved' são ignorados. Retorna quantos foram concedidos.
+CREATE OR REPLACE FUNCTION fn_conceder_emprestimos(p_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+  v_ids BIGINT[];
+BEGIN
+  WITH concedidos AS (
+    UPDATE tb_emprestimo
+       SET status = 'disbursed', iniciado_em = CURRENT_DATE
+     WHERE id_emprestimo = ANY(p_ids) AND status = 'approved'
+    RETURNING id_emprestimo
+  )
+  SELECT array_agg(id_emprestimo) INTO v_ids FROM concedidos;
+
+  IF v_ids IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  PERFORM fn_gerar_parcelas(v_ids);
+
+  -- ordenado por conta para que lotes concorrentes travem tb_conta na mesma ordem
+  INSERT INTO tb_transacao (id_conta_para, tipo, valor_cents, status, referencia)
+  SELECT e.id_conta, 'loan_disbursement', e.principal_cents, 'confirmed', 'EMPR-'||e.id_emprestimo
+  FROM tb_emprestimo e
+  WHERE e.id_emprestimo = ANY(v_ids)
+  ORDER BY e.id_conta, e.id_emprestimo;
+
+  RETURN array_length(v_ids, 1);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX IF NOT EXISTS idx_emprestimo_aprovado
+  ON tb_emprestimo (id_emprestimo) WHERE status = 'approved';
@@ -0,0 +1,19 @@
+-- 10-idempotencia.sql — chaves de idempotência (header Idempotency-Key) para
+-- /accounts/deposit, /payments, /transfers e /installments/pay.
+-- A linha é gravada na mesma transação da operação; a PK garante que um
+-- retry nunca executa a operação duas vezes.
+
+CREATE TABLE IF NOT EXISTS tb_idempotencia (
+  id_usuario        BIGINT NOT NULL,
+  rota              TEXT NOT NULL,
+  chave             VARCHAR(100) NOT NULL,
+  hash_requisicao   TEXT NOT NULL,
+  status_code       INT,
+  resposta          JSONB,
+  criado_em         TIMESTAMP NOT NULL DEFAULT now(),
+  expira_em         TIMESTAMP NOT NULL,
+  PRIMARY KEY (id_usuario, rota, chave)
+);
+
+-- limpeza em lotes das chaves expiradas
+CREATE INDEX IF NOT EXISTS idx_idempotencia_expira ON tb_idempotencia (expira_em);
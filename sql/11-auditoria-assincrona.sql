@@ -0,0 +1,146 @@
+-- 11-auditoria-assincrona.sql — auditoria particionada por mês e modo
+-- assíncrono.
+--
+-- * tb_auditoria passa a ser particionada por RANGE (momento), mensal, e
+--   id_registro vira o id do registro (BIGINT) em vez da linha inteira
+--   serializada como texto.
+-- * fn_auditoria escolhe o destino pelo parâmetro finpay.auditoria:
+--     'sync'  (padrão) grava direto em tb_auditoria, como antes;
+--     'async' só enfileira em tb_auditoria_fila, e o drenador da API
+--             (ou "manage.py drenar-auditoria") move a fila em lotes.
+--   A API define o parâmetro por conexão (AUDIT_MODE); para valer para
+--   qualquer sessão: ALTER DATABASE finpay SET finpay.auditoria = 'async';
+
+-- Cria as partições mensais [p_de, p_ate] de uma tabela particionada por
+-- mês, com nome <tabela>_pAAAAMM. Retorna quantas foram criadas.
+CREATE OR REPLACE FUNCTION fn_criar_particoes_mensais(p_tabela TEXT, p_de DATE, p_ate DATE)
+RETURNS INT AS $$
+DECLARE
+  v_mes DATE;
+  v_nome TEXT;
+  v_criadas INT := 0;
+BEGIN
+  FOR v_mes IN
+    SELECT generate_series(date_trunc('month', p_de), date_trunc('month', p_ate), interval '1 month')::date
+  LOOP
+    v_nome := p_tabela || '_p' || to_char(v_mes, 'YYYYMM');
+    IF to_regclass(v_nome) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+        v_nome, p_tabela, v_mes, (v_mes + interval '1 month')::date
+      );
+      v_criadas := v_criadas + 1;
+    END IF;
+  END LOOP;
+  RETURN v_criadas;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  v_inicio DATE;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = 'tb_auditoria'::regclass) = 'r' THEN
+    ALTER TABLE tb_auditoria RENAME TO tb_auditoria_legado;
+    ALTER TABLE tb_auditoria_legado RENAME CONSTRAINT tb_auditoria_pkey TO tb_auditoria_legado_pkey;
+
+    CREATE TABLE tb_auditoria (
+      id_auditoria      BIGINT NOT NULL DEFAULT nextval('tb_auditoria_id_auditoria_seq'),
+      tabela            TEXT NOT NULL,
+      operacao          TEXT NOT NULL,
+      id_registro       BIGINT,
+      usuario_bd        TEXT DEFAULT CURRENT_USER,
+      momento           TIMESTAMP NOT NULL DEFAULT now(),
+      dados_antes       JSONB,
+      dados_depois      JSONB,
+      PRIMARY KEY (id_auditoria, momento)
+    ) PARTITION BY RANGE (momento);
+    ALTER SEQUENCE tb_auditoria_id_auditoria_seq OWNED BY tb_auditoria.id_auditoria;
+
+    CREATE TABLE tb_auditoria_default PARTITION OF tb_auditoria DEFAULT;
+
+    SELECT date_trunc('month', coalesce(min(momento), now()))::date INTO v_inicio FROM tb_auditoria_legado;
+    PERFORM fn_criar_particoes_mensais('tb_auditoria', v_inicio, (now() + interval '3 months')::date);
+
+    INSERT INTO tb_auditoria (id_auditoria, tabela, operacao, id_registro, usuario_bd, momento, dados_antes, dados_depois)
+    SELECT
+      a.id_auditoria, a.tabela, a.operacao,
+      (coalesce(a.dados_depois, a.dados_antes) ->> CASE a.tabela
+          WHEN 'tb_transacao' THEN 'id_transacao'
+          WHEN 'tb_emprestimo' THEN 'id_emprestimo'
+        END)::bigint,
+      a.usuario_bd, a.momento, a.dados_antes, a.dados_depois
+    FROM tb_auditoria_legado a;
+
+    DROP TABLE tb_auditoria_legado;
+  END IF;
+END$$;
+
+CREATE INDEX IF NOT EXISTS idx_auditoria_registro ON tb_auditoria (tabela, id_registro);
+
+-- Fila de eventos do modo assíncrono: só a PK, sem índices extras.
+CREATE TABLE IF NOT EXISTS tb_auditoria_fila (
+  id                BIGSERIAL PRIMARY KEY,
+  tabela            TEXT NOT NULL,
+  operacao          TEXT NOT NULL,
+  id_registro       BIGINT,
+  usuario_bd        TEXT DEFAULT CURRENT_USER,
+  momento           TIMESTAMP NOT NULL DEFAULT now(),
+  dados_antes       JSONB,
+  dados_depois      JSONB
+) WITH (autovacuum_vacuum_scale_factor = 0.01);
+
+-- TG_ARGV[0]: nome da coluna de id da tabela auditada
+CREATE OR REPLACE FUNCTION fn_auditoria() RETURNS trigger AS $$
+DECLARE
+  v_antes JSONB;
+  v_depois JSONB;
+BEGIN
+  IF TG_OP <> 'INSERT' THEN v_antes := to_jsonb(OLD); END IF;
+  IF TG_OP <> 'DELETE' THEN v_depois := to_jsonb(NEW); END IF;
+
+  IF current_setting('finpay.auditoria', true) = 'async' THEN
+    INSERT INTO tb_auditoria_fila (tabela, operacao, id_registro, dados_antes, dados_depois)
+    VALUES (TG_TABLE_NAME, TG_OP, (coalesce(v_depois, v_antes) ->> TG_ARGV[0])::bigint, v_antes, v_depois);
+  ELSE
+    INSERT INTO tb_auditoria (tabela, operacao, id_registro, dados_antes, dados_depois)
+    VALUES (TG_TABLE_NAME, TG_OP, (coalesce(v_depois, v_antes) ->> TG_ARGV[0])::bigint, v_antes, v_depois);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_audit_transacao ON tb_transacao;
+CREATE TRIGGER trg_audit_transacao
+AFTER INSERT OR UPDATE OR DELETE ON tb_transacao
+FOR EACH ROW EXECUTE FUNCTION fn_auditoria('id_transacao');
+
+DROP TRIGGER IF EXISTS trg_audit_emprestimo ON tb_emprestimo;
+CREATE TRIGGER trg_audit_emprestimo
+AFTER INSERT OR UPDATE OR DELETE ON tb_emprestimo
+FOR EACH ROW EXECUTE FUNCTION fn_auditoria('id_emprestimo');
+
+-- Move até p_lote eventos da fila para tb_auditoria; retorna quantos moveu.
+-- SKIP LOCKED deixa vários drenadores (um por worker) rodarem juntos.
+CREATE OR REPLACE FUNCTION fn_drenar_auditoria(p_lote INT)
+RETURNS INT AS $$
+DECLARE
+  v_linhas INT;
+BEGIN
+  WITH lote AS (
+    DELETE FROM tb_auditoria_fila
+    WHERE id IN (
+      SELECT id FROM tb_auditoria_fila ORDER BY id LIMIT p_lote FOR UPDATE SKIP LOCKED
+    )
+    RETURNING tabela, operacao, id_registro, usuario_bd, momento, dados_antes, dados_depois
+  )
+  INSERT INTO tb_auditoria (tabela, operacao, id_registro, usuario_bd, momento, dados_antes, dados_depois)
+  SELECT tabela, operacao, id_registro, usuario_bd, momento, dados_antes, dados_depois FROM lote;
+
+  GET DIAGNOSTICS v_linhas = ROW_COUNT;
+  RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE UPDATE, DELETE ON tb_auditoria FROM finpay_operador;
+GRANT SELECT ON tb_auditoria TO finpay_auditor;
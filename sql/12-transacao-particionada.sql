@@ -0,0 +1,81 @@
+-- 12-transacao-particionada.sql — tb_transacao particionada por mês em
+-- criado_em (RANGE), com partição default para o que cair fora.
+-- tb_auditoria já foi convertida em 11-auditoria-assincrona.sql.
+--
+-- A conversão copia a tabela inteira: rode em janela de manutenção. As
+-- partições futuras e o arquivamento das antigas ficam com
+-- "manage.py criar-particoes" / "arquivar-particoes" / "verificar-particoes".
+
+DO $$
+DECLARE
+  v_inicio DATE;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = 'tb_transacao'::regclass) = 'r' THEN
+    ALTER TABLE tb_transacao RENAME TO tb_transacao_legado;
+    ALTER TABLE tb_transacao_legado RENAME CONSTRAINT tb_transacao_pkey TO tb_transacao_legado_pkey;
+    DROP INDEX IF EXISTS idx_transacao_status;
+    DROP INDEX IF EXISTS idx_transacao_tipo_data;
+    DROP INDEX IF EXISTS idx_transacao_de_data;
+    DROP INDEX IF EXISTS idx_transacao_para_data;
+
+    CREATE TABLE tb_transacao (
+      id_transacao      BIGINT NOT NULL DEFAULT nextval('tb_transacao_id_transacao_seq'),
+      id_conta_de       BIGINT REFERENCES tb_conta(id_conta),
+      id_conta_para     BIGINT REFERENCES tb_conta(id_conta),
+      id_comerciante    BIGINT REFERENCES tb_comerciante(id_comerciante),
+      tipo              transaction_type NOT NULL,
+      valor_cents       BIGINT NOT NULL CHECK (valor_cents >= 0),
+      status            transaction_status NOT NULL DEFAULT 'pending',
+      referencia        VARCHAR(60),
+      criado_em         TIMESTAMP NOT NULL DEFAULT now(),
+      confirmado_em     TIMESTAMP,
+      PRIMARY KEY (id_transacao, criado_em)
+    ) PARTITION BY RANGE (criado_em);
+    ALTER SEQUENCE tb_transacao_id_transacao_seq OWNED BY tb_transacao.id_transacao;
+
+    CREATE TABLE tb_transacao_default PARTITION OF tb_transacao DEFAULT;
+
+    SELECT date_trunc('month', coalesce(min(criado_em), now()))::date INTO v_inicio FROM tb_transacao_legado;
+    PERFORM fn_criar_particoes_mensais('tb_transacao', v_inicio, (now() + interval '3 months')::date);
+
+    -- cópia antes de criar os gatilhos: saldos e faturamento já refletem estas linhas
+    INSERT INTO tb_transacao (id_transacao, id_conta_de, id_conta_para, id_comerciante, tipo,
+                              valor_cents, status, referencia, criado_em, confirmado_em)
+    SELECT id_transacao, id_conta_de, id_conta_para, id_comerciante, tipo,
+           valor_cents, status, referencia, criado_em, confirmado_em
+    FROM tb_transacao_legado;
+
+    DROP TABLE tb_transacao_legado;
+  END IF;
+END$$;
+
+-- Índices (criados em cada partição)
+CREATE INDEX IF NOT EXISTS idx_transacao_status ON tb_transacao (status);
+CREATE INDEX IF NOT EXISTS idx_transacao_tipo_data ON tb_transacao (tipo, criado_em);
+CREATE INDEX IF NOT EXISTS idx_transacao_de_data
+  ON tb_transacao (id_conta_de, criado_em DESC, id_transacao DESC)
+  WHERE id_conta_de IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_transacao_para_data
+  ON tb_transacao (id_conta_para, criado_em DESC, id_transacao DESC)
+  WHERE id_conta_para IS NOT NULL;
+
+-- Gatilhos
+DROP TRIGGER IF EXISTS trg_valida_saldo ON tb_transacao;
+CREATE TRIGGER trg_valida_saldo
+AFTER INSERT ON tb_transacao
+FOR EACH ROW EXECUTE FUNCTION fn_valida_saldo();
+
+DROP TRIGGER IF EXISTS trg_audit_transacao ON tb_transacao;
+CREATE TRIGGER trg_audit_transacao
+AFTER INSERT OR UPDATE OR DELETE ON tb_transacao
+FOR EACH ROW EXECUTE FUNCTION fn_auditoria('id_transacao');
+
+DROP TRIGGER IF EXISTS trg_faturamento_mensal ON tb_transacao;
+CREATE TRIGGER trg_faturamento_mensal
+AFTER INSERT OR DELETE OR UPDATE OF tipo, status, valor_cents, id_comerciante, criado_em ON tb_transacao
+FOR EACH ROW EXECUTE FUNCTION fn_faturamento_mensal();
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON tb_transacao TO finpay_admin;
+GRANT SELECT, INSERT ON tb_transacao TO finpay_operador;
+
+ANALYZE tb_transacao;
@@ -0,0 +1,106 @@
+-- 13-contas-quentes.sql — contas "quentes" (comerciantes grandes, contas de
+-- arrecadação) sem fila de lock em tb_conta.
+--
+-- Créditos para contas com conta_quente = TRUE não fazem UPDATE na linha da
+-- conta: viram linhas em tb_credito_pendente (só INSERT, sem lock
+-- compartilhado). A API consolida os pendentes periodicamente e todo débito
+-- da conta consolida antes de validar o saldo. Saldo visível =
+-- saldo_cents + pendentes (ver vw_contas_saldo / fn_saldo_conta).
+-- Ordem de locks em todos os caminhos: linha de tb_conta, depois pendentes.
+-- O débito trava a origem com FOR NO KEY UPDATE (antes FOR UPDATE): as FKs
+-- de tb_transacao/tb_credito_pendente pegam FOR KEY SHARE na conta, e com
+-- FOR UPDATE cada crédito recebido bloquearia os débitos da conta quente.
+
+ALTER TABLE tb_conta ADD COLUMN IF NOT EXISTS conta_quente BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS tb_credito_pendente (
+  id                BIGSERIAL PRIMARY KEY,
+  id_conta          BIGINT NOT NULL REFERENCES tb_conta(id_conta),
+  valor_cents       BIGINT NOT NULL CHECK (valor_cents >= 0),
+  id_transacao      BIGINT,
+  criado_em         TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_credito_pendente_conta ON tb_credito_pendente (id_conta);
+
+CREATE OR REPLACE FUNCTION fn_creditar(p_conta BIGINT, p_valor BIGINT, p_id_transacao BIGINT)
+RETURNS void AS $$
+BEGIN
+  IF (SELECT conta_quente FROM tb_conta WHERE id_conta = p_conta) THEN
+    INSERT INTO tb_credito_pendente (id_conta, valor_cents, id_transacao)
+    VALUES (p_conta, p_valor, p_id_transacao);
+  ELSE
+    UPDATE tb_conta SET saldo_cents = saldo_cents + p_valor WHERE id_conta = p_conta;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Incorpora os créditos pendentes de uma conta ao saldo. Retorna o valor.
+CREATE OR REPLACE FUNCTION fn_consolidar_creditos(p_conta BIGINT)
+RETURNS BIGINT AS $$
+DECLARE
+  v_total BIGINT;
+BEGIN
+  PERFORM 1 FROM tb_conta WHERE id_conta = p_conta FOR NO KEY UPDATE;
+
+  WITH movidos AS (
+    DELETE FROM tb_credito_pendente WHERE id_conta = p_conta RETURNING valor_cents
+  )
+  SELECT coalesce(sum(valor_cents), 0) INTO v_total FROM movidos;
+
+  IF v_total > 0 THEN
+    UPDATE tb_conta SET saldo_cents = saldo_cents + v_total WHERE id_conta = p_conta;
+  END IF;
+  RETURN v_total;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_saldo_conta(p_conta BIGINT)
+RETURNS BIGINT AS $$
+  SELECT c.saldo_cents + CASE WHEN c.conta_quente
+           THEN coalesce((SELECT sum(p.valor_cents) FROM tb_credito_pendente p WHERE p.id_conta = c.id_conta), 0)
+           ELSE 0 END
+  FROM tb_conta c WHERE c.id_conta = p_conta;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION fn_valida_saldo() RETURNS trigger AS $$
+DECLARE
+  saldo_atual BIGINT;
+  quente BOOLEAN;
+BEGIN
+  IF NEW.tipo IN ('withdrawal','transfer','payment','fee', 'loan_repayment') AND NEW.status = 'confirmed' THEN
+    IF NEW.id_conta_de IS NULL THEN
+      RAISE EXCEPTION 'Transação requer conta de origem';
+    END IF;
+    SELECT saldo_cents, conta_quente INTO saldo_atual, quente FROM tb_conta WHERE id_conta = NEW.id_conta_de FOR NO KEY UPDATE;
+    IF quente THEN
+      saldo_atual := saldo_atual + fn_consolidar_creditos(NEW.id_conta_de);
+    END IF;
+    IF saldo_atual < NEW.valor_cents THEN
+      RAISE EXCEPTION 'Saldo insuficiente (conta %, saldo %, valor %)', NEW.id_conta_de, saldo_atual, NEW.valor_cents;
+    END IF;
+    UPDATE tb_conta SET saldo_cents = saldo_cents - NEW.valor_cents WHERE id_conta = NEW.id_conta_de;
+    IF NEW.id_conta_para IS NOT NULL THEN
+      PERFORM fn_creditar(NEW.id_conta_para, NEW.valor_cents, NEW.id_transacao);
+    END IF;
+  ELSIF NEW.tipo IN ('deposit','loan_disbursement') AND NEW.status='confirmed' THEN
+    IF NEW.id_conta_para IS NULL THEN
+      RAISE EXCEPTION 'Transação de crédito requer conta de destino';
+    END IF;
+    PERFORM fn_creditar(NEW.id_conta_para, NEW.valor_cents, NEW.id_transacao);
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Views de saldo passam a incluir os créditos pendentes
+CREATE OR REPLACE VIEW vw_contas_saldo AS
+SELECT c.id_conta, u.nome AS titular, c.numero_conta, c.agencia,
+       fn_saldo_conta(c.id_conta) AS saldo_cents, c.status
+FROM tb_conta c JOIN tb_usuario u ON u.id_usuario = c.id_usuario;
+
+CREATE OR REPLACE VIEW vw_conta_por_usuario AS
+SELECT u.id_usuario, c.id_conta, fn_saldo_conta(c.id_conta) AS saldo_cents,
+       c.salario_mensal_cents, c.status, c.numero_conta
+FROM tb_usuario u
+JOIN tb_conta c ON c.id_usuario = u.id_usuario;
@@ -0,0 +1,33 @@
+-- 14-notificacoes-cache.sql — avisos de invalidação para os caches em
+-- memória da API (vários workers). Canal finpay_cache:
+--   'conta:<id_usuario>'  usuário -> conta mudou
+--   'pix'                 chaves Pix podem ter mudado (o worker limpa o cache)
+-- pg_notify dentro da transação só é entregue no COMMIT.
+
+CREATE OR REPLACE FUNCTION fn_notificar_cache() RETURNS trigger AS $$
+BEGIN
+  IF TG_TABLE_NAME = 'tb_conta' THEN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+      PERFORM pg_notify('finpay_cache', 'conta:' || NEW.id_usuario);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+      PERFORM pg_notify('finpay_cache', 'conta:' || OLD.id_usuario);
+      PERFORM pg_notify('finpay_cache', 'pix');
+    END IF;
+  ELSE
+    PERFORM pg_notify('finpay_cache', 'pix');
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- UPDATE OF: movimentação de saldo não dispara aviso
+DROP TRIGGER IF EXISTS trg_notificar_cache ON tb_conta;
+CREATE TRIGGER trg_notificar_cache
+AFTER INSERT OR DELETE OR UPDATE OF id_usuario, status ON tb_conta
+FOR EACH ROW EXECUTE FUNCTION fn_notificar_cache();
+
+DROP TRIGGER IF EXISTS trg_notificar_cache ON tb_usuario;
+CREATE TRIGGER trg_notificar_cache
+AFTER DELETE OR UPDATE OF nome, email, telefone, doc_cpf_cnpj ON tb_usuario
+FOR EACH ROW EXECUTE FUNCTION fn_notificar_cache();
@@ -0,0 +1,4 @@
+#!/bin/sh
+# 15-replicacao.sh — libera conexões de replicação física para a réplica de
+# leitura local (docker compose --profile replica). Roda só na criação do banco.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
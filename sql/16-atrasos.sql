@@ -0,0 +1,82 @@
+-- 16-atrasos.sql — detecção de atraso em lote.
+--
+-- in_arrears só mudava no gatilho de tb_parcela (ao pagar uma parcela), então
+-- empréstimo que ninguém paga nunca entrava em atraso. fn_atualizar_atrasos()
+-- marca/desmarca todos de uma vez a partir do índice parcial de parcelas em
+-- aberto; a API roda a função periodicamente (ARREARS_JOB_INTERVAL) e há
+-- "manage.py atualizar-atrasos".
+
+-- Parcelas em aberto por vencimento: o job e a view leem só as vencidas,
+-- direto do índice (INCLUDE evita ir na tabela)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parcela_aberta_venc
+  ON tb_parcela (vencimento) INCLUDE (id_emprestimo, valor_cents)
+  WHERE pago = FALSE;
+
+-- Parcelas em aberto por empréstimo: gatilho de status e listagem paginada
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parcela_aberta_emprestimo
+  ON tb_parcela (id_emprestimo, vencimento)
+  WHERE pago = FALSE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_emprestimo_em_atraso
+  ON tb_emprestimo (id_emprestimo)
+  WHERE status = 'in_arrears';
+
+-- Retorna (entraram, sairam). Sem lock de outra execução em andamento,
+-- retorna NULLs em vez de esperar.
+CREATE OR REPLACE FUNCTION fn_atualizar_atrasos(OUT entraram BIGINT, OUT sairam BIGINT) AS $$
+BEGIN
+  IF NOT pg_try_advisory_xact_lock(hashtext('finpay:atrasos')) THEN
+    RETURN;
+  END IF;
+
+  CREATE TEMP TABLE IF NOT EXISTS tmp_vencidos (id_emprestimo BIGINT PRIMARY KEY) ON COMMIT DROP;
+  TRUNCATE tmp_vencidos;
+  INSERT INTO tmp_vencidos
+  SELECT DISTINCT id_emprestimo FROM tb_parcela
+  WHERE pago = FALSE AND vencimento < CURRENT_DATE;
+  ANALYZE tmp_vencidos;
+
+  UPDATE tb_emprestimo e SET status = 'in_arrears'
+  FROM tmp_vencidos v
+  WHERE e.id_emprestimo = v.id_emprestimo AND e.status = 'disbursed';
+  GET DIAGNOSTICS entraram = ROW_COUNT;
+
+  UPDATE tb_emprestimo e SET status = 'disbursed'
+  WHERE e.status = 'in_arrears'
+    AND NOT EXISTS (SELECT 1 FROM tmp_vencidos v WHERE v.id_emprestimo = e.id_emprestimo)
+    AND EXISTS (SELECT 1 FROM tb_parcela p WHERE p.id_emprestimo = e.id_emprestimo AND p.pago = FALSE);
+  GET DIAGNOSTICS sairam = ROW_COUNT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Gatilho de tb_parcela: também tira do atraso quem pôs as parcelas em dia
+CREATE OR REPLACE FUNCTION fn_atualiza_status_emprestimo() RETURNS trigger AS $$
+DECLARE
+  qtd_restantes INT;
+BEGIN
+  SELECT COUNT(*) INTO qtd_restantes FROM tb_parcela WHERE id_emprestimo = NEW.id_emprestimo AND pago = FALSE;
+  UPDATE tb_emprestimo
+    SET status = CASE WHEN qtd_restantes = 0 THEN 'paid'
+                      WHEN EXISTS (SELECT 1 FROM tb_parcela WHERE id_emprestimo = NEW.id_emprestimo AND pago = FALSE AND vencimento < CURRENT_DATE) THEN 'in_arrears'
+                      WHEN status = 'in_arrears' THEN 'disbursed'
+                      ELSE status END
+  WHERE id_emprestimo = NEW.id_emprestimo;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Uma agregação sobre as parcelas vencidas (índice parcial) em vez de um
+-- EXISTS correlacionado por empréstimo
+CREATE OR REPLACE VIEW vw_emprestimos_em_atraso AS
+SELECT e.*, c.id_usuario, a.parcelas_vencidas, a.valor_vencido_cents, a.primeiro_vencimento
+FROM (
+  SELECT id_emprestimo, COUNT(*) AS parcelas_vencidas, SUM(valor_cents) AS valor_vencido_cents,
+         MIN(vencimento) AS primeiro_vencimento
+  FROM tb_parcela
+  WHERE pago = FALSE AND vencimento < CURRENT_DATE
+  GROUP BY id_emprestimo
+) a
+JOIN tb_emprestimo e ON e.id_emprestimo = a.id_emprestimo
+JOIN tb_conta c ON c.id_conta = e.id_conta;
+
+SELECT * FROM fn_atualizar_atrasos();
@@ -0,0 +1,38 @@
+-- 17-notificacoes-movimento.sql — aviso por conta a cada movimento, para o
+-- cache de ETag do /me/dashboard (e quem mais escutar finpay_mov).
+-- Payload: id_conta. Avisos iguais na mesma transação são unificados pelo
+-- Postgres (um lote de mil transferências gera um aviso por conta).
+
+CREATE OR REPLACE FUNCTION fn_notificar_movimento() RETURNS trigger AS $$
+BEGIN
+  IF TG_TABLE_NAME = 'tb_transacao' THEN
+    IF NEW.id_conta_de IS NOT NULL THEN
+      PERFORM pg_notify('finpay_mov', NEW.id_conta_de::text);
+    END IF;
+    IF NEW.id_conta_para IS NOT NULL THEN
+      PERFORM pg_notify('finpay_mov', NEW.id_conta_para::text);
+    END IF;
+  ELSIF TG_TABLE_NAME = 'tb_emprestimo' THEN
+    PERFORM pg_notify('finpay_mov', NEW.id_conta::text);
+  ELSE
+    PERFORM pg_notify('finpay_mov', e.id_conta::text)
+    FROM tb_emprestimo e WHERE e.id_emprestimo = NEW.id_emprestimo;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificar_movimento ON tb_transacao;
+CREATE TRIGGER trg_notificar_movimento
+AFTER INSERT OR UPDATE OF status, valor_cents ON tb_transacao
+FOR EACH ROW EXECUTE FUNCTION fn_notificar_movimento();
+
+DROP TRIGGER IF EXISTS trg_notificar_movimento ON tb_emprestimo;
+CREATE TRIGGER trg_notificar_movimento
+AFTER INSERT OR UPDATE ON tb_emprestimo
+FOR EACH ROW EXECUTE FUNCTION fn_notificar_movimento();
+
+DROP TRIGGER IF EXISTS trg_notificar_movimento ON tb_parcela;
+CREATE TRIGGER trg_notificar_movimento
+AFTER UPDATE OF pago, valor_cents, vencimento ON tb_parcela
+FOR EACH ROW EXECUTE FUNCTION fn_notificar_movimento();
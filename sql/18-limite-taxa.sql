@@ -0,0 +1,49 @@
+-- 18-limite-taxa.sql — token bucket compartilhado entre workers, usado pela
+-- API com RATE_LIMIT_BACKEND=postgres. UNLOGGED: contador perdido num crash
+-- só zera os limites, e não vale o custo de WAL a cada requisição.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS tb_limite_taxa (
+  chave             TEXT PRIMARY KEY,
+  fichas            DOUBLE PRECISION NOT NULL,
+  atualizado_em     TIMESTAMPTZ NOT NULL
+);
+
+-- limpeza dos baldes ociosos
+CREATE INDEX IF NOT EXISTS idx_limite_taxa_atualizado ON tb_limite_taxa (atualizado_em);
+
+-- Tira uma ficha do balde de p_chave. Devolve 0 se liberou; senão os
+-- segundos até a próxima ficha (o pedido negado não consome nada).
+CREATE OR REPLACE FUNCTION fn_limite_taxa(p_chave TEXT, p_taxa DOUBLE PRECISION, p_rajada DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION AS $$
+DECLARE
+  v_agora  TIMESTAMPTZ := clock_timestamp();
+  v_fichas DOUBLE PRECISION;
+BEGIN
+  LOOP
+    SELECT LEAST(p_rajada, fichas + EXTRACT(EPOCH FROM v_agora - atualizado_em) * p_taxa)
+      INTO v_fichas
+    FROM tb_limite_taxa
+    WHERE chave = p_chave
+    FOR UPDATE;
+
+    IF FOUND THEN
+      EXIT;
+    END IF;
+
+    INSERT INTO tb_limite_taxa (chave, fichas, atualizado_em)
+    VALUES (p_chave, p_rajada - 1, v_agora)
+    ON CONFLICT (chave) DO NOTHING;
+    IF FOUND THEN
+      RETURN 0;
+    END IF;
+    -- outro worker criou o balde entre o SELECT e o INSERT: lê de novo
+  END LOOP;
+
+  IF v_fichas >= 1 THEN
+    UPDATE tb_limite_taxa SET fichas = v_fichas - 1, atualizado_em = v_agora WHERE chave = p_chave;
+    RETURN 0;
+  END IF;
+  UPDATE tb_limite_taxa SET fichas = v_fichas, atualizado_em = v_agora WHERE chave = p_chave;
+  RETURN (1 - v_fichas) / p_taxa;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,97 @@
+-- 19-faturamento-pendente.sql — o gatilho de faturamento deixa de fazer
+-- UPSERT na linha (id_comerciante, mes) a cada pagamento confirmado: com
+-- ela, pagamentos simultâneos para o mesmo comerciante entravam em fila no
+-- lock dessa linha. Como os créditos de contas quentes (sql/13), cada
+-- pagamento vira uma linha em tb_faturamento_pendente (só INSERT) e a API
+-- consolida os pendentes a cada FATURAMENTO_FOLD_INTERVAL segundos.
+-- A view soma agregado + pendentes, então o relatório não fica defasado.
+
+CREATE TABLE IF NOT EXISTS tb_faturamento_pendente (
+  id                BIGSERIAL PRIMARY KEY,
+  id_comerciante    BIGINT NOT NULL,
+  mes               DATE NOT NULL,
+  total_cents       BIGINT NOT NULL,
+  qtde              BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_faturamento_pendente_comerciante
+  ON tb_faturamento_pendente (id_comerciante, mes);
+
+CREATE OR REPLACE FUNCTION fn_faturamento_aplica(p_comerciante BIGINT, p_criado_em TIMESTAMP, p_valor BIGINT, p_qtde INT)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO tb_faturamento_pendente (id_comerciante, mes, total_cents, qtde)
+  VALUES (p_comerciante, date_trunc('month', p_criado_em)::date, p_valor, p_qtde);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move os pendentes para tb_faturamento_mensal, um UPSERT por
+-- (comerciante, mês) por rodada. Retorna quantas linhas pendentes consumiu.
+CREATE OR REPLACE FUNCTION fn_consolidar_faturamento()
+RETURNS BIGINT AS $$
+DECLARE
+  v_linhas BIGINT;
+BEGIN
+  WITH movidos AS (
+    DELETE FROM tb_faturamento_pendente RETURNING id_comerciante, mes, total_cents, qtde
+  ), somados AS (
+    SELECT id_comerciante, mes, SUM(total_cents) AS total_cents, SUM(qtde) AS qtde, COUNT(*) AS linhas
+    FROM movidos
+    GROUP BY id_comerciante, mes
+  ), aplicados AS (
+    INSERT INTO tb_faturamento_mensal AS f (id_comerciante, mes, total_cents, qtde)
+    SELECT id_comerciante, mes, total_cents, qtde FROM somados
+    ORDER BY id_comerciante, mes
+    ON CONFLICT (id_comerciante, mes) DO UPDATE
+      SET total_cents = f.total_cents + EXCLUDED.total_cents,
+          qtde        = f.qtde + EXCLUDED.qtde
+  )
+  SELECT coalesce(SUM(linhas), 0) INTO v_linhas FROM somados;
+  RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A reconstrução lê o razão inteiro do período: os pendentes do período
+-- já estão contados nele e saem junto.
+CREATE OR REPLACE FUNCTION fn_rebuild_faturamento_mensal(p_de DATE DEFAULT NULL, p_ate DATE DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+  v_linhas BIGINT;
+BEGIN
+  LOCK TABLE tb_transacao IN SHARE MODE;
+
+  DELETE FROM tb_faturamento_pendente
+  WHERE (p_de IS NULL OR mes >= p_de) AND (p_ate IS NULL OR mes < p_ate);
+  DELETE FROM tb_faturamento_mensal
+  WHERE (p_de IS NULL OR mes >= p_de) AND (p_ate IS NULL OR mes < p_ate);
+
+  INSERT INTO tb_faturamento_mensal (id_comerciante, mes, total_cents, qtde)
+  SELECT t.id_comerciante, date_trunc('month', t.criado_em)::date, SUM(t.valor_cents), COUNT(*)
+  FROM tb_transacao t
+  WHERE t.tipo = 'payment' AND t.status = 'confirmed' AND t.id_comerciante IS NOT NULL
+    AND (p_de IS NULL OR t.criado_em >= p_de)
+    AND (p_ate IS NULL OR t.criado_em < p_ate)
+  GROUP BY t.id_comerciante, date_trunc('month', t.criado_em);
+
+  GET DIAGNOSTICS v_linhas = ROW_COUNT;
+  RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mesmas colunas e tipos de antes; pendentes somados por (comerciante, mês).
+CREATE OR REPLACE VIEW vw_faturamento_mensal AS
+SELECT
+  f.id_comerciante,
+  m.nome_fantasia,
+  f.mes,
+  SUM(f.total_cents)::numeric AS total_cents,
+  SUM(f.qtde)::bigint AS qtde
+FROM (
+  SELECT id_comerciante, mes, total_cents, qtde FROM tb_faturamento_mensal
+  UNION ALL
+  SELECT id_comerciante, mes, total_cents, qtde FROM tb_faturamento_pendente
+) f
+JOIN tb_comerciante m ON m.id_comerciante = f.id_comerciante
+GROUP BY f.id_comerciante, m.nome_fantasia, f.mes;
+
+GRANT SELECT ON tb_faturamento_pendente TO finpay_auditor;
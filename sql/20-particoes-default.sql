@@ -0,0 +1,78 @@
+-- 20-particoes-default.sql — fn_criar_particoes_mensais passa a tirar da
+-- partição default as linhas do mês antes de criar a partição dele. Antes,
+-- se a partição do mês faltou (criar-particoes não rodou a tempo) e linhas
+-- caíram na default, o CREATE ... PARTITION OF falhava com "updated
+-- partition constraint for default partition would be violated".
+--
+-- As linhas mudam de partição sem disparar os gatilhos (saldo, auditoria,
+-- faturamento já refletem essas linhas): session_replication_role = replica
+-- só durante a função, o que exige superusuário (ou SET concedido nesse
+-- parâmetro). A default fica travada contra escrita até o fim da transação.
+
+CREATE OR REPLACE FUNCTION fn_criar_particoes_mensais(p_tabela TEXT, p_de DATE, p_ate DATE)
+RETURNS INT AS $$
+DECLARE
+  v_mes DATE;
+  v_nome TEXT;
+  v_criadas INT := 0;
+  v_default REGCLASS;
+  v_coluna TEXT;
+  v_papel TEXT;
+  v_movidas BIGINT;
+  v_tem_linhas BOOLEAN;
+BEGIN
+  SELECT c.oid::regclass INTO v_default
+  FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+  WHERE i.inhparent = p_tabela::regclass AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT';
+
+  SELECT a.attname INTO v_coluna
+  FROM pg_partitioned_table pt
+  JOIN pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+  WHERE pt.partrelid = p_tabela::regclass;
+
+  FOR v_mes IN
+    SELECT generate_series(date_trunc('month', p_de), date_trunc('month', p_ate), interval '1 month')::date
+  LOOP
+    v_nome := p_tabela || '_p' || to_char(v_mes, 'YYYYMM');
+    IF to_regclass(v_nome) IS NOT NULL THEN
+      CONTINUE;
+    END IF;
+
+    v_movidas := 0;
+    IF v_default IS NOT NULL THEN
+      EXECUTE format('LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE', v_default);
+      EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE %I >= %L AND %I < %L)',
+                     v_default, v_coluna, v_mes, v_coluna, (v_mes + interval '1 month')::date)
+        INTO v_tem_linhas;
+      IF v_tem_linhas THEN
+        EXECUTE format(
+          'CREATE TEMP TABLE tmp_particao_default ON COMMIT DROP AS SELECT * FROM %s WHERE %I >= %L AND %I < %L',
+          v_default, v_coluna, v_mes, v_coluna, (v_mes + interval '1 month')::date
+        );
+        GET DIAGNOSTICS v_movidas = ROW_COUNT;
+      END IF;
+    END IF;
+
+    IF v_movidas > 0 THEN
+      v_papel := current_setting('session_replication_role');
+      PERFORM set_config('session_replication_role', 'replica', true);
+      EXECUTE format('DELETE FROM %s WHERE %I >= %L AND %I < %L',
+                     v_default, v_coluna, v_mes, v_coluna, (v_mes + interval '1 month')::date);
+    END IF;
+
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+      v_nome, p_tabela, v_mes, (v_mes + interval '1 month')::date
+    );
+    v_criadas := v_criadas + 1;
+
+    IF v_movidas > 0 THEN
+      EXECUTE format('INSERT INTO %I SELECT * FROM tmp_particao_default', p_tabela);
+      PERFORM set_config('session_replication_role', v_papel, true);
+      DROP TABLE tmp_particao_default;
+      RAISE NOTICE '%: % linhas movidas da partição default', v_nome, v_movidas;
+    END IF;
+  END LOOP;
+  RETURN v_criadas;
+END;
+$$ LANGUAGE plpgsql;
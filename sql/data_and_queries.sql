@@ -53,11 +53,17 @@ SELECT b.id_emprestimo, n, (b.iniciado_em + make_interval(months => n))::date, (
 FROM base b, LATERAL generate_series(1, b.prazo_meses) n;
 
 -- Transações
+-- Sorteio por índice em arrays carregados uma vez (em vez de
+-- ORDER BY random() LIMIT 1 por linha, que ordena a tabela inteira)
+WITH ids AS (
+  SELECT (SELECT array_agg(id_conta) FROM tb_conta) AS contas,
+         (SELECT array_agg(id_comerciante) FROM tb_comerciante) AS comerciantes
+)
 INSERT INTO tb_transacao (id_conta_de, id_conta_para, id_comerciante, tipo, valor_cents, status, referencia, criado_em, confirmado_em)
 SELECT
-  CASE WHEN t % 4 IN (0,1) THEN c1.id_conta ELSE NULL END,
-  CASE WHEN t % 4 = 1 THEN c2.id_conta ELSE NULL END,
-  CASE WHEN t % 4 = 0 THEN m.id_comerciante ELSE NULL END,
+  CASE WHEN t % 4 IN (0,1) THEN ids.contas[1 + floor(random() * cardinality(ids.contas))::int] ELSE NULL END,
+  CASE WHEN t % 4 = 1 THEN ids.contas[1 + floor(random() * cardinality(ids.contas))::int] ELSE NULL END,
+  CASE WHEN t % 4 = 0 THEN ids.comerciantes[1 + floor(random() * cardinality(ids.comerciantes))::int] ELSE NULL END,
   CASE WHEN t % 4 = 0 THEN 'payment'
        WHEN t % 4 = 1 THEN 'transfer'
        WHEN t % 4 = 2 THEN 'deposit'
@@ -68,9 +74,7 @@ SELECT
   now() - (t || ' hours')::interval,
   CASE WHEN t % 10 = 0 THEN NULL ELSE now() - ((t-1) || ' hours')::interval END
 FROM generate_series(1,120) t
-CROSS JOIN LATERAL (SELECT c.id_conta FROM tb_conta c ORDER BY random() LIMIT 1) c1
-CROSS JOIN LATERAL (SELECT c.id_conta FROM tb_conta c ORDER BY random() LIMIT 1) c2
-CROSS JOIN LATERAL (SELECT m.id_comerciante FROM tb_comerciante m ORDER BY random() LIMIT 1) m;
+CROSS JOIN ids;
 
 -- Views
 CREATE OR REPLACE VIEW vw_contas_saldo AS